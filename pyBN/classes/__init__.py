@@ -1,4 +1,5 @@
 from pyBN.classes.bayesnet import BayesNet
+from pyBN.classes.compiledbayesnet import CompiledBayesNet
 from pyBN.classes.cliquetree import CliqueTree, Clique
 from pyBN.classes.clustergraph import ClusterGraph
 from pyBN.classes.empiricaldistribution import EmpiricalDistribution
@@ -34,6 +34,7 @@ assertDictEqual(a, b)	dicts
 __author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
 
 import unittest
+import numpy as np
 from pyBN.classes.bayesnet import BayesNet
 from pyBN.readwrite.read import read_bn
 
@@ -133,6 +134,71 @@ class BayesNetTestCase(unittest.TestCase):
 
 	def test_values_idx(self):
 		self.assertEqual(self.bn_bn.values('Alarm')[1],'Yes')
+		self.assertEqual(self.bn_bn.value_idx('Alarm','Yes'),1)
+		self.assertRaises(KeyError, self.bn_bn.value_idx, 'Alarm', 'Maybe')
+
+	def test_cpt_indices(self):
+		self.assertListEqual(list(self.bn_bn.cpt_indices('Alarm',
+			{'Burglary':'Yes'})),[4,5,6,7])
+		self.assertListEqual(list(self.bn_bn.cpt_indices('Alarm',
+			{'Alarm':['No','Yes'],'Earthquake':['Yes','Yes'],
+			'Burglary':['Yes','No']})),[6,3])
+
+	def test_edit_topsort(self):
+		bn = BayesNet()
+		for rv in ['a','b','c']:
+			bn.add_node(rv)
+		bn.add_edge('c','b')
+		bn.add_edge('b','a')
+		self.assertListEqual(bn.V,['c','b','a'])
+		self.assertSetEqual(bn.ancestors('a'),set(['b','c']))
+		self.assertTrue(bn.would_cause_cycle('a','c'))
+		self.assertFalse(bn.would_cause_cycle('c','a'))
+		self.assertFalse(bn.would_cause_cycle('a','b',reverse=True))
+		self.assertRaises(ValueError, bn.add_edge, 'a', 'c')
+		bn.add_edge('c','a')
+		self.assertTrue(bn.would_cause_cycle('a','c',reverse=True))
+		bn.remove_edge('b','a')
+		self.assertSetEqual(bn.ancestors('a'),set(['c']))
+
+	def test_compile(self):
+		cbn = self.bn_bn.compile()
+		self.assertListEqual(list(cbn.cards),[2,2,2,2,2])
+		self.assertListEqual(list(cbn.offsets),[0,2,4,12,16,20])
+		self.assertListEqual(list(cbn.parent_ids(2)),[1,0])
+		self.assertListEqual(list(cbn.child_ids(2)),[3,4])
+		for rv in self.bn_bn.nodes():
+			self.assertListEqual(list(cbn.cpt(rv)),list(self.bn_bn.cpt(rv)))
+			self.assertListEqual(cbn.scope(rv),self.bn_bn.scope(rv))
+			for p in self.bn_bn.parents(rv):
+				self.assertEqual(cbn.stride(rv,p),self.bn_bn.stride(rv,p))
+		self.assertEqual(cbn.value_idx('Alarm','Yes'),1)
+		self.assertRaises(KeyError, cbn.value_idx, 'Alarm', 'Maybe')
+
+	def test_compile_family_indices(self):
+		cbn = self.bn_bn.compile()
+		idx = cbn.family_indices([[0,1,1,0,1]])
+		self.assertListEqual(list(cbn.params[idx[0]]),
+			[0.999, 0.002, 0.29, 0.1, 0.7])
+
+	def test_compile_sample(self):
+		cbn = self.bn_bn.compile()
+		cum = cbn.cum_params()[2]
+		self.assertAlmostEqual(cum[-2],3.05)
+		self.assertEqual(cum[-1],4.)
+		np.random.seed(3636)
+		data = cbn.sample(200000)
+		self.assertEqual(data.shape,(200000,5))
+		configs = np.array([[(k >> i) & 1 for i in range(5)] for k in range(32)])
+		p = np.exp(cbn.log_prob(configs))
+		for i in range(5):
+			self.assertAlmostEqual(np.mean(data[:,i]),
+				np.sum(p[configs[:,i]==1]),places=2)
+
+	def test_log_prob(self):
+		lp = self.bn_bn.log_prob(np.array([[0,1,1,0,1],[0,0,0,0,0]]))
+		self.assertAlmostEqual(lp[0],np.log(0.999*0.002*0.29*0.1*0.7))
+		self.assertAlmostEqual(lp[1],np.log(0.999*0.998*0.999*0.95*0.99))
 
 if __name__ == '__main__':
 	unittest.main(exit=False)
@@ -35,6 +35,7 @@ __author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
 
 import unittest
 import os
+from copy import deepcopy
 from os.path import dirname
 import numpy as np
 
@@ -88,6 +89,25 @@ class FactorTestCase(unittest.TestCase):
 		f3.multiply_factor(f4)
 
 		self.assertListEqual(list(f1.cpt),list(f3.cpt))
+
+	def test_multiply_factor_values(self):
+		f1 = Factor(self.bn,'Alarm')
+		f2 = Factor(self.bn,'Burglary')
+		f1.multiply_factor(f2)
+		self.assertDictEqual(f1.stride,
+			{'Alarm':1, 'Earthquake':2, 'Burglary':4})
+		self.assertTrue(np.allclose(f1.cpt,
+			[0.999*0.999, 0.001*0.999, 0.71*0.999, 0.29*0.999,
+			 0.06*0.001, 0.94*0.001, 0.05*0.001, 0.95*0.001]))
+
+	def test_multiply_factor_new_var(self):
+		f1 = Factor(self.bn,'JohnCalls')
+		f2 = Factor(self.bn,'MaryCalls')
+		f1.multiply_factor(f2)
+		self.assertSetEqual(set(f1.scope),
+			set(['JohnCalls','MaryCalls','Alarm']))
+		self.assertEqual(len(f1.cpt),8)
+		self.assertAlmostEqual(f1.cpt[f1.stride['MaryCalls']],0.95*0.01)
 	
 	def test_sumover_var(self):
 		self.f.sumover_var('Burglary')
@@ -100,6 +120,16 @@ class FactorTestCase(unittest.TestCase):
 		self.assertDictEqual(f.stride,{'Alarm':1})
 		self.assertListEqual(list(f.cpt),[0.45475,0.54525])
 
+	def test_sumout_var_list_matches_sumout_var(self):
+		f1 = Factor(self.bn,'Alarm')
+		f1.sumout_var_list(['Alarm','Burglary'])
+		f2 = Factor(self.bn,'Alarm')
+		f2.sumout_var('Alarm')
+		f2.sumout_var('Burglary')
+		self.assertListEqual(f1.scope,f2.scope)
+		self.assertDictEqual(f1.stride,f2.stride)
+		self.assertTrue(np.allclose(f1.cpt,f2.cpt))
+
 	def test_sumout_var(self):
 		f = Factor(self.bn,'Alarm')
 		f.sumout_var('Earthquake')
@@ -134,6 +164,23 @@ class FactorTestCase(unittest.TestCase):
 		self.assertListEqual(list(f.cpt),
 			[ 0.06,  0.94,  0.05,  0.95])
 
+	def test_observe_var(self):
+		f = Factor(self.bn, 'Alarm')
+		f.observe_var('Burglary','Yes')
+		self.assertListEqual(list(f.cpt),
+			[ 0.,  0.,  0.,  0.,  0.06,  0.94,  0.05,  0.95])
+		self.assertListEqual(f.scope,self.f.scope)
+
+	def test_reduce_factor_batch(self):
+		f = Factor(self.bn, 'Alarm')
+		f.reduce_factor('Burglary',['No','Yes','Yes'])
+		self.assertEqual(f.batch,3)
+		self.assertEqual(f.cpt.shape,(3,4))
+		self.assertListEqual(list(f.cpt[1]),
+			[ 0.06,  0.94,  0.05,  0.95])
+		f.sumout_var('Earthquake')
+		self.assertEqual(f.cpt.shape,(3,2))
+
 	def test_to_log(self):
 		f = Factor(self.bn,'Earthquake')
 		f.to_log()
@@ -145,6 +192,68 @@ class FactorTestCase(unittest.TestCase):
 		f.from_log()
 		self.assertListEqual(list(f.cpt),[0.998,0.002])
 
+	def test_log_operations(self):
+		f1 = Factor(self.bn,'Alarm')
+		f1.multiply_factor(Factor(self.bn,'Burglary'))
+		f1.sumout_var('Burglary')
+		f2 = Factor(self.bn,'Alarm')
+		f2.to_log(decimals=None)
+		f3 = Factor(self.bn,'Burglary')
+		f3.to_log(decimals=None)
+		f2.multiply_factor(f3)
+		f2.sumout_var('Burglary')
+		self.assertTrue(f2.is_log)
+		f2.from_log(decimals=None)
+		self.assertTrue(np.allclose(f1.cpt,f2.cpt))
+
+	def test_normalize_zero_row(self):
+		f = Factor(self.bn,'Alarm')
+		f.cpt[0] = 0
+		f.cpt[1] = 0
+		f.normalize()
+		self.assertListEqual(list(f.cpt[0:2]),[0.,0.])
+		self.assertFalse(np.any(np.isnan(f.cpt)))
+
+	def test_sparse_operations(self):
+		f1 = Factor(self.bn,'Alarm')
+		f1.sparse_min_size = 1
+		f1.sparse_threshold = 0.6
+		f1.cpt[0:4] = 0
+		f1.to_sparse()
+		self.assertTrue(f1.is_sparse)
+		self.assertEqual(f1.nnz(),4)
+		f1.multiply_factor(Factor(self.bn,'Burglary'))
+		self.assertTrue(f1.is_sparse)
+		f1.sumout_var('Earthquake')
+		f2 = Factor(self.bn,'Alarm')
+		f2.cpt[0:4] = 0
+		f2.multiply_factor(Factor(self.bn,'Burglary'))
+		f2.sumout_var('Earthquake')
+		self.assertFalse(f2.is_sparse)
+		self.assertDictEqual(f1.stride,f2.stride)
+		self.assertTrue(np.allclose(f1.cpt,f2.cpt))
+		self.assertFalse(f1.is_sparse)
+
+	def test_copy_on_write(self):
+		f = self.f.copy()
+		self.assertIs(f._cpt,self.f._cpt)
+		f.reduce_factor('Burglary','Yes')
+		self.assertEqual(len(self.f.cpt),8)
+		g = self.f.copy()
+		g.cpt[0] = 0
+		self.assertEqual(self.f.cpt[0],0.999)
+		g.scope.append('x')
+		g.card['x'] = 2
+		self.assertNotIn('x',self.f.scope)
+		self.assertNotIn('x',self.f.card)
+
+	def test_deepcopy(self):
+		f = deepcopy(self.f)
+		self.assertIsNot(f.bn,self.f.bn)
+		self.assertIsNot(f._cpt,self.f._cpt)
+		f.bn.F['Alarm']['cpt'][0] = 0
+		self.assertEqual(self.bn.cpt('Alarm')[0],0.999)
+
 	def test_normalize(self):
 		self.f.cpt[0]=20
 		self.f.cpt[1]=20
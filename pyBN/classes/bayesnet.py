@@ -101,15 +101,40 @@ class BayesNet(object):
         """
         return hash((str(self.V),str(self.E)))
 
+    def compile(self):
+        """
+        Return a frozen, integer-indexed CompiledBayesNet
+        version of this network for fast inference, sampling
+        and learning loops. See "compiledbayesnet.py".
+        """
+        from pyBN.classes.compiledbayesnet import CompiledBayesNet
+        return CompiledBayesNet(self)
+
+    def log_prob(self, data):
+        """
+        Joint log-probability of each row of an integer-coded
+        (N x n) numpy array, with columns in bn.nodes() order
+        and entries = value indices. Returns a length-N array.
+
+        This compiles the network on every call - when scoring
+        many batches, call bn.compile() once and use its
+        log_prob() instead.
+        """
+        return self.compile().log_prob(data)
+
     def copy(self):
-        V = deepcopy(self.V)
-        E = deepcopy(self.E)
+        """
+        Return a copy of the network. Every list is copied, so
+        changing one network never changes the other.
+        """
+        V = list(self.V)
+        E = dict([(rv, list(children)) for rv, children in self.E.items()])
         F = {}
         for v in V:
             F[v] = {}
-            F[v]['cpt'] = deepcopy(self.F[v]['cpt'])
-            F[v]['parents'] = deepcopy(self.F[v]['parents'])
-            F[v]['values'] = deepcopy(self.F[v]['values'])
+            F[v]['cpt'] = copy(self.F[v]['cpt'])
+            F[v]['parents'] = list(self.F[v]['parents'])
+            F[v]['values'] = list(self.F[v]['values'])
         bn = BayesNet()
         bn.V = V
         bn.E = E
@@ -119,7 +144,11 @@ class BayesNet(object):
 
     def add_node(self, rv, cpt=[], parents=[], values=[]):
         self.V.append(rv)
-        self.F[rv] = {'cpt':cpt,'parents':parents,'values':values}
+        self.E.setdefault(rv, [])
+        self.F[rv] = {'cpt':list(cpt),'parents':list(parents),
+                        'values':list(values)}
+        if getattr(self, '_anc_E', None) is self.E:
+            self._anc[rv] = set()
 
     def add_edge(self, u, v):
         if not self.has_node(u):
@@ -129,20 +158,100 @@ class BayesNet(object):
         if self.has_edge(u,v):
             print('Edge already exists')
         else:
+            if self.would_cause_cycle(u,v):
+                raise ValueError('Edge would create a directed cycle.')
+            anc = self._ancestor_index()
+            # keep self.V in topsort order - only the block of
+            # nodes between v and u can be out of order, and moving
+            # v and its descendants in that block behind the rest
+            # of the block fixes it
+            pos = self._index_map(None, self.V)
+            i, j = pos[v], pos[u]
+            if i < j:
+                block = self.V[i:j+1]
+                desc = [w for w in block if w==v or v in anc[w]]
+                rest = [w for w in block if w!=v and v not in anc[w]]
+                self.V = self.V[:i] + rest + desc + self.V[j+1:]
             self.E[u].append(v)
             self.F[v]['parents'].append(u)
-        #self.V = topsort(self.E)
+            # v and all its descendants gain u's ancestors
+            new_anc = anc[u] | set([u])
+            for w in self.descendants(v) | set([v]):
+                anc[w] |= new_anc
         # HOW DO I RECALCULATE CPT?
 
-
     def remove_edge(self, u, v):
+        desc = self.descendants(v)
         self.E[u].remove(v)
         self.F[v]['parents'].remove(u)
+        # recompute ancestors of v and its descendants, in topsort order
+        anc = self._ancestor_index()
+        for w in self.nodes():
+            if w==v or w in desc:
+                anc[w] = set(self.parents(w))
+                for p in self.parents(w):
+                    anc[w] |= anc[p]
 
     def reverse_arc(self, u, v):
         if self.has_edge(u,v):
-            self.E[u].remove(v)
-            self.E[v].append(u)
+            self.remove_edge(u,v)
+            self.add_edge(v,u)
+
+    def _ancestor_index(self):
+        """
+        Return a dict where key = rv and value = set of rv's
+        ancestors. The index is kept up to date by add_node,
+        add_edge, remove_edge and reverse_arc - it is rebuilt
+        (and self.V put back in topsort order, if needed) the
+        first time it is used, or after self.E is replaced.
+        """
+        if getattr(self, '_anc_E', None) is not self.E:
+            pos = self._index_map(None, self.V)
+            if any([pos[u] > pos[v] for u,v in self.edges()]):
+                self.V = topsort(self.E)
+            parents = dict([(rv,[]) for rv in self.nodes()])
+            for u,v in self.edges():
+                parents[v].append(u)
+            self._anc = {}
+            for rv in self.nodes():
+                self._anc[rv] = set(parents[rv])
+                for p in parents[rv]:
+                    self._anc[rv] |= self._anc[p]
+            self._anc_E = self.E
+        return self._anc
+
+    def ancestors(self, rv):
+        return self._ancestor_index()[rv]
+
+    def descendants(self, rv):
+        """
+        Set of rv's descendants - found by a search over
+        the children of rv, so this costs O(#descendants).
+        """
+        desc = set()
+        stack = list(self.children(rv))
+        while stack:
+            w = stack.pop()
+            if w not in desc:
+                desc.add(w)
+                stack.extend(self.children(w))
+        return desc
+
+    def would_cause_cycle(self, u, v, reverse=False):
+        """
+        Test if adding the edge u -> v (or, if *reverse*,
+        reversing the existing edge v -> u) would create a
+        directed cycle. Adding is an O(1) ancestor lookup,
+        reversing is O(#parents of u).
+        """
+        anc = self._ancestor_index()
+        if u == v:
+            return True
+        if not reverse:
+            return v in anc[u]
+        # v -> u reversed creates a cycle iff some other
+        # path v ~> u exists - i.e. through another parent of u
+        return any([p!=v and v in anc[p] for p in self.parents(u)])
 
     def set_data(self, rv, data):
         assert (isinstance(data, dict)), 'data must be dictionary'
@@ -161,11 +270,26 @@ class BayesNet(object):
         for v in self.V:
             yield v
 
-    def node_idx(self, rv):
+    def _index_map(self, key, items):
+        """
+        Return a cached dict of item -> position in the
+        list *items*. The cache entry for *key* is rebuilt
+        whenever *items* is replaced by another list or
+        changes length - so set_values(), set_parents() and
+        direct assignment to bn.F all keep it valid.
+        """
         try:
-            return self.V.index(rv)
-        except ValueError:
-            return -1
+            cache = self._idx_maps
+        except AttributeError:
+            cache = self._idx_maps = {}
+        m = cache.get(key)
+        if m is None or m[0] is not items or len(m[1]) != len(items):
+            m = (items, dict([(v,i) for i,v in enumerate(items)]))
+            cache[key] = m
+        return m[1]
+
+    def node_idx(self, rv):
+        return self._index_map(None, self.V).get(rv, -1)
 
     def has_node(self, rv):
         return rv in self.V
@@ -219,20 +343,31 @@ class BayesNet(object):
         return self.F[rv]['values']
 
     def value_idx(self, rv, val):
-        try:   
-            return self.F[rv]['values'].index(val)
-        except ValueError:
-            print("Value Index Error")
-            return -1
+        """
+        Index of *val* in bn.values(rv). Raises a KeyError
+        for values not in bn.values(rv).
+        """
+        return self._index_map(('values',rv), self.values(rv))[val]
+
+    def value_indices(self, rv, vals):
+        """
+        Vectorized value_idx - map an array of values of *rv*
+        to a numpy integer array of their value indices.
+        Raises a KeyError for values not in bn.values(rv).
+        """
+        vmap = self._index_map(('values',rv), self.values(rv))
+        uniq, inv = np.unique(np.asarray(vals), return_inverse=True)
+        return np.array([vmap[v] for v in uniq], dtype=np.int64)[inv]
 
     def stride(self, rv, n):
         if n==rv:
             return 1
         else:
-            card_list = [self.card(rv)]
-            card_list.extend([self.card(p) for p in self.parents(rv)])
-            n_idx = self.parents(rv).index(n) + 1
-            return int(np.prod(card_list[0:n_idx]))
+            k = self._index_map(('parents',rv), self.parents(rv))[n]
+            s = self.card(rv)
+            for p in self.parents(rv)[:k]:
+                s *= self.card(p)
+            return s
 
     def flat_cpt(self, by_var=False, by_parents=False):
         """
@@ -249,14 +384,15 @@ class BayesNet(object):
 
     def cpt_indices(self, target, val_dict):
         """
-        Get the index of the CPT which corresponds
-        to a dictionary of rv=val sets. This can be
+        Get the indices of the CPT of *target* which agree
+        with a dictionary of rv=val sets. This can be
         used for parameter learning to increment the
         appropriate cpt frequency value based on
         observations in the data.
 
-        There is definitely a fast way to do this.
-            -- check if (idx - rv_stride*value_idx) % (rv_card*rv_stride) == 0
+        Indices are computed with mixed-radix arithmetic -
+        the value of rv at cpt index idx is
+        (idx // stride(target,rv)) % card(rv).
 
         Arguments
         ---------
@@ -264,26 +400,31 @@ class BayesNet(object):
             Main RV
 
         *val_dict* : a dictionary, where
-            key=rv,val=rv value
+            key=rv,val=rv value - OR - key=rv,
+            val=array of rv values (one per observation).
+            In the array case, every rv in the scope
+            of *target* must be given.
+
+        Returns
+        -------
+        *idx* : a numpy integer array - either all cpt
+            indices which agree with *val_dict*, or (array
+            case) the single cpt index of each observation.
 
         """
-        stride = dict([(n,self.stride(target,n)) for n in self.scope(target)])
-        #if len(val_dict)==len(self.parents(target)):
-        #    idx = sum([self.value_idx(rv,val)*stride[rv] \
-        #            for rv,val in val_dict.items()])
-        #else:
-        card = dict([(n, self.card(n)) for n in self.scope(target)])
-        idx = set(range(len(self.cpt(target))))
+        if any([np.ndim(val) > 0 for val in val_dict.values()]):
+            assert (set(val_dict) == set(self.scope(target))), \
+                'Must give values for every rv in the scope.'
+            idx = 0
+            for rv, val in val_dict.items():
+                idx = idx + self.value_indices(rv,np.atleast_1d(val)) * \
+                    self.stride(target,rv)
+            return idx
+        idx = np.arange(len(self.cpt(target)))
         for rv, val in val_dict.items():
-            val_idx = self.value_idx(rv,val)
-            rv_idx = []
-            s_idx = val_idx*stride[rv]
-            while s_idx < len(self.cpt(target)):
-                rv_idx.extend(range(s_idx,(s_idx+stride[rv])))
-                s_idx += stride[rv]*card[rv]
-            idx = idx.intersection(set(rv_idx))
-
-        return list(idx)
+            val_idx = (idx // self.stride(target,rv)) % self.card(rv)
+            idx = idx[val_idx == self.value_idx(rv,val)]
+        return idx
 
     def cpt_str_idx(self, rv, idx):
         """
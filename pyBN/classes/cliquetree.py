@@ -35,15 +35,22 @@ __author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
 
 
 
+import hashlib
 import numpy as np
 import networkx as nx
 from copy import copy, deepcopy
+from multiprocessing.pool import ThreadPool
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 from pyBN.classes.bayesnet import BayesNet
-from pyBN.classes.factor import Factor
+from pyBN.classes.factor import Factor, _logsumexp
 from pyBN.classes.factorization import Factorization
 
 from pyBN.utils.graph import *
+from pyBN.utils.elimination_order import triangulate
 
 
 
@@ -70,9 +77,37 @@ class CliqueTree(object):
         - Cliques -> a dictionary where key = vertex idx,
                 value = Clique object
 
+    - evidence
+        - a dictionary, where key = rv and value = rv value,
+            holding the evidence currently entered in the tree
+
+    - width
+        - the treewidth of the triangulation the tree was
+            built from (the largest clique size, minus one)
+
+    - total_size
+        - the summed number of entries of every clique potential
+
+    - n_jobs
+        - the number of threads used to compute messages
+
+    Notes
+    -----
+    A CliqueTree is compiled once and then queried many times:
+    every message between two neighboring cliques is cached, and
+    "set_evidence" only throws away the messages which depend on
+    a clique whose evidence changed. "marginal" then recomputes
+    just the missing messages on the way to the target's clique.
+
+    The same compiled tree also runs max-product message passing
+    (with its own message buffers), which gives the max-marginal
+    of every rv ("max_marginal") and an MPE assignment ("mpe").
+
     """
 
-    def __init__(self, bn):
+    parallel_min_size = 16384
+
+    def __init__(self, bn, log=False, heuristic='min_fill', n_jobs=1):
         """
         Instantiate a CliqueTree object.
 
@@ -80,6 +115,23 @@ class CliqueTree(object):
         ---------
         *bn*: a BayesNet object
 
+        *log* : a boolean
+            Whether the clique potentials are kept in log space.
+
+        *heuristic* : a string, a function or a list
+            The elimination order heuristic used to triangulate
+            the moral graph (see "pyBN.utils.elimination_order"),
+            or an elimination order over every rv.
+
+        *n_jobs* : an integer
+            The number of threads used to compute messages. With
+            more than one, every message whose incoming messages
+            are ready is handed to a thread pool, so messages from
+            independent subtrees are computed at the same time.
+            NumPy releases the GIL while it multiplies and sums
+            large arrays, so this pays off on trees with large
+            cliques.
+
         Notes
         -----
         Ideally, the Factor class should be used as the
@@ -91,11 +143,16 @@ class CliqueTree(object):
         self.V = None
         self.E = None
         self.C = None
+        self.width = None
+        self.total_size = None
         ###
 
         self.bn = bn
-        self._F = Factorization(bn)
-        self.initialize_tree()
+        self.log = log
+        self._F = Factorization(bn, log=log)
+        self.evidence = {}
+        self.n_jobs = n_jobs
+        self.initialize_tree(heuristic)
 
         
 
@@ -113,11 +170,9 @@ class CliqueTree(object):
         return self.C[rv]
 
     def parents(self, v):
-        p = []
-        for rv in self.V:
-            if v in self.E[rv]:
-                p.append(v)
-        return p
+        if self._parent[v] is None:
+            return []
+        return [self._parent[v]]
 
     def children(self, n):
         return self.E[n]
@@ -128,49 +183,34 @@ class CliqueTree(object):
         clique_ordering = list(nx.dfs_postorder_nodes(tree_graph,root))
         return clique_ordering
 
-    def initialize_tree(self):
+    def initialize_tree(self, heuristic='min_fill'):
         """
         Initialize the structure of a clique tree, using
         the following steps:
             - Moralize graph (i.e. marry parents)
             - Triangulate graph (i.e. make graph chordal)
             - Get max cliques (i.e. community/clique detection)
-            - Max spanning tree over sepset cardinality (i.e. create tree)
+            - Join the cliques along the elimination order (i.e. create tree)
         
         """
-        ### MORALIZE GRAPH & MAKE IT CHORDAL ###
-        chordal_G = make_chordal(self.bn) # must return a networkx object
-        V = chordal_G.nodes()
-
-        ### GET MAX CLIQUES FROM CHORDAL GRAPH ###
+        ### MORALIZE GRAPH, MAKE IT CHORDAL & GET MAX CLIQUES ###
+        tri = triangulate(self.bn, heuristic)
+        self.width = tri['width']
+        self.total_size = tri['total_size']
         C = {} # key = vertex, value = clique object
-        max_cliques = reversed(list(nx.chordal_graph_cliques(chordal_G)))
-        for v_idx,clique in enumerate(max_cliques):
+        for v_idx,clique in enumerate(tri['cliques']):
             C[v_idx] = Clique(set(clique))
 
-        ### MAXIMUM SPANNING TREE OVER COMPLETE GRAPH TO MAKE A TREE ###
-        weighted_edge_dict = dict([(c_idx,{}) for c_idx in range(len(C))])
-        for i in range(len(C)):
-            for j in range(len(C)):
-                if i!=j:
-                    intersect_cardinality = len(C[i].sepset(C[j]))
-                    weighted_edge_dict[i][j] = -1*intersect_cardinality
-        mst_G = mst(weighted_edge_dict)
-        ### SET V,E,C ###
-        self.E = mst_G # dictionary
-        self.V = mst_G.keys() # list
+        ### JUNCTION TREE FROM THE ELIMINATION ORDER ###
         self.C = C
+        self._set_tree(dict(enumerate(tri['parents'])))
 
-        
         ### ASSIGN EACH FACTOR TO ONE CLIQUE ONLY ###
-        v_a = dict([(rv, False) for rv in self.bn.nodes()])
-        for clique in self.C.values():
-            temp_scope = []
-            for var in v_a:
-                if v_a[var] == False and set(self.bn.scope(var)).issubset(clique.scope):
-                    temp_scope.append(var)
-                    v_a[var] = True
-            clique._F = Factorization(self.bn, temp_scope)
+        scopes = dict([(i, []) for i in C])
+        for rv in self.bn.nodes():
+            scopes[tri['assignment'][rv]].append(rv)
+        for i, clique in self.C.items():
+            clique._F = Factorization(self.bn, scopes[i], log=self.log)
 
         ### COMPUTE INITIAL POTENTIAL FOR EACH FACTOR ###
         # - i.e. multiply all of its assigned factors together
@@ -179,6 +219,587 @@ class CliqueTree(object):
                 clique.is_ready = True
             clique.initialize_psi()
 
+        self.compile()
+
+    def _set_tree(self, parents):
+        """
+        Set self.V and self.E from the parent of every clique.
+        The roots of all but one connected component hang off
+        the last root (with empty sepsets) to make a single tree.
+        """
+        self._parent = dict(parents)
+        root = [i for i in self.C if self._parent[i] is None][-1]
+        for i in self.C:
+            if i != root and self._parent[i] is None:
+                self._parent[i] = root
+        self.E = dict([(i, []) for i in self.C])
+        for i in self.C:
+            if i != root:
+                self.E[self._parent[i]].append(i)
+        self.V = [root] + [i for i in self.C if i != root]
+
+    def compile(self, pot0=None):
+        """
+        Lay out every clique potential as a dense numpy array
+        whose axes are the clique's rvs in sorted order, and
+        precompute, for every directed edge (i,j) of the tree:
+            - the axes of clique i which are summed out to get
+                the message from i to j (i.e. the non-sepset axes)
+            - the shape which broadcasts that message over the
+                axes of clique j
+            - a preallocated buffer which holds the message
+
+        Since the sepset axes appear in the same (sorted) order
+        in both cliques, sending a message is a single in-place
+        np.sum over clique i, and absorbing it is a single
+        in-place broadcast multiply into clique j. Together with
+        one scratch buffer shared by every clique, repeated
+        calibrations allocate no new arrays (except in log
+        space, where summing is a log-sum-exp).
+
+        Arguments
+        ---------
+        *pot0* : a dictionary or None
+            The flat initial potential of each clique, laid out
+            as above. If None, it is computed from each clique's
+            psi0 - "load" passes the saved potentials instead.
+
+        Effects
+        -------
+        - sets the compiled arrays of the tree
+
+        """
+        ### CLIQUE LAYOUTS & POTENTIALS ###
+        self._axes = dict([(i, sorted(c.scope)) for i, c in self.C.items()])
+        self._shape = dict([(i, tuple([self.bn.card(rv) for rv in axes])) \
+            for i, axes in self._axes.items()])
+        if pot0 is None:
+            pot0 = dict([(i, np.ascontiguousarray(c.psi0._tensor(
+                self._axes[i]), dtype=np.float64).ravel()) \
+                for i, c in self.C.items()])
+        self._pot0 = pot0
+        self._pot = dict([(i, p.copy()) for i, p in pot0.items()])
+
+        ### UNDIRECTED NEIGHBORS & HOME CLIQUE OF EACH RV ###
+        self._nbrs = dict([(i, list(self.E[i])) for i in self.V])
+        for i in self.V:
+            for j in self.E[i]:
+                self._nbrs[j].append(i)
+        self._home = {}
+        for i in sorted(self.C, key=lambda i: len(self._pot0[i])):
+            for rv in self.C[i].scope:
+                self._home.setdefault(rv, i)
+
+        self._scratch = np.empty(max([len(p) for p in self._pot.values()]))
+        self._buffers = [] # scratch buffers of the pool threads
+
+        ### EDGE INDEX MAPS & MESSAGE BUFFERS ###
+        self._sum_axes = {}
+        self._bshape = {}
+        self._msg = {} # key = (i,j), value = message from clique i to j
+        self._max_msg = {} # the same, for max-product messages
+        for i in self.V:
+            for j in self._nbrs[i]:
+                sep = self.C[i].sepset(self.C[j])
+                self._sum_axes[(i,j)] = tuple([a for a, rv in \
+                    enumerate(self._axes[i]) if rv not in sep])
+                self._bshape[(i,j)] = tuple([self.bn.card(rv) if rv in sep \
+                    else 1 for rv in self._axes[j]])
+                self._msg[(i,j)] = np.empty([self.bn.card(rv) for rv in \
+                    self._axes[i] if rv in sep])
+                self._max_msg[(i,j)] = np.empty_like(self._msg[(i,j)])
+        self._valid = set() # the messages which are up to date
+        self._max_valid = set()
+        self._marginal = {}
+        self._max_marginal = {}
+
+    def set_evidence(self, evidence):
+        """
+        Replace the evidence entered in the tree.
+
+        Only the cliques whose evidence changed get a new
+        potential, and only the messages which depend on one
+        of those cliques - i.e. the messages pointing away
+        from them - are thrown away. Every other message stays
+        valid and is reused by the next query.
+
+        Arguments
+        ---------
+        *evidence* : a dictionary, where
+            key = rv and value = rv value
+
+        Returns
+        -------
+        None
+
+        Effects
+        -------
+        - sets self.evidence
+        - alters the potentials of the cliques whose evidence changed
+
+        """
+        evidence = dict(evidence)
+        changed = [rv for rv in set(evidence) | set(self.evidence) \
+            if evidence.get(rv) != self.evidence.get(rv)]
+        self.evidence = evidence
+        dirty = set([self._home[rv] for rv in changed])
+        fill = -np.inf if self.log else 0.
+        for i in dirty:
+            np.copyto(self._pot[i], self._pot0[i])
+            pot = self._pot[i].reshape(self._shape[i])
+            for rv, val in evidence.items():
+                if self._home[rv] == i:
+                    idx = [slice(None)]*len(self._axes[i])
+                    idx[self._axes[i].index(rv)] = \
+                        np.array(self.bn.values(rv)) != val
+                    pot[tuple(idx)] = fill
+        for valid in [self._valid, self._max_valid]:
+            for i in dirty:
+                # a message is already invalid if an earlier dirty clique
+                # lies behind it - and so is everything downstream of it
+                stack = [(i, j) for j in self._nbrs[i]]
+                while stack:
+                    u, w = stack.pop()
+                    if (u,w) in valid:
+                        valid.remove((u,w))
+                        stack.extend([(w,k) for k in self._nbrs[w] if k != u])
+        if len(dirty) > 0:
+            self._marginal = {}
+            self._max_marginal = {}
+
+    def calibrate(self, max_product=False):
+        """
+        Calibrate the tree - i.e. make sure every message in
+        both directions is computed - with an upward pass to
+        the root clique followed by a downward pass. Messages
+        which are still valid are not recomputed.
+
+        Arguments
+        ---------
+        *max_product* : a boolean
+            Whether to calibrate the max-product messages (which
+            "max_marginal" and "mpe" use) instead of the
+            sum-product ones. Both kinds are cached separately.
+
+        Returns
+        -------
+        *n_sent* : an integer
+            The number of messages which were (re)computed.
+
+        """
+        up, down = self._schedule(self.V[0])
+        return self._send(up + [(j,i) for i,j in reversed(up)], max_product)
+
+    def marginal(self, rv):
+        """
+        Return the marginal distribution of *rv*, given the
+        evidence in self.evidence, as a normalized Factor.
+
+        Only the messages into the smallest clique containing
+        *rv* are needed, and only the ones which are missing
+        are computed.
+
+        Arguments
+        ---------
+        *rv* : a string
+
+        Returns
+        -------
+        *marginal* : a Factor object whose scope is [rv]
+
+        """
+        if rv not in self._marginal:
+            i = self._home[rv]
+            up, _ = self._schedule(i)
+            self._send(up)
+            belief = self._absorb(i)
+            axis = self._axes[i].index(rv)
+            axes = tuple([a for a in range(len(self._axes[i])) if a != axis])
+            if self.log:
+                p = _logsumexp(belief, axis=axes)
+                p = np.exp(p - np.max(p))
+            else:
+                p = np.sum(belief, axis=axes)
+            total = np.sum(p)
+            if total > 0:
+                p = p / total
+            self._marginal[rv] = p
+        phi = Factor(self.bn, rv)
+        phi._set_tensor([rv], self._marginal[rv].copy(),
+            {rv: self.bn.card(rv)})
+        return phi
+
+    def max_marginal(self, rv):
+        """
+        Return the max-marginal of *rv*, given the evidence in
+        self.evidence, as a Factor normalized to sum to one - i.e.
+        for each value x of *rv*, the probability of the most likely
+        assignment of every other rv in which *rv* = x.
+
+        The argmax of the max-marginal is the value of *rv* in
+        an MPE assignment (if that value is unique), and the gap
+        to the other values tells how confident that choice is.
+        Once the tree is calibrated with calibrate(max_product=True),
+        the max-marginal of every rv needs no further messages.
+
+        Arguments
+        ---------
+        *rv* : a string
+
+        Returns
+        -------
+        *max_marginal* : a Factor object whose scope is [rv]
+
+        """
+        if rv not in self._max_marginal:
+            i = self._home[rv]
+            up, _ = self._schedule(i)
+            self._send(up, True)
+            belief = self._absorb(i, max_product=True)
+            axis = self._axes[i].index(rv)
+            axes = tuple([a for a in range(len(self._axes[i])) if a != axis])
+            p = np.max(belief, axis=axes)
+            if self.log:
+                p = np.exp(p - np.max(p))
+            total = np.sum(p)
+            if total > 0:
+                p = p / total
+            self._max_marginal[rv] = p
+        phi = Factor(self.bn, rv)
+        phi._set_tensor([rv], self._max_marginal[rv].copy(),
+            {rv: self.bn.card(rv)})
+        return phi
+
+    def mpe(self, prob=False):
+        """
+        Return the most probable explanation - i.e. the most
+        likely assignment of every rv - given the evidence in
+        self.evidence.
+
+        Only the upward max-product messages to the root clique
+        are needed. The root's belief then gives the assignment
+        of its rvs, and every other clique - in preorder - picks
+        the most likely assignment of its remaining rvs given
+        the rvs already assigned by its parent clique. Ties are
+        thereby broken consistently across cliques.
+
+        Arguments
+        ---------
+        *prob* : a boolean
+            Whether to also return the probability of the MPE.
+
+        Returns
+        -------
+        *assignment* : a dictionary, where key = rv and
+            value = rv value
+
+        If *prob* is True, a tuple (*max_prob*, *assignment*)
+        is returned instead, where *max_prob* is the joint
+        probability of the assignment and the evidence - or
+        its log, if the tree is kept in log space.
+
+        """
+        root = self.V[0]
+        up, down = self._schedule(root)
+        self._send(up, True)
+        parent = dict(up)
+        assignment = {}
+        max_prob = None
+        for i in [root] + [w for w, u in down]:
+            belief = self._absorb(i, parent.get(i), max_product=True)
+            if max_prob is None:
+                max_prob = float(np.max(belief))
+            axes = self._axes[i]
+            free = [rv for rv in axes if rv not in assignment]
+            if len(free) == 0:
+                continue
+            sub = belief[tuple([list(self.bn.values(rv)).index( \
+                assignment[rv]) if rv in assignment else slice(None) \
+                for rv in axes])]
+            idx = np.unravel_index(np.argmax(sub), sub.shape)
+            for rv, k in zip(free, idx):
+                assignment[rv] = self.bn.values(rv)[k]
+        if prob:
+            return max_prob, assignment
+        return assignment
+
+    def save(self, path):
+        """
+        Save the compiled tree to a single (uncompressed) .npz
+        file, which "load" reads back without parsing, triangulating
+        or multiplying any factors. The file holds:
+            - the network, as the arrays of its CompiledBayesNet
+                plus the rv and value names
+            - the scope of every clique and the parent of every
+                clique in the tree
+            - the initial (evidence-free) clique potentials, in
+                their compiled layout
+            - a hash of the network's structure and one of its
+                parameters, to check the file against a BayesNet
+
+        Arguments
+        ---------
+        *path* : a string
+            The path of the file - '.npz' is appended if it
+            is missing.
+
+        Notes
+        -----
+        - Values are stored as strings.
+        - The evidence and the messages are not saved.
+        """
+        cbn = self.bn.compile()
+        names = list(cbn.nodes())
+        ids = dict([(rv, k) for k, rv in enumerate(names)])
+        values = [str(val) for rv in names for val in cbn.values(rv)]
+        cliques = list(range(len(self.C)))
+        structure_hash, param_hash = _network_hash(self.bn)
+        np.savez(path,
+            names=np.array(names), values=np.array(values),
+            cards=cbn.cards, offsets=cbn.offsets, params=cbn.params,
+            par_ptr=cbn.par_ptr, par_ids=cbn.par_ids,
+            ch_ptr=cbn.ch_ptr, ch_ids=cbn.ch_ids,
+            clique_ptr=np.cumsum([0] + [len(self._axes[i]) for i in cliques]),
+            clique_ids=np.array([ids[rv] for i in cliques \
+                for rv in self._axes[i]], dtype=np.int64),
+            parents=np.array([-1 if self._parent[i] is None \
+                else self._parent[i] for i in cliques], dtype=np.int64),
+            pot_ptr=np.cumsum([0] + [len(self._pot0[i]) for i in cliques]),
+            pot0=np.concatenate([self._pot0[i] for i in cliques]),
+            info=np.array([structure_hash, param_hash, str(int(self.log)),
+                str(self.width), str(self.total_size)]))
+
+    @classmethod
+    def load(cls, path, bn=None, n_jobs=1):
+        """
+        Load a compiled tree saved with "save".
+
+        Arguments
+        ---------
+        *path* : a string
+
+        *bn* : a BayesNet object or None
+            The network the tree was compiled from. If given, it
+            is checked against the hashes in the file - a
+            ValueError is raised if they differ - and used as
+            the tree's network. If None, the network is
+            rebuilt from the file.
+
+        *n_jobs* : an integer
+            The number of threads used to compute messages.
+
+        Returns
+        -------
+        *ctree* : a CliqueTree object
+
+        Notes
+        -----
+        - The Clique objects of a loaded tree only hold their
+            scope, since the potentials live in the compiled arrays.
+        """
+        with np.load(path) as f:
+            structure_hash, param_hash, log, width, total_size = \
+                [str(x) for x in f['info'].tolist()]
+            names = [str(rv) for rv in f['names'].tolist()]
+            if bn is not None:
+                if _network_hash(bn) != (structure_hash, param_hash):
+                    raise ValueError('The saved clique tree was compiled '
+                        'from a different network.')
+            else:
+                bn = _read_network(f, names)
+            ptr, ids = f['clique_ptr'], f['clique_ids']
+            parents = f['parents']
+            pot_ptr, pot0 = f['pot_ptr'], f['pot0']
+
+        ctree = cls.__new__(cls)
+        ctree.bn = bn
+        ctree.log = bool(int(log))
+        ctree._F = None
+        ctree.evidence = {}
+        ctree.n_jobs = n_jobs
+        ctree.width = int(width)
+        ctree.total_size = int(total_size)
+        ctree.C = dict([(i, Clique(set([names[k] for k in \
+            ids[ptr[i]:ptr[i+1]]]))) for i in range(len(ptr)-1)])
+        ctree._set_tree([(i, None if p < 0 else int(p)) \
+            for i, p in enumerate(parents)])
+        ctree.compile(dict([(i, pot0[pot_ptr[i]:pot_ptr[i+1]]) \
+            for i in ctree.C]))
+        return ctree
+
+    def _schedule(self, root):
+        """
+        Return the (child, parent) edges of the tree when it is
+        rooted at *root*, ordered from the leaves to the root.
+        """
+        edges = []
+        seen = set([root])
+        queue = [root]
+        for u in queue:
+            for w in self._nbrs[u]:
+                if w not in seen:
+                    seen.add(w)
+                    queue.append(w)
+                    edges.append((w,u))
+        return list(reversed(edges)), edges
+
+    def _absorb(self, i, skip=None, scratch=None, max_product=False):
+        """
+        Multiply the potential of clique *i* by every message
+        it received (except the one from clique *skip*) into the
+        scratch buffer, and return the result as a tensor.
+        """
+        if scratch is None:
+            scratch = self._scratch
+        msg = self._max_msg if max_product else self._msg
+        out = scratch[:len(self._pot[i])].reshape(self._shape[i])
+        np.copyto(out, self._pot[i].reshape(self._shape[i]))
+        combine = np.add if self.log else np.multiply
+        for k in self._nbrs[i]:
+            if k != skip:
+                combine(out, msg[(k,i)].reshape(self._bshape[(k,i)]),
+                    out=out)
+        return out
+
+    def _compute(self, i, j, scratch=None, max_product=False):
+        """
+        Compute the message from clique *i* to clique *j* into
+        its buffer.
+        """
+        belief = self._absorb(i, j, scratch, max_product)
+        if max_product:
+            np.max(belief, axis=self._sum_axes[(i,j)],
+                out=self._max_msg[(i,j)])
+        elif self.log:
+            np.copyto(self._msg[(i,j)], _logsumexp(belief,
+                axis=self._sum_axes[(i,j)]))
+        else:
+            np.sum(belief, axis=self._sum_axes[(i,j)],
+                out=self._msg[(i,j)])
+
+    def _send(self, edges, max_product=False):
+        """
+        Compute every missing (max-product) message along *edges*
+        (in order), and return how many were computed.
+        """
+        valid = self._max_valid if max_product else self._valid
+        missing = [e for e in edges if e not in valid]
+        if self.n_jobs > 1 and len(missing) > 1:
+            self._send_parallel(missing, max_product)
+        else:
+            for i, j in missing:
+                self._compute(i, j, None, max_product)
+                valid.add((i,j))
+        return len(missing)
+
+    def _send_parallel(self, missing, max_product=False):
+        """
+        Compute the messages in *missing* on a pool of self.n_jobs
+        threads. A message is handed to the pool as soon as every
+        message it depends on - i.e. every message into its sending
+        clique, except the one from its receiving clique - is valid.
+        Messages from cliques with fewer than *parallel_min_size*
+        entries are cheaper to compute than to hand over, so they
+        are computed right away on the calling thread.
+
+        The pool only lives for this call - its threads are joined
+        before returning, even if a message raised an error.
+        """
+        valid = self._max_valid if max_product else self._valid
+        todo = set(missing)
+        waiting = dict([((i,j), len([k for k in self._nbrs[i] \
+            if k != j and (k,i) in todo])) for i,j in missing])
+        ready = [e for e in missing if waiting[e] == 0]
+        done = Queue()
+        while len(self._buffers) < self.n_jobs:
+            self._buffers.append(np.empty(len(self._scratch)))
+        free = Queue()
+        for buf in self._buffers[:self.n_jobs]:
+            free.put(buf)
+        pool = ThreadPool(self.n_jobs)
+
+        n_running = 0
+        error = None
+        try:
+            while (ready and error is None) or n_running > 0:
+                if ready and error is None:
+                    i, j = ready.pop()
+                    if len(self._pot[i]) >= self.parallel_min_size:
+                        pool.apply_async(self._compute_task,
+                            ((i,j), free, done, max_product))
+                        n_running += 1
+                        continue
+                    self._compute(i, j, None, max_product)
+                else:
+                    (i,j), err = done.get()
+                    n_running -= 1
+                    if err is not None:
+                        # let the running messages finish before raising
+                        error = error or err
+                        continue
+                valid.add((i,j))
+                for k in self._nbrs[j]:
+                    if k != i and (j,k) in todo:
+                        waiting[(j,k)] -= 1
+                        if waiting[(j,k)] == 0:
+                            ready.append((j,k))
+        finally:
+            pool.close()
+            pool.join()
+        if error is not None:
+            raise error
+
+    def _compute_task(self, edge, free, done, max_product=False):
+        """
+        Compute one message on a pool thread, with a scratch buffer
+        taken from *free*, and report it (or its error) to *done*.
+        """
+        scratch = free.get()
+        try:
+            self._compute(edge[0], edge[1], scratch, max_product)
+            done.put((edge, None))
+        except Exception as err:
+            done.put((edge, err))
+        finally:
+            free.put(scratch)
+
+
+def _network_hash(bn):
+    """
+    Hashes of the structure (rvs, parents and values) and of the
+    parameters of *bn*, which - unlike hash(bn) - are the same
+    in every process.
+    """
+    structure = hashlib.sha1()
+    params = hashlib.sha1()
+    for rv in bn.nodes():
+        structure.update(repr((str(rv), [str(p) for p in bn.parents(rv)],
+            [str(v) for v in bn.values(rv)])).encode('utf-8'))
+        params.update(np.asarray(bn.cpt(rv), dtype=np.float64).tobytes())
+    return structure.hexdigest(), params.hexdigest()
+
+def _read_network(f, names):
+    """
+    Rebuild the BayesNet saved by CliqueTree.save from the
+    arrays of the loaded .npz file *f*.
+    """
+    values = [str(v) for v in f['values'].tolist()]
+    cards, offsets, params = f['cards'], f['offsets'], f['params']
+    par_ptr, par_ids = f['par_ptr'], f['par_ids']
+    ch_ptr, ch_ids = f['ch_ptr'], f['ch_ids']
+    bn = BayesNet()
+    bn.V = list(names)
+    bn.E = {}
+    bn.F = {}
+    start = 0
+    for i, rv in enumerate(names):
+        bn.E[rv] = [names[c] for c in ch_ids[ch_ptr[i]:ch_ptr[i+1]]]
+        bn.F[rv] = {'parents': [names[p] for p in par_ids[par_ptr[i]:par_ptr[i+1]]],
+                    'values': values[start:start+cards[i]],
+                    'cpt': params[offsets[i]:offsets[i+1]].tolist()}
+        start += cards[i]
+    return bn
+
 
 class Clique(object):
     """
@@ -192,6 +813,10 @@ class Clique(object):
     *psi* : a factor
         The potential of the clique.
 
+    *psi0* : a factor
+        The potential of the clique before any evidence
+        is entered.
+
     *belief* : a factor
         The factor which holds the marginal/conditional
         probabilities of the relevant nodes after 
@@ -224,6 +849,7 @@ class Clique(object):
         self._F = None
         
         self.psi = None # Psi should never change -> Factor object
+        self.psi0 = None
         self.belief = None
         
         self.messages_received = []
@@ -270,17 +896,17 @@ class Clique(object):
         if len(self.messages_received) > 0:
             # if there are messages received, mutliply them in to psi first
             if not self.belief:
-                self.belief = copy(self.psi)
+                self.belief = self.psi.copy()
             for msg in self.messages_received:
                 self.belief *= msg
             #self.belief.merge_multiply(self.messages_received)
         else:
             # if there are no messages received, simply move on with psi
             if not self.belief:
-                self.belief = copy(self.psi)
+                self.belief = self.psi.copy()
         # generate message as belief with Ci - Sij vars summed out
         #vars_to_sumout = list(self.scope.difference(self.sepset(parent)))
-        msg_to_send = copy(self.belief)
+        msg_to_send = self.belief.copy()
         for var_to_sumout in self.scope.difference(self.sepset(parent)):
             msg_to_send /= var_to_sumout
         #message_to_send = copy(self.belief)
@@ -292,17 +918,24 @@ class Clique(object):
         Compute a new psi (cpt) in order to 
         set the clique's belief. This involves
         multiplying the factors in the Clique together.
-        """
-        assert (len(self._F) != 0), 'No Factors assigned to this clique.'
 
-        if len(self._F) == 1:
-            self.psi = copy(self._F[0])
-            self.belief = copy(self.psi)
-        else:
-            self.psi = max(self._F, key=lambda x: len(x.cpt))
-            for f in self._F:
-                self.psi *= f
-            self.belief = copy(self.psi)
+        The potential always covers the whole scope of the
+        clique, even if no factor (or only smaller factors)
+        were assigned to it. The potential before any evidence
+        is entered is kept in self.psi0.
+        """
+        scope = sorted(self.scope)
+        psi = Factor(self._F.bn, scope[0])
+        psi.is_log = self._F.log
+        card = dict([(rv, self._F.bn.card(rv)) for rv in scope])
+        psi._set_tensor(scope, np.full([card[rv] for rv in scope],
+            0. if self._F.log else 1.), card)
+        psi.var = scope[-1]
+        for f in self._F:
+            psi *= f
+        self.psi0 = psi
+        self.psi = psi.copy()
+        self.belief = self.psi.copy()
 
     def send_initial_message(self, other_clique):
         """
@@ -315,7 +948,7 @@ class Clique(object):
         *other_clique* : a different Clique object
 
         """
-        psi_copy = copy(self.psi)
+        psi_copy = self.psi.copy()
         sepset = self.sepset(other_clique)
         sumout_vars = self.scope.difference(sepset)
         # sum out variables not in the sepset of other_clique
@@ -327,7 +960,7 @@ class Clique(object):
         print('Init Msg: \n', psi_copy.cpt)
         other_clique.messages_received.append(psi_copy)
 
-        self.belief = copy(self.psi)
+        self.belief = self.psi.copy()
 
     def collect_beliefs(self):
         """
@@ -347,13 +980,13 @@ class Clique(object):
         since the main algorithm is just sending messages for a while.
         """
         if len(self.messages_received) > 0:
-            self.belief = copy(self.psi)
+            self.belief = self.psi.copy()
             for msg in self.messages_received:
                 self.belief *= msg
             self.belief 
             self.messages_received = []
         else:
-            self.belief = copy(self.belief)
+            self.belief = self.belief.copy()
 
     def sepset(self, other_clique):
         """
@@ -378,7 +1011,7 @@ class Clique(object):
             The target random variable.
 
         """
-        blf = copy(self.belief)
+        blf = self.belief.copy()
         blf.sumover_var(target)
         return blf
 
@@ -21,29 +21,81 @@ __author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
 
 
 
+import heapq
+import time
 import numpy as np
-import pandas as pd
 import networkx as nx
 
 from pyBN.classes.cliquetree import Clique
+from pyBN.classes.factor import Factor
+from pyBN.classes.factorization import Factorization
 
 class ClusterGraph(object):
     """
     ClusterGraph Class
 
+    The Bethe cluster graph of a BayesNet: one factor cluster
+    per cpt (whose scope is the rv's family) and one variable
+    cluster per rv, with an edge between a factor cluster and
+    the variable cluster of every rv in its scope. Every sepset
+    is a single rv, so every message is a vector.
+
+    Attributes
+    ----------
+    - bn
+        - BayesNet object
+
+    - V
+        - Clusters -> a dictionary where key = cluster idx,
+            value = Clique object. The factor clusters come
+            first, then the variable clusters.
+
+    - E
+        - Edges -> a list of (factor cluster idx, variable
+            cluster idx) tuples
+
+    - G
+        - the cluster graph as a networkx Graph
+
+    - evidence
+        - a dictionary, where key = rv and value = rv value,
+            holding the evidence currently entered in the graph
+
+    - n_updates
+        - the number of messages sent by the last calibration
+
+    - residual
+        - the largest (relative) change any message would
+            still make after the last calibration
+
+    Notes
+    -----
+    Messages live in preallocated flat arrays: one vector per
+    edge and direction, plus one vector per edge for the next
+    value of the factor-to-variable message. Sending a message
+    never allocates a new array. Sum-product and max-product
+    messages are kept apart, so marginal and MAP queries can
+    both warm-start from their last calibration.
+
     """
 
     def __init__(self, bn):
         """
         Initialize a ClusterGraph object
 
+        Arguments
+        ---------
+        *bn* : a BayesNet object
+
         """
-        self.BN = BN
-        self.V = {} # key = cluster index, value = Cluster objects
+        self.bn = bn
+        self.V = {} # key = cluster index, value = Clique objects
         self.E = []
         self.G = None
-        self.initialize_graph(method)
-        self.beliefs = {} # dict where key = cluster idx, value = belief cpt
+        self.evidence = {}
+        self.n_updates = 0
+        self.residual = None
+        self.initialize_graph()
 
     def initialize_graph(self):
         """
@@ -52,11 +104,8 @@ class ClusterGraph(object):
         """
         # generate graph structure
         self.bethe()
-        # initialize beliefs
-        for clique in self.V.values():
-            clique.compute_psi() 
-        # initialize messages to 1
-        self.initialize_messages()
+        # lay out potentials & messages
+        self.compile()
 
     def bethe(self):
         """
@@ -64,105 +113,452 @@ class ClusterGraph(object):
         """
         self.V = {}
         self.E = []
-
-        factorization = Factorization(self.BN)
-        prior_dict = {}
-        for factor in factorization.f_list:
-            # if factor is just a prior (i.e. already added as rv)
-            if len(factor.scope) == 1:
-                #self.V[len(self.V)] = Clique(scope=factor.scope)
-                #self.V[len(self.V)-1].factors = [factor]
-                prior_dict[factor.var] = factor
-            if len(factor.scope) > 1:
-                self.V[len(self.V)] = Clique(scope=factor.scope)
-                self.V[len(self.V)-1].factors = [factor] # assign the factor
-        sep_len = len(self.V)
-        # First, add all individual random variables
-        for rv in self.BN.V:
-            # if rv is a prior, don't add it
-            if rv in prior_dict.keys():
-                factor = prior_dict[rv]
-                self.V[len(self.V)] = Clique(scope=factor.scope)
-                self.V[len(self.V)-1].factors = [factor]
-            else:
-                self.V[len(self.V)] = Clique(scope={rv})
-                # create a new initial factor since it wont have one        
-                new_factor = Factor(BN=self.BN, var=rv, init_to_one=True)
-                self.V[len(self.V)-1].factors = [new_factor]        
-        for i in range(sep_len):
-            for j in range(sep_len,len(self.V)):
-                if self.V[j].scope.issubset(self.V[i].scope):
-                    self.E.append((i,j))
+        self._F = Factorization(self.bn)
+        for phi in self._F:
+            self.V[len(self.V)] = Clique(set(phi.scope))
+        self._var = {} # key = rv, value = variable cluster index
+        for rv in self.bn.nodes():
+            self._var[rv] = len(self.V)
+            self.V[len(self.V)] = Clique(set([rv]))
+        for i, phi in enumerate(self._F):
+            for rv in sorted(phi.scope):
+                self.E.append((i, self._var[rv]))
 
         new_G = nx.Graph()
-        new_G.add_edges_from(self.E)        
+        new_G.add_nodes_from(self.V)
+        new_G.add_edges_from(self.E)
         self.G = new_G
 
-    def initialize_messages(self):
+    def compile(self):
         """
-        For each edge (i-j) in the ClusterGraph,
-        set delta_(i-j) = 1 and
-        set delta_(j-i) = 1.
-        (i.e. send a message from each parent to every child where the 
-            message is a df = 1)
+        Lay out every factor cluster's potential as a dense
+        numpy array whose axes are its rvs in sorted order,
+        and preallocate every message, so that the message
+        from a factor cluster to one of its rvs is a copy,
+        a few in-place broadcast multiplies and one np.sum.
+
+        Effects
+        -------
+        - sets the compiled arrays of the graph
+
         """
-        for cluster in self.V:
-            for neighbor in self.G.neighbors(cluster):
-                self.V[cluster].send_initial_message(self.V[neighbor])
+        n_factors = len(self._F)
+        self._axes = [sorted(phi.scope) for phi in self._F]
+        self._shape = [tuple([self.bn.card(rv) for rv in axes]) \
+            for axes in self._axes]
+        self._pot = [np.ascontiguousarray(phi._tensor(axes),
+            dtype=np.float64) for phi, axes in zip(self._F, self._axes)]
+        self._scratch = np.empty(max([p.size for p in self._pot]))
 
+        ### EDGES: FACTOR SIDE & VARIABLE SIDE ###
+        self._erv = [] # the rv of every edge
+        self._efactor = [] # the factor cluster of every edge
+        self._fedges = [[] for _ in range(n_factors)]
+        self._vedges = dict([(rv, []) for rv in self.bn.nodes()])
+        self._bshape = []
+        self._sum_axes = []
+        for e, (i, j) in enumerate(self.E):
+            rv = list(self.V[j].scope)[0]
+            axis = self._axes[i].index(rv)
+            self._erv.append(rv)
+            self._efactor.append(i)
+            self._fedges[i].append(e)
+            self._vedges[rv].append(e)
+            self._bshape.append(tuple([self.bn.card(rv) if a == axis \
+                else 1 for a in range(len(self._axes[i]))]))
+            self._sum_axes.append(tuple([a for a in \
+                range(len(self._axes[i])) if a != axis]))
 
-    def collect_beliefs(self):
-        self.beliefs = {}
-        for cluster in self.V:
-            self.V[cluster].collect_beliefs()
-            #print('Belief ' , cluster , ' : \n', self.V[cluster].belief.cpt)
-            self.beliefs[cluster] = self.V[cluster].belief
+        ### MESSAGE BUFFERS ###
+        cards = [self.bn.card(rv) for rv in self._erv]
+        self._messages = {False: _Messages(cards, self._pot),
+                          True: _Messages(cards, self._pot)}
+        self._ev = dict([(rv, np.ones(self.bn.card(rv))) for rv in self.bn.nodes()])
+        self.reset()
 
+    def reset(self):
+        """
+        Set every (sum- and max-product) message back to uniform.
+        """
+        for m in self._messages.values():
+            self._reset(m)
 
-    def loopy_belief_propagation(self, target, evidence, max_iter=100):
+    def set_evidence(self, evidence):
         """
-        
-        This is Message Passing (Loopy Belief Propagation) over a cluster graph.
+        Replace the evidence entered in the graph. The current
+        messages are kept, so the next calibration starts from
+        where the last one stopped.
+
+        Arguments
+        ---------
+        *evidence* : a dictionary, where
+            key = rv and value = rv value
+
+        Effects
+        -------
+        - sets self.evidence
 
-        It is Sum-Product Belief Propagation in a cluster graph as shown in
-        Koller p.397
+        """
+        evidence = dict(evidence)
+        changed = [rv for rv in set(evidence) | set(self.evidence) \
+            if evidence.get(rv) != self.evidence.get(rv)]
+        self.evidence = evidence
+        for rv in changed:
+            if rv in evidence:
+                self._ev[rv] = (np.array(self.bn.values(rv)) == \
+                    evidence[rv]).astype(np.float64)
+            else:
+                self._ev[rv] = np.ones(self.bn.card(rv))
 
-        Notes:
-            1. Definitely a problem due to normalization (prob vals way too small)
-            2. Need to check the scope w.r.t. messages.. all clusters should not
-               be accumulating rv's in their scope over the course of the algorithm.
+    def calibrate(self, max_iter=100, tol=1e-6, damping=0.,
+            max_product=False, rho=None, max_time=None):
         """
-        # 1: Moralize the graph
-        # 2: Triangluate
-        # 3: Build a clique tree using max spanning
-        # 4: Propagation of probabilities using message passing
+        Run sum-product (or max-product) loopy belief propagation
+        with residual scheduling [1]: the next value of every
+        factor-to-variable message is kept up to date, and the
+        message which would change the most - its residual - is
+        always sent first. Sending it updates the messages from
+        its rv to its other factor clusters, and only the messages
+        out of those clusters get a new next value.
 
-        # creates clique tree and assigns factors, thus satisfying steps 1-3
-        cgraph = copy.copy(self)
-        G = cgraph.G
+        Arguments
+        ---------
+        *max_iter* : an integer
+            The largest number of messages sent, per edge.
 
-        edge_visit_dict = dict([(i,0) for i in cgraph.E])
+        *tol* : a float
+            The graph is calibrated once no message would
+            change by more than *tol* (in any entry, relative
+            to the entry's size).
 
-        iteration = 0
-        while not cgraph.is_calibrated():
-            if iteration == max_iter:
+        *damping* : a float in [0,1)
+            Every message sent is this much of its old value
+            plus (1 - damping) of its new value, which helps
+            calibration converge on graphs with strong loops.
+
+        *max_product* : a boolean
+            Whether to calibrate the max-product messages (which
+            "max_marginal" and "mpe" use) instead of the
+            sum-product ones.
+
+        *rho* : a float in (0,1] or None
+            If given, max-product messages are tree-reweighted [2]
+            with the same edge appearance probability *rho* for
+            every factor cluster: each potential is raised to the
+            power 1/*rho*, and every message into a variable cluster
+            counts *rho* times. With *rho* = 1 (or None) this is
+            ordinary max-product, which can oscillate on loopy
+            graphs; a smaller *rho* (e.g. 0.5) usually converges.
+
+        *max_time* : a float or None
+            The largest number of seconds to spend sending messages.
+
+        Returns
+        -------
+        *converged* : a boolean
+            Whether the graph was calibrated within *max_iter*
+            (and *max_time*).
+
+        Effects
+        -------
+        - sets self.n_updates and self.residual
+
+        References
+        ----------
+        [1] Elidan, McGraw, Koller (2006). "Residual Belief
+            Propagation: Informed Scheduling for Asynchronous
+            Message Passing."
+        [2] Wainwright, Jaakkola, Willsky (2005). "MAP Estimation
+            Via Agreement on Trees: Message-Passing and Linear
+            Programming."
+
+        """
+        assert (rho is None or max_product), \
+            'Only max-product messages can be reweighted.'
+        assert (rho is None or 0 < rho <= 1), 'rho must be in (0,1].'
+        if rho == 1:
+            rho = None
+        m = self._messages[max_product]
+        if rho != m.rho:
+            # messages for another rho are no place to start from
+            m.rho = rho
+            m.pot = self._pot if rho is None else \
+                [(p / np.max(p)) ** (1. / rho) if np.max(p) > 0 else p \
+                for p in self._pot]
+            self._reset(m)
+        for rv in self._vedges:
+            self._update_var(m, rv)
+        heap = []
+        for e in range(len(self.E)):
+            self._compute(m, e, damping, max_product)
+            heap.append((-m.res[e], e))
+        heapq.heapify(heap)
+
+        self.n_updates = 0
+        start = time.time()
+        while heap and self.n_updates < max_iter * len(self.E):
+            if max_time is not None and time.time() - start > max_time:
+                break
+            r, e = heapq.heappop(heap)
+            if -r != m.res[e]:
+                continue # stale entry
+            if -r <= tol:
                 break
-            if iteration % 50 == 0:
-                print('Iteration: ' , iteration)
-                for cluster in cgraph.V.values():
-                    cluster.collect_beliefs()
-            # select an edge
-            e_idx = np.random.randint(0,len(cgraph.E))
-            edge_select = cgraph.E[e_idx]
-            p_idx = np.random.randint(0,2)
-            parent_edge = edge_select[p_idx]
-            child_edge = edge_select[np.abs(p_idx-1)]
-            print(parent_edge , child_edge)
-
-            # send a message along that edge
-            cgraph.V[parent_edge].send_message(cgraph.V[child_edge])
-
-            iteration += 1
-        print('Now Collecting Beliefs..')
-        self.collect_beliefs()
-        self.BN.ctree = self
+            np.copyto(m.fv[e], m.new[e])
+            m.res[e] = 0.
+            self.n_updates += 1
+            if damping > 0:
+                # a damped message is only part of the way there
+                self._compute(m, e, damping, max_product)
+                heapq.heappush(heap, (-m.res[e], e))
+            rv = self._erv[e]
+            # a reweighted message back to the sender counts
+            # fv[e] ** (rho - 1), so it changes as well
+            skip = e if m.rho is None else None
+            self._update_var(m, rv, skip=skip)
+            for e2 in self._vedges[rv]:
+                if e2 == skip:
+                    continue
+                for e3 in self._fedges[self._efactor[e2]]:
+                    if e3 != e2:
+                        self._compute(m, e3, damping, max_product)
+                        heapq.heappush(heap, (-m.res[e3], e3))
+        self.residual = float(np.max(m.res)) if len(self.E) > 0 else 0.
+        return self.residual <= tol
+
+    def is_calibrated(self, tol=1e-6):
+        """
+        Whether no message would change by more than *tol*
+        after the last calibration.
+        """
+        return self.residual is not None and self.residual <= tol
+
+    def marginal(self, rv):
+        """
+        Return the (approximate) marginal distribution of *rv*,
+        given the evidence in self.evidence, as a normalized Factor
+        - i.e. the belief of its variable cluster.
+
+        Arguments
+        ---------
+        *rv* : a string
+
+        Returns
+        -------
+        *marginal* : a Factor object whose scope is [rv]
+
+        """
+        return self._belief(self._messages[False], rv)
+
+    def max_marginal(self, rv):
+        """
+        Return the (approximate) max-marginal of *rv*, given the
+        evidence in self.evidence, as a Factor normalized to sum
+        to one - see calibrate(max_product=True).
+
+        Arguments
+        ---------
+        *rv* : a string
+
+        Returns
+        -------
+        *max_marginal* : a Factor object whose scope is [rv]
+
+        """
+        return self._belief(self._messages[True], rv)
+
+    def mpe(self, score=False):
+        """
+        Decode an (approximate) most probable explanation from
+        the max-product messages - see calibrate(max_product=True).
+
+        The rvs are decoded in topological order: each rv takes
+        the value which maximizes the belief of its own factor
+        cluster, given the values its parents already took. Unlike
+        the argmax of every max-marginal on its own, this breaks
+        ties consistently and never picks a value which has zero
+        probability given the parents, if another one is possible.
+
+        Messages which did not converge can still lead to a poor
+        assignment, so it is then improved by iterated conditional
+        modes: each non-evidence rv in turn moves to the value which
+        maximizes the cpts of its family and its children's families,
+        until no single move raises the joint probability.
+
+        Arguments
+        ---------
+        *score* : a boolean
+            Whether to also return the objective - the joint
+            log-probability of the assignment and the evidence.
+
+        Returns
+        -------
+        *assignment* : a dictionary, where key = rv and
+            value = rv value
+
+        If *score* is True, a tuple (*log_prob*, *assignment*)
+        is returned instead.
+
+        """
+        m = self._messages[True]
+        idx = {}
+        for i, phi in enumerate(self._F):
+            rv = phi.var
+            e = [e for e in self._fedges[i] if self._erv[e] == rv][0]
+            pot = m.pot[i][tuple([slice(None) if u == rv else idx[u] \
+                for u in self._axes[i]])]
+            # fall back on the evidence if the messages rule out
+            # every value (which loopy max-product can do)
+            for b in [pot * m.vf[e], pot * self._ev[rv], self._ev[rv]]:
+                if np.any(b > 0):
+                    break
+            idx[rv] = int(np.argmax(b))
+
+        ### ITERATED CONDITIONAL MODES ###
+        changed = True
+        while changed:
+            changed = False
+            for rv in self.bn.nodes():
+                if rv in self.evidence:
+                    continue
+                b = np.ones(self.bn.card(rv))
+                for e in self._vedges[rv]:
+                    i = self._efactor[e]
+                    b *= self._pot[i][tuple([slice(None) if u == rv \
+                        else idx[u] for u in self._axes[i]])]
+                k = int(np.argmax(b))
+                if b[k] > b[idx[rv]]:
+                    idx[rv] = k
+                    changed = True
+        assignment = dict([(rv, self.bn.values(rv)[k]) \
+            for rv, k in idx.items()])
+        if score:
+            log_prob = self.bn.log_prob(np.array([[idx[rv] \
+                for rv in self.bn.nodes()]]))[0]
+            return float(log_prob), assignment
+        return assignment
+
+    def loopy_belief_propagation(self, target=None, evidence=None,
+            max_iter=100, tol=1e-6, damping=0.):
+        """
+        This is Message Passing (Loopy Belief Propagation) over a
+        cluster graph - Sum-Product Belief Propagation in a cluster
+        graph as shown in Koller p.397. See "calibrate".
+
+        Returns
+        -------
+        The marginal Factor of *target* - or, if *target* is None,
+        a dictionary where key = rv and value = its marginal Factor.
+
+        """
+        self.set_evidence(evidence or {})
+        self.calibrate(max_iter, tol, damping)
+        if target is None:
+            return dict([(rv, self.marginal(rv)) for rv in self.bn.nodes()])
+        return self.marginal(target)
+
+    def _reset(self, m):
+        """
+        Set every factor-to-variable message in *m* to uniform.
+        """
+        for e, rv in enumerate(self._erv):
+            m.fv[e].fill(1. / self.bn.card(rv))
+
+    def _belief(self, m, rv):
+        """
+        The normalized belief of the variable cluster of *rv* -
+        its evidence times every incoming message in *m*.
+        """
+        p = self._ev[rv].copy()
+        for e in self._vedges[rv]:
+            p *= m.fv[e] if m.rho is None else m.fv[e] ** m.rho
+        total = np.sum(p)
+        if total > 0:
+            p /= total
+        phi = Factor(self.bn, rv)
+        phi._set_tensor([rv], p, {rv: self.bn.card(rv)})
+        return phi
+
+    def _update_var(self, m, rv, skip=None):
+        """
+        Recompute the messages in *m* from the variable cluster
+        of *rv* to its factor clusters (except the one on edge
+        *skip*) - the rv's evidence times every other incoming
+        message. Reweighted messages count *rho* times, and the
+        message back from the receiving cluster counts rho - 1
+        times (entries where it is zero stay zero).
+        """
+        edges = self._vedges[rv]
+        for e in edges:
+            if e == skip:
+                continue
+            msg = m.vf[e]
+            np.copyto(msg, self._ev[rv])
+            for e2 in edges:
+                if e2 != e:
+                    msg *= m.fv[e2] if m.rho is None else m.fv[e2] ** m.rho
+            if m.rho is not None and m.rho < 1:
+                back = np.zeros(len(msg))
+                np.power(m.fv[e], m.rho - 1., out=back, where=m.fv[e] > 0)
+                msg *= back
+            total = np.sum(msg)
+            if total > 0:
+                msg /= total
+
+    def _compute(self, m, e, damping=0., max_product=False):
+        """
+        Compute the next value of the message in *m* on edge *e*
+        from its factor cluster to its rv, and its residual.
+        """
+        i = self._efactor[e]
+        out = self._scratch[:m.pot[i].size].reshape(self._shape[i])
+        np.copyto(out, m.pot[i])
+        for e2 in self._fedges[i]:
+            if e2 != e:
+                np.multiply(out, m.vf[e2].reshape(self._bshape[e2]),
+                    out=out)
+        new = m.new[e]
+        if max_product:
+            np.max(out, axis=self._sum_axes[e], out=new)
+        else:
+            np.sum(out, axis=self._sum_axes[e], out=new)
+        total = np.sum(new)
+        if total > 0:
+            new /= total
+        if damping > 0:
+            new *= 1. - damping
+            new += damping * m.fv[e]
+        # the change relative to the larger of the old and new
+        # entry, so that small entries of peaked messages count
+        old = m.fv[e]
+        top = np.maximum(new, old)
+        m.res[e] = np.max(np.abs(new - old)[top > 0] / top[top > 0]) \
+            if np.any(top > 0) else 0.
+
+
+class _Messages(object):
+    """
+    The message buffers of one kind (sum- or max-product) of
+    loopy belief propagation over a ClusterGraph - one vector
+    per edge, as views into flat arrays.
+
+    *fv* : the factor-to-variable messages
+    *vf* : the variable-to-factor messages
+    *new* : the next value of every factor-to-variable message
+    *res* : the residual of every factor-to-variable message
+    *rho* : the edge appearance probability, or None
+    *pot* : the factor cluster potentials, reweighted by *rho*
+    """
+
+    def __init__(self, cards, pot):
+        offsets = np.cumsum([0] + list(cards))
+        spans = list(zip(offsets[:-1], offsets[1:]))
+        self._fv_flat = np.empty(offsets[-1])
+        self._vf_flat = np.empty(offsets[-1])
+        self._new_flat = np.empty(offsets[-1])
+        self.fv = [self._fv_flat[a:b] for a, b in spans]
+        self.vf = [self._vf_flat[a:b] for a, b in spans]
+        self.new = [self._new_flat[a:b] for a, b in spans]
+        self.res = np.zeros(len(spans))
+        self.rho = None
+        self.pot = pot
@@ -0,0 +1,459 @@
+"""
+**********************
+CompiledBayesNet Class
+**********************
+
+A frozen, integer-indexed form of a BayesNet object, created
+with "bn.compile()".
+
+Every rv gets an integer id (its position in bn.nodes(), which
+is topsort order), and the network is stored in flat numpy arrays:
+
+    - cards -
+        cardinality of each rv
+    - offsets -
+        start of each rv's cpt in *params* (length = n+1)
+    - params -
+        every cpt concatenated into one contiguous float64 buffer
+    - par_ptr, par_ids, par_strides -
+        CSR parent adjacency - the parents of rv i are
+        par_ids[par_ptr[i]:par_ptr[i+1]], and par_strides holds
+        each parent's stride in rv i's cpt
+    - ch_ptr, ch_ids -
+        CSR child adjacency
+
+Hot loops (sampling, counting, scoring) should work on these
+arrays directly. For everything else, a CompiledBayesNet
+answers the same (string-based) queries as a BayesNet - e.g.
+card(), parents(), values(), value_idx(), cpt() - but from
+precomputed tables instead of list scans, so any function
+which only reads a BayesNet also accepts a CompiledBayesNet.
+
+The parameters are read-only - change the original BayesNet
+and compile it again instead.
+
+"""
+
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+import numpy as np
+
+class CompiledBayesNet(object):
+    """
+    Frozen integer-indexed form of a BayesNet.
+
+    """
+
+    def __init__(self, bn):
+        """
+        Compile a BayesNet object.
+
+        Arguments
+        ---------
+        *bn* : a BayesNet object
+
+        Effects
+        -------
+        - sets *self.V*, *self.E*
+        - sets *self.cards*, *self.offsets*, *self.params*
+        - sets *self.par_ptr*, *self.par_ids*, *self.par_strides*
+        - sets *self.ch_ptr*, *self.ch_ids*
+
+        Notes
+        -----
+        - bn.nodes() must be in topsort order, as it is for
+            every BayesNet read from a file or learned.
+        """
+        self.V = list(bn.nodes())
+        self.E = dict([(rv, list(bn.children(rv))) for rv in self.V])
+        self.n = len(self.V)
+        self._id = dict([(rv, i) for i, rv in enumerate(self.V)])
+
+        self._values = [list(bn.values(rv)) for rv in self.V]
+        self._value_idx = [dict([(val, j) for j, val in enumerate(vals)])
+            for vals in self._values]
+        self._parents = [list(bn.parents(rv)) for rv in self.V]
+        self._parent_pos = [dict([(p, k) for k, p in enumerate(ps)])
+            for ps in self._parents]
+        self._children = [self.E[rv] for rv in self.V]
+
+        self.cards = np.array([len(v) for v in self._values], dtype=np.int64)
+
+        self.par_ptr = np.zeros(self.n+1, dtype=np.int64)
+        self.ch_ptr = np.zeros(self.n+1, dtype=np.int64)
+        par_ids = []
+        par_strides = []
+        ch_ids = []
+        for i in range(self.n):
+            s = self.cards[i]
+            for p in self._parents[i]:
+                par_ids.append(self._id[p])
+                par_strides.append(s)
+                s *= self.cards[self._id[p]]
+            ch_ids.extend([self._id[c] for c in self._children[i]])
+            self.par_ptr[i+1] = len(par_ids)
+            self.ch_ptr[i+1] = len(ch_ids)
+        self.par_ids = np.array(par_ids, dtype=np.int64)
+        self.par_strides = np.array(par_strides, dtype=np.int64)
+        self.ch_ids = np.array(ch_ids, dtype=np.int64)
+
+        self.offsets = np.zeros(self.n+1, dtype=np.int64)
+        for i, rv in enumerate(self.V):
+            self.offsets[i+1] = self.offsets[i] + len(bn.cpt(rv))
+        self.params = np.empty(self.offsets[-1], dtype=np.float64)
+        for i, rv in enumerate(self.V):
+            self.params[self.offsets[i]:self.offsets[i+1]] = bn.cpt(rv)
+        self.params.flags.writeable = False
+        self._log_params = None
+        self._cum_params = None
+
+    def __hash__(self):
+        """
+        Same hash as the BayesNet it was compiled from.
+        """
+        return hash((str(self.V),str(self.E)))
+
+    def compile(self):
+        return self
+
+    ### INTEGER-ID ACCESS ###
+
+    def node_id(self, rv):
+        return self._id[rv]
+
+    def parent_ids(self, i):
+        return self.par_ids[self.par_ptr[i]:self.par_ptr[i+1]]
+
+    def child_ids(self, i):
+        return self.ch_ids[self.ch_ptr[i]:self.ch_ptr[i+1]]
+
+    def cpt_matrix(self, i):
+        """
+        The cpt of rv *i* as a (parent configurations x card)
+        matrix - row r holds the distribution of rv *i* given
+        the parent configuration with flat index r*card.
+        """
+        return self.params[self.offsets[i]:self.offsets[i+1]].reshape(
+            -1, self.cards[i])
+
+    def family_indices(self, data):
+        """
+        Index into *params* of every rv's cpt entry selected
+        by each row of an integer-coded dataset.
+
+        Arguments
+        ---------
+        *data* : a (N x n) numpy array of value indices,
+            with columns in self.V (i.e. bn.nodes()) order
+
+        Returns
+        -------
+        *idx* : a (N x n) numpy integer array
+        """
+        data = np.asarray(data, dtype=np.int64)
+        idx = data + self.offsets[:-1]
+        for i in range(self.n):
+            ps = slice(self.par_ptr[i], self.par_ptr[i+1])
+            if self.par_ptr[i+1] > self.par_ptr[i]:
+                idx[:,i] += np.dot(data[:,self.par_ids[ps]],
+                    self.par_strides[ps])
+        return idx
+
+    def log_prob(self, data):
+        """
+        Joint log-probability of each row of an integer-coded
+        dataset, gathered from the (cached) log of *params*.
+
+        Arguments
+        ---------
+        *data* : a (N x n) numpy array of value indices,
+            with columns in self.V (i.e. bn.nodes()) order
+
+        Returns
+        -------
+        *lp* : a numpy array of length N - rows with a
+            zero-probability entry get -inf
+        """
+        return self.log_params()[self.family_indices(data)].sum(axis=1)
+
+    def log_params(self):
+        """
+        The (cached) log of *params* - zeros become -inf.
+        """
+        if self._log_params is None:
+            with np.errstate(divide='ignore'):
+                self._log_params = np.log(self.params)
+        return self._log_params
+
+    def sample(self, n, dtype=None):
+        """
+        Forward sample *n* rows from the network.
+
+        Every rv is drawn for all rows at once, in topsort order:
+        the parent values of each row select a row of the rv's
+        cumulative cpt matrix (see cum_params()), and a single
+        searchsorted call over the whole matrix turns the uniform
+        draws into value indices.
+
+        Arguments
+        ---------
+        *n* : an integer
+            The number of rows
+
+        *dtype* : a numpy integer type or None
+            The type of the returned array - if None, the smallest
+            unsigned type which holds every value index.
+
+        Returns
+        -------
+        *data* : a (n x self.n) numpy array of value indices,
+            with columns in self.V order (stored column-major,
+            so each column is contiguous)
+        """
+        data = self._empty(n, dtype)
+        for i in range(self.n):
+            data[:,i] = self._draw(i, self._parent_rows(data, i))
+        return data
+
+    def weighted_sample(self, n, evidence, dtype=None):
+        """
+        Likelihood weighted sample of *n* rows from the network.
+
+        Every non-evidence rv is drawn for all rows at once, as in
+        sample(). Evidence rvs are set to their observed value, and
+        each row's log-weight gains the log-probability of that
+        value given the row's parents - so the weights do not
+        underflow however much evidence there is.
+
+        Arguments
+        ---------
+        *n* : an integer
+            The number of rows
+
+        *evidence* : a dictionary, where
+            key = rv and value = rv value
+
+        *dtype* : a numpy integer type or None
+            The type of the returned array (see sample()).
+
+        Returns
+        -------
+        *data* : a (n x self.n) numpy array of value indices,
+            with columns in self.V order
+
+        *log_weight* : a numpy array of length n - rows which
+            contradict the evidence get -inf
+        """
+        ev = dict([(self._id[rv], self._value_idx[self._id[rv]][val]) \
+            for rv, val in evidence.items()])
+        data = self._empty(n, dtype)
+        log_weight = np.zeros(n)
+        for i in range(self.n):
+            row = self._parent_rows(data, i)
+            if i in ev:
+                data[:,i] = ev[i]
+                log_weight += self.log_params()[self.offsets[i] + \
+                    row*self.cards[i] + ev[i]]
+            else:
+                data[:,i] = self._draw(i, row)
+        return data, log_weight
+
+    def _empty(self, n, dtype):
+        if dtype is None:
+            dtype = np.min_scalar_type(max(int(self.cards.max())-1, 0))
+        return np.empty((n, self.n), dtype=dtype, order='F')
+
+    def _parent_rows(self, data, i):
+        """
+        The row of cpt_matrix(i) selected by the parent values
+        in each row of *data*.
+        """
+        row = np.zeros(data.shape[0], dtype=np.int64)
+        for k in range(self.par_ptr[i], self.par_ptr[i+1]):
+            row += data[:,self.par_ids[k]].astype(np.int64) * \
+                (self.par_strides[k] // self.cards[i])
+        return row
+
+    def _draw(self, i, row):
+        """
+        Draw a value of rv *i* for each cpt row in *row*.
+        """
+        card = self.cards[i]
+        u = np.random.random_sample(len(row)) + row
+        val = np.searchsorted(self.cum_params()[i], u, side='right') - row*card
+        return np.minimum(val, card-1)
+
+    def cum_params(self):
+        """
+        The (cached) cumulative cpt matrix of every rv, flattened.
+
+        Row r of rv i's matrix holds P(rv i <= k | parent
+        configuration r) + r, so the rows are increasing end to
+        end: a draw u in [0,1) for configuration r is sampled by
+        searching u + r in the flat array and subtracting r*card.
+
+        Returns
+        -------
+        *cum* : a list of numpy arrays, one per rv
+        """
+        if self._cum_params is None:
+            cum = []
+            for i in range(self.n):
+                c = np.cumsum(self.cpt_matrix(i), axis=1)
+                total = c[:,-1:].copy()
+                total[total <= 0] = 1.
+                c /= total
+                c[:,-1] = 1.
+                c += np.arange(c.shape[0])[:,np.newaxis]
+                cum.append(c.ravel())
+            self._cum_params = cum
+        return self._cum_params
+
+    ### BAYESNET API ###
+
+    def nodes(self):
+        for v in self.V:
+            yield v
+
+    def node_idx(self, rv):
+        return self._id.get(rv, -1)
+
+    def has_node(self, rv):
+        return rv in self._id
+
+    def has_edge(self, u, v):
+        return v in self.E[u]
+
+    def edges(self):
+        for u in self.nodes():
+            for v in self.E[u]:
+                yield (u,v)
+
+    def num_edges(self):
+        return len(self.ch_ids)
+
+    def num_params(self):
+        return len(self.params)
+
+    def num_nodes(self):
+        return self.n
+
+    def scope_size(self, rv):
+        return len(self._parents[self._id[rv]])+1
+
+    def cpt(self, rv):
+        i = self._id[rv]
+        return self.params[self.offsets[i]:self.offsets[i+1]]
+
+    def card(self, rv):
+        return int(self.cards[self._id[rv]])
+
+    def scope(self, rv):
+        return [rv] + self._parents[self._id[rv]]
+
+    def parents(self, rv):
+        return self._parents[self._id[rv]]
+
+    def children(self, rv):
+        return self._children[self._id[rv]]
+
+    def degree(self, rv):
+        i = self._id[rv]
+        return len(self._parents[i]) + len(self._children[i])
+
+    def values(self, rv):
+        return self._values[self._id[rv]]
+
+    def value_idx(self, rv, val):
+        """
+        Index of *val* in values(rv). Raises a KeyError
+        for values not in values(rv).
+        """
+        return self._value_idx[self._id[rv]][val]
+
+    def value_indices(self, rv, vals):
+        vmap = self._value_idx[self._id[rv]]
+        uniq, inv = np.unique(np.asarray(vals), return_inverse=True)
+        return np.array([vmap[v] for v in uniq], dtype=np.int64)[inv]
+
+    def stride(self, rv, n):
+        if n==rv:
+            return 1
+        i = self._id[rv]
+        k = self._parent_pos[i][n]
+        return int(self.par_strides[self.par_ptr[i]+k])
+
+    def flat_cpt(self, by_var=False, by_parents=False):
+        """
+        Return all cpt values in the BN as a flattened
+        numpy array ordered by bn.nodes() - i.e. topsort
+        """
+        if by_var:
+            return np.add.reduceat(self.params, self.offsets[:-1])
+        elif by_parents:
+            return np.concatenate([self.cpt_matrix(i).sum(axis=1)
+                for i in range(self.n)])
+        return self.params.copy()
+
+    def cpt_indices(self, target, val_dict):
+        """
+        Get the indices of the CPT of *target* which agree
+        with a dictionary of rv=val sets - or, if the values
+        are arrays, the cpt index of each observation.
+        See BayesNet.cpt_indices.
+        """
+        if any([np.ndim(val) > 0 for val in val_dict.values()]):
+            assert (set(val_dict) == set(self.scope(target))), \
+                'Must give values for every rv in the scope.'
+            idx = 0
+            for rv, val in val_dict.items():
+                idx = idx + self.value_indices(rv,np.atleast_1d(val)) * \
+                    self.stride(target,rv)
+            return idx
+        idx = np.arange(len(self.cpt(target)))
+        for rv, val in val_dict.items():
+            val_idx = (idx // self.stride(target,rv)) % self.card(rv)
+            idx = idx[val_idx == self.value_idx(rv,val)]
+        return idx
+
+    def adj_list(self):
+        """
+        Returns adjacency list of lists, where
+        each list element is a vertex, and each sub-list is
+        a list of that vertex's neighbors.
+        """
+        return [list(self.child_ids(i)) for i in range(self.n)]
+
+    def moralized_edges(self):
+        """
+        Moralized graph is the original graph PLUS
+        an edge between every set of common effect
+        structures -
+            i.e. all parents of a node are connected.
+
+        Returns
+        -------
+        *e* : a python list of parent-child tuples.
+
+        """
+        e = set()
+        for u in self.nodes():
+            for p1 in self.parents(u):
+                e.add((p1,u))
+                for p2 in self.parents(u):
+                    if p1!=p2 and (p2,p1) not in e:
+                        e.add((p1,p2))
+        return list(e)
+
+    def to_bayesnet(self):
+        """
+        Return an (editable) BayesNet copy of the network.
+        """
+        from pyBN.classes.bayesnet import BayesNet
+        bn = BayesNet()
+        bn.V = list(self.V)
+        bn.E = dict([(rv, list(self.E[rv])) for rv in self.V])
+        bn.F = dict([(rv, {'parents':list(self.parents(rv)),
+                        'values':list(self.values(rv)),
+                        'cpt':list(self.cpt(rv))}) for rv in self.V])
+        return bn
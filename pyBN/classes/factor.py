@@ -28,8 +28,32 @@ from __future__ import division
 
 __author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
 
+from copy import copy
+
 import numpy as np
 
+def _logsumexp(arr, axis=None):
+    """
+    Numerically stable log(sum(exp(arr))) over *axis*, used
+    in place of np.sum when a factor is in log space.
+    """
+    m = np.max(arr, axis=axis, keepdims=True)
+    m = np.where(np.isfinite(m), m, 0)
+    with np.errstate(divide='ignore'):
+        s = np.log(np.sum(np.exp(arr - m), axis=axis, keepdims=True)) + m
+    if axis is None:
+        return s.reshape(())
+    return np.squeeze(s, axis=axis)
+
+def _group_max(val, inv, n):
+    """
+    Maximum of *val* within each of the *n* groups
+    given by the group indices in *inv*.
+    """
+    out = np.full(n, -np.inf)
+    np.maximum.at(out, inv, val)
+    return out
+
 class Factor(object):
     """
     A Factor uses a flattened numpy array for the cpt.
@@ -54,14 +78,35 @@ class Factor(object):
     *self.cpt* : a 1D numpy array
         The probability values for self.var conditioned
         on its parents
+
+    *self.is_log* : a boolean
+        Whether self.cpt holds log-probabilities. In log
+        space, multiplication becomes addition and summing
+        out becomes a log-sum-exp, so long products of
+        small probabilities do not underflow.
+
+    *self.batch* : an integer or None
+        If not None, the factor holds B = self.batch factors
+        over the same scope at once (one per row of evidence),
+        and self.cpt is a (B x prod(card)) numpy array. Every
+        operation then works on all B rows simultaneously.
+
+    *self.is_sparse* : a boolean
+        Whether the cpt is currently stored sparsely - i.e. as
+        the sorted flat indices (self._idx) and values (self._val)
+        of its non-zero entries. Every factor operation works
+        directly on this representation, and accessing self.cpt
+        converts the factor back to a dense array. A factor with
+        at least *sparse_min_size* entries switches to the sparse
+        representation automatically whenever the fraction of
+        non-zero entries falls below *sparse_threshold*.
     
 
     Methods
     -------
     *multiply_factor*
-        Multiply two factors together. The factor
-        multiplication algorithm used here is adapted
-        from Koller and Friedman (PGMs) textbook.
+        Multiply two factors together by broadcasting
+        their cpts over the union of the two scopes.
 
     *sumover_var* :
         Sum over one *rv* by keeping it constant. Thus, you 
@@ -89,9 +134,14 @@ class Factor(object):
         Condition the factor by eliminating any sets of
         values that don't align with a given [rv, val]
 
+    *observe_var* :
+        Zero out the entries that don't align with a
+        given [rv, val], keeping rv in the scope
+
     *to_log* :
         Convert probabilities to log space from
-        normal space.
+        normal space - every operation after this
+        works in log space.
 
     *from_log* :
         Convert probabilities from log space to
@@ -100,11 +150,18 @@ class Factor(object):
     *normalize* :
         Make relevant collections of probabilities sum to one.
 
+    *copy* :
+        Copy the factor cheaply - the copy shares the cpt
+        buffer until one of them is written to.
+
 
     Notes
     -----
     """            
 
+    sparse_threshold = 0.1
+    sparse_min_size = 4096
+
 
     def __init__(self, bn, var):
         """
@@ -128,6 +185,9 @@ class Factor(object):
         - sets *self.card*
         - sets *self.scope*
         - sets *self.stride*
+        - sets *self.is_log*
+        - sets *self.batch*
+        - sets *self.is_sparse*
 
         Notes
         -----
@@ -137,7 +197,16 @@ class Factor(object):
         """
         self.bn = bn
         self.var = var
-        self.cpt = np.array(bn.cpt(var))
+        cpt = bn.cpt(var)
+        if isinstance(cpt, np.ndarray):
+            # share the network's buffer until it is written to
+            cpt = cpt.view()
+            cpt.flags.writeable = False
+        else:
+            cpt = np.array(cpt)
+        self.cpt = cpt
+        self.is_log = False
+        self.batch = None
         self.scope = bn.scope(var)
         self.card = dict([(rv, bn.card(rv)) for rv in self.scope])
 
@@ -146,8 +215,31 @@ class Factor(object):
         for v in bn.parents(var):
             self.stride[v]=s
             s*=self.card[v]
+        self._check_sparse()
 
 
+    @property
+    def cpt(self):
+        """
+        The dense cpt. If the factor is currently stored
+        sparsely, it is converted back to a dense array.
+
+        If the buffer is shared with another factor or with
+        the BayesNet (see "copy"), it is copied first so that
+        it can safely be written to.
+        """
+        cpt = self._dense()
+        if not cpt.flags.writeable:
+            cpt = self._cpt = cpt.copy()
+        return cpt
+
+    @cpt.setter
+    def cpt(self, cpt):
+        self._cpt = cpt
+        self._idx = None
+        self._val = None
+        self.is_sparse = False
+
     def __repr__(self):
         """
         Internal representation of the factor,
@@ -191,6 +283,8 @@ class Factor(object):
         self.sumout_var(rv)
         return self
 
+    __truediv__ = __div__
+
     def __floordiv__(self, rv):
         """
         Overloads floor division operator to
@@ -200,6 +294,26 @@ class Factor(object):
         return self
 
 
+    def copy(self):
+        """
+        Return a copy of the factor which shares its cpt buffer
+        (and BayesNet) with this one, so the cost does not grow
+        with the size of the cpt. The scope, card and stride are
+        copied.
+
+        The shared buffer is marked read-only, so writing to
+        either factor's cpt through self.cpt copies the buffer
+        first. Use deepcopy() for a fully independent factor.
+        """
+        for arr in (self._cpt, self._idx, self._val):
+            if arr is not None:
+                arr.flags.writeable = False
+        f = copy(self)
+        f.scope = list(self.scope)
+        f.card = dict(self.card)
+        f.stride = dict(self.stride)
+        return f
+
     def parents(self):
         """
         Return parents of self.var ...
@@ -238,18 +352,227 @@ class Factor(object):
         """
         return set(self.scope).intersection(set(other_factor.scope))
 
+    def _axes(self):
+        """
+        Return the scope ordered by decreasing stride - i.e.
+        the axes of self.cpt when it is viewed as a C-ordered
+        N-dimensional numpy array.
+        """
+        return sorted(self.stride, key=self.stride.__getitem__, reverse=True)
+
+    def _lead(self):
+        """
+        Return the leading (batch) dimensions of the
+        N-dimensional view of self.cpt.
+        """
+        if self.batch is None:
+            return []
+        return [self.batch]
+
+    def _tensor(self, axes=None, batched=False):
+        """
+        Return a view of self.cpt as an N-dimensional numpy array.
+        If the factor is batched, the first dimension is the batch.
+
+        If *axes* is given, the dimensions follow the order of
+        *axes*, and any variable in *axes* which is not in the
+        scope gets a dimension of length 1 so that the result
+        broadcasts against other factors over the same *axes*.
+        If *batched* is also True, an unbatched factor gets a
+        leading dimension of length 1 as well.
+        """
+        own = self._axes()
+        lead = self._lead()
+        arr = self._dense().reshape(lead + [self.card[rv] for rv in own])
+        if axes is None:
+            return arr
+        n = len(lead)
+        pos = dict((rv,i) for i,rv in enumerate(axes))
+        arr = arr.transpose(list(range(n)) + [n+i for i in \
+            sorted(range(len(own)), key=lambda i: pos[own[i]])])
+        if batched and n == 0:
+            lead = [1]
+        return arr.reshape(lead + [self.card[rv] if rv in self.card else 1 \
+            for rv in axes])
+
+    def _set_tensor(self, axes, arr, card=None):
+        """
+        Set self.cpt from an N-dimensional numpy array whose
+        dimensions follow *axes*, and rebuild self.scope,
+        self.card and self.stride to match.
+        """
+        self.cpt = np.ascontiguousarray(arr).reshape(self._lead() + [-1])
+        self._set_layout(axes, card)
+        self._check_sparse()
+
+    def _set_sparse(self, axes, idx, val, card=None):
+        """
+        Set the sparse cpt from the sorted flat indices *idx* and
+        values *val* of the non-zero entries over *axes*, and
+        rebuild self.scope, self.card and self.stride to match.
+        """
+        self._set_layout(axes, card)
+        self._cpt = None
+        self._idx = idx
+        self._val = val
+        self.is_sparse = True
+        self._check_sparse()
+
+    def _set_layout(self, axes, card=None):
+        """
+        Rebuild self.scope, self.card and self.stride for a
+        cpt whose C-ordered axes are *axes*.
+
+        The relative order of variables already in self.scope
+        is kept, and new variables are appended in stride order.
+        """
+        if card is None:
+            card = self.card
+        self.card = dict((rv, card[rv]) for rv in axes)
+        self.stride = {}
+        s=1
+        for rv in reversed(axes):
+            self.stride[rv]=s
+            s*=self.card[rv]
+        scope = [rv for rv in self.scope if rv in self.stride]
+        scope.extend([rv for rv in reversed(axes) if rv not in scope])
+        self.scope = scope
+
+    def _eliminate(self, rv_list, maxout=False):
+        """
+        Remove every rv in *rv_list* from the factor at once by
+        summing (or maxing) over their axes of the N-dimensional
+        view of self.cpt.
+        """
+        axes = self._axes()
+        new_axes = [rv for rv in axes if rv not in rv_list]
+        if self.is_sparse:
+            new_idx = np.zeros(len(self._idx), dtype=np.int64)
+            s=1
+            for rv in reversed(new_axes):
+                new_idx += self._digits(self._idx, rv)*s
+                s*=self.card[rv]
+            uniq, inv = np.unique(new_idx, return_inverse=True)
+            if maxout:
+                new_val = _group_max(self._val, inv, len(uniq))
+            elif self.is_log:
+                m = _group_max(self._val, inv, len(uniq))
+                new_val = np.log(np.bincount(inv,
+                    weights=np.exp(self._val - m[inv]),
+                    minlength=len(uniq))) + m
+            else:
+                new_val = np.bincount(inv, weights=self._val,
+                    minlength=len(uniq))
+            self._set_sparse(new_axes, uniq, new_val)
+        else:
+            n = len(self._lead())
+            axis = tuple([n+axes.index(rv) for rv in rv_list])
+            if maxout:
+                new_cpt = np.max(self._tensor(), axis=axis)
+            else:
+                new_cpt = self._sum(self._tensor(), axis)
+            self._set_tensor(new_axes, new_cpt)
+
+    def _dense(self):
+        """
+        The dense cpt buffer, for reading only - unlike self.cpt,
+        a shared buffer is not copied.
+        """
+        if self.is_sparse:
+            self.to_dense()
+        return self._cpt
+
+    def _sum(self, arr, axis):
+        """
+        Sum *arr* over *axis* in the space of the factor -
+        a plain sum, or a log-sum-exp in log space.
+        """
+        if self.is_log:
+            return _logsumexp(arr, axis=axis)
+        return np.sum(arr, axis=axis)
+
+    def _size(self):
+        """
+        Number of entries in the (unbatched) dense cpt.
+        """
+        return int(np.prod([self.card[rv] for rv in self.scope]))
+
+    def _fill(self):
+        """
+        The value of the entries which a sparse cpt does not store.
+        """
+        if self.is_log:
+            return -np.inf
+        return 0.
+
+    def _digits(self, idx, rv):
+        """
+        Value indices of *rv* for the flat cpt indices *idx*.
+        """
+        return (idx // self.stride[rv]) % self.card[rv]
+
+    def _coords(self):
+        """
+        Return the flat indices and values of the non-zero
+        entries of the cpt, without changing its storage.
+        """
+        if self.is_sparse:
+            return self._idx, self._val
+        idx = np.flatnonzero(self._cpt != self._fill())
+        return idx, self._cpt[idx]
+
+    def _lookup(self, idx):
+        """
+        Return the cpt values at the flat indices *idx*,
+        without changing its storage.
+        """
+        if not self.is_sparse:
+            return self._cpt[idx]
+        if len(self._idx) == 0:
+            return np.full(len(idx), self._fill())
+        pos = np.minimum(np.searchsorted(self._idx, idx), len(self._idx)-1)
+        return np.where(self._idx[pos] == idx, self._val[pos], self._fill())
+
+    def _check_sparse(self):
+        """
+        Switch between the dense and sparse cpt depending on the
+        fraction of non-zero entries (see *sparse_threshold*).
+        """
+        if self.batch is not None or self._size() < self.sparse_min_size:
+            if self.is_sparse:
+                self.to_dense()
+        elif self.density() < self.sparse_threshold:
+            self.to_sparse()
+        else:
+            self.to_dense()
+
+    def _reset_var(self):
+        """
+        Make the rv with stride = 1 the main variable, which
+        is needed once the old main variable has been removed.
+        """
+        l = [k for k,v in self.stride.items() if v==1]
+        if len(l)>0:
+            self.var = l[0]
+
 
 
     ##### FACTOR OPERATIONS #####
 
     def multiply_factor(self, other_factor):
         """
-        Multiply two factors together. The factor
-        multiplication algorithm used here is adapted
-        from Koller and Friedman (PGMs) textbook.
+        Multiply two factors together.
 
         In essence, the scope of the merged factor is the
-        union of the two scopes.
+        union of the two scopes. Each cpt is viewed as an
+        N-dimensional array over that union scope (with
+        length-1 axes for the variables it does not contain)
+        and the product is taken with numpy broadcasting,
+        so no python-level loop over the cpt is needed.
+
+        The strides of the merged factor keep the stride order
+        of the larger factor, followed by the variables which
+        only appear in the smaller factor.
 
         Arguments
         ---------
@@ -270,8 +593,11 @@ class Factor(object):
         -----
         - What is done about normalization here? I guess
         assume it's already normalized
+        - In log space the cpts are added instead.
 
         """
+        assert (self.is_log == other_factor.is_log), \
+            'Cannot multiply a log-space factor with a normal-space factor.'
         if len(self.scope)>=len(other_factor.scope):
             phi1=self
             phi2=other_factor
@@ -279,47 +605,76 @@ class Factor(object):
             phi1=other_factor
             phi2=self
         # go in order of strides to keep them in order after the fact
-        rv_order = sorted(phi1.stride, key=phi1.stride.__getitem__)        
-        scope_set=set(phi1.scope).union(set(phi2.scope))
-
-        ########### HAD TO ADD THESE FOR V/E TO WORK... #################
-        ## I think this is necessary when phi2 has vars not in phi1 ##
-        rv_order.extend(list(set(phi2.scope).difference(set(phi1.scope))))
-        phi1.card.update(phi2.card)
-        #################################################################
-
-        j,k=0,0
-        assignment = dict([(rv, 0) for rv in scope_set])
-        psi = np.zeros(np.product(phi1.card.values()))
-
-        for i in range(len(psi)):
-            psi[i] = phi1.cpt[j]*phi2.cpt[k]
-            for rv in rv_order:
-                assignment[rv] += 1
-                if assignment[rv] == phi1.card[rv]:
-                    assignment[rv] = 0
-                    if rv in phi1.scope:
-                        j=j-(phi1.card[rv]-1)*phi1.stride[rv]
-                    if rv in phi2.scope:
-                        k=k-(phi2.card[rv]-1)*phi2.stride[rv]
-                else:
-                    if rv in phi1.scope:
-                        j=j+phi1.stride[rv]
-                    if rv in phi2.scope:
-                        k=k+phi2.stride[rv]
-                    break
-        self.cpt = psi
-        self.scope = list(scope_set)
-        self.card=phi1.card
-        self.stride={}
-        s=1
-        for v in rv_order:
-            self.stride[v]=s
-            s*=phi1.card[v]
+        rv_order = sorted(phi1.stride, key=phi1.stride.__getitem__)
+        rv_order.extend([rv for rv in reversed(phi2._axes()) \
+            if rv not in phi1.stride])
+
+        card = dict(phi2.card)
+        card.update(phi1.card)
+
+        batched = self.batch is not None or other_factor.batch is not None
+        assert (self.batch is None or other_factor.batch is None or \
+            self.batch == other_factor.batch), 'Batch sizes differ.'
+
+        axes = list(reversed(rv_order))
+        if not batched and (phi1.is_sparse or phi2.is_sparse or \
+                (int(np.prod(list(card.values()))) >= self.sparse_min_size \
+                and min(phi1.density(), phi2.density()) < self.sparse_threshold)):
+            self._multiply_sparse(phi1, phi2, axes, card)
+            return
+
+        if self.is_log:
+            psi = phi1._tensor(axes, batched) + phi2._tensor(axes, batched)
+        else:
+            psi = phi1._tensor(axes, batched) * phi2._tensor(axes, batched)
+        if batched:
+            self.batch = psi.shape[0]
+        self._set_tensor(axes, psi, card)
 
         #self.normalize()
 
 
+    def _multiply_sparse(self, phi1, phi2, axes, card):
+        """
+        Multiply two factors over *axes* when at least one of them
+        is mostly zeros. Only the non-zero entries of the sparser
+        factor are combined with every instantiation of the variables
+        it is missing, so the dense product is never materialized.
+        """
+        a, b = sorted([phi1, phi2], key=lambda f: f.nnz())
+        idx, val = a._coords()
+        extra = [rv for rv in axes if rv not in a.stride]
+        n_extra = int(np.prod([card[rv] for rv in extra]))
+
+        out_stride = {}
+        s=1
+        for rv in reversed(axes):
+            out_stride[rv]=s
+            s*=card[rv]
+
+        out_idx = np.zeros(len(idx)*n_extra, dtype=np.int64)
+        b_idx = np.zeros(len(idx)*n_extra, dtype=np.int64)
+        for rv in a.stride:
+            d = np.repeat(a._digits(idx, rv), n_extra)
+            out_idx += d*out_stride[rv]
+            if rv in b.stride:
+                b_idx += d*b.stride[rv]
+        if len(extra) > 0:
+            grid = np.indices([card[rv] for rv in extra]).reshape(len(extra),-1)
+            for k, rv in enumerate(extra):
+                d = np.tile(grid[k], len(idx))
+                out_idx += d*out_stride[rv]
+                b_idx += d*b.stride[rv]
+
+        if self.is_log:
+            new_val = np.repeat(val, n_extra) + b._lookup(b_idx)
+        else:
+            new_val = np.repeat(val, n_extra) * b._lookup(b_idx)
+        keep = new_val != self._fill()
+        out_idx = out_idx[keep]
+        order = np.argsort(out_idx, kind='mergesort')
+        self._set_sparse(axes, out_idx[order], new_val[keep][order], card)
+
     def sumover_var(self, rv):
         """
         Sum over one *rv* by keeping it constant. Thus, you 
@@ -350,22 +705,7 @@ class Factor(object):
         -----
 
         """
-        exp_len = self.card[rv]
-        new_cpt= np.zeros(exp_len)
-
-        rv_card = self.card[rv]
-        rv_stride = self.stride[rv]
-
-        for i in range(exp_len):
-            idx=i*rv_stride
-            while idx < len(self.cpt):
-                new_cpt[i] += np.sum(self.cpt[idx:(idx+rv_stride)])
-                idx+=rv_card*rv_stride
-
-        self.cpt=new_cpt
-        self.card = {rv:rv_card}
-        self.stride = {rv:1}
-        self.scope = [rv]
+        self._eliminate([r for r in self.scope if r != rv])
         self.var = rv
 
         #self.normalize()
@@ -376,6 +716,10 @@ class Factor(object):
         by summing out (i.e. calling sumout_var) over
         each rv.
 
+        All of the rv's are summed out together in a single
+        reduction over their axes, which is equivalent to
+        (but much faster than) summing them out one at a time.
+
         Arguments
         ---------
         *var_list* : a list
@@ -393,8 +737,11 @@ class Factor(object):
         -----
 
         """
-        for var in var_list:
-            self.sumout_var(var)
+        var_list = list(var_list)
+        if len(var_list) > 0:
+            self._eliminate(var_list)
+            if self.var in var_list:
+                self._reset_var()
 
     def sumout_var(self, rv):
         """
@@ -421,31 +768,10 @@ class Factor(object):
         -----     
         
         """
-        exp_len = int(len(self.cpt)/self.card[rv])
-        new_cpt = np.zeros(exp_len)
-        
-        rv_card = self.card[rv]
-        rv_stride = self.stride[rv]
-
-        k=0
-        p = np.prod([self.card[r] for r in self.scope if self.stride[r] < self.stride[rv]])
-        for i in range(exp_len):
-            for c in range(rv_card):
-                new_cpt[i] += self.cpt[k + (rv_stride*c)]
-            k+=1
-            if (k % p== 0):
-                k += (p * (rv_card - 1))
-        self.cpt=new_cpt
-
-        del self.card[rv]
-        self.stride.update((k,v/rv_card) for k,v in self.stride.items() if v > rv_stride)
-        del self.stride[rv]
-        self.scope.remove(rv)
+        self._eliminate([rv])
 
         if rv == self.var:
-            l = [k for k,v in self.stride.items() if v==1]
-            if len(l)>0:
-                self.var = l[0]
+            self._reset_var()
 
         #if len([k for k,v in self.stride.items() if v==1]) > 0:
         #self.normalize()
@@ -478,29 +804,7 @@ class Factor(object):
         
         """
         #self.cpt += 0.00002
-        exp_len = int(len(self.cpt)/self.card[rv])
-        new_cpt = np.zeros(exp_len)
-
-        rv_card = self.card[rv]
-        rv_stride = self.stride[rv]
-
-        k=0
-        p = np.prod([self.card[r] for r in self.scope if self.stride[r] < self.stride[rv]])
-        for i in range(exp_len):
-            max_val = 0
-            for c in range(rv_card):
-                if self.cpt[k + (rv_stride*c)] > max_val:
-                    max_val = self.cpt[k + (rv_stride*c)]
-                    new_cpt[i] = max_val
-            k+=1
-            if (k % p == 0):
-                k += (p* (rv_card - 1))
-        self.cpt=new_cpt
-
-        del self.card[rv]
-        self.stride.update((k,v/rv_card) for k,v in self.stride.items() if v > rv_stride)
-        del self.stride[rv]
-        self.scope.remove(rv)
+        self._eliminate([rv], maxout=True)
 
         #if rv == self.var:
             #self.var = [k for k,v in self.stride.items() if v==1][0]
@@ -563,8 +867,11 @@ class Factor(object):
         *rv* : a string
             The random variable to eliminate/condition upon.
 
-        *val* : a string
-            The value of RV
+        *val* : a string, or a list of strings
+            The value of RV. If a list of B values is passed,
+            the factor becomes batched - i.e. it is reduced by
+            B different pieces of evidence at once and self.cpt
+            gets a leading dimension of length B.
 
         Returns
         -------
@@ -576,6 +883,7 @@ class Factor(object):
         - alters self.scope
         - alters self.card
         - alters self.stride
+        - may set self.batch
 
         Notes
         -----
@@ -583,47 +891,169 @@ class Factor(object):
             rv-val pair is actually in the factor..
 
         """
-        exp_len = len(self.cpt)/float(self.card[rv])
-        new_cpt = np.zeros((exp_len,))
+        axes = self._axes()
+        if isinstance(val, (list, tuple, np.ndarray)):
+            values = self.bn.values(rv)
+            val_idx = np.array([values.index(v) for v in val])
+            assert (self.batch is None or self.batch == len(val_idx)), \
+                'Batch sizes differ.'
+            arr = self._tensor()
+            if self.batch is None:
+                arr = np.broadcast_to(arr, (len(val_idx),) + arr.shape)
+                self.batch = len(val_idx)
+            arr = np.moveaxis(arr, 1+axes.index(rv), 1)
+            new_cpt = arr[np.arange(self.batch), val_idx]
+        elif self.is_sparse:
+            val_idx = self.bn.values(rv).index(val)
+            keep = self._digits(self._idx, rv) == val_idx
+            idx = self._idx[keep]
+            s = self.stride[rv]
+            idx = (idx // (s*self.card[rv]))*s + idx % s
+            axes.remove(rv)
+            self._set_sparse(axes, idx, self._val[keep])
+            if rv == self.var:
+                self._reset_var()
+            return
+        else:
+            val_idx = self.bn.values(rv).index(val)
+            new_cpt = np.take(self._tensor(), val_idx,
+                axis=len(self._lead())+axes.index(rv))
+        axes.remove(rv)
+        self._set_tensor(axes, new_cpt)
 
-        val_idx = self.bn.F[rv]['values'].index(val)
-        rv_card = self.card[rv]
-        rv_stride = self.stride[rv]
+        if rv == self.var:
+            self._reset_var()
 
-        add_idx=0
-        idx = val_idx*rv_stride
-        while add_idx < exp_len:
-            for j in self.cpt[idx:(idx+rv_stride)]:
-                new_cpt[add_idx] = j
-                add_idx+=1
-            idx+=rv_card*rv_stride
+    def observe_var(self, rv, val):
+        """
+        Condition the factor over evidence by zeroing out every
+        entry which does not align with [rv, val].
 
-        self.cpt=new_cpt
-        del self.card[rv]
-        self.stride.update((k,v/rv_card) for k,v in self.stride.items() if v > rv_stride)
-        del self.stride[rv]
-        self.scope.remove(rv)
+        Unlike "reduce_factor", *rv* stays in the scope, so the
+        factor keeps its shape. This is what clique potentials
+        need, since messages are computed over fixed scopes and
+        the evidence can later be changed or retracted.
 
-        if rv == self.var:
-            l = [k for k,v in self.stride.items() if v==1]
-            if len(l)>0:
-                self.var = l[0]
+        Arguments
+        ---------
+        *rv* : a string
+            The random variable to condition upon.
+
+        *val* : a string
+            The value of RV.
+
+        Returns
+        -------
+        None
 
-    def to_log(self):
+        Effects
+        -------
+        - alters self.cpt
+
+        """
+        assert (self.batch is None), 'Cannot observe a batched factor.'
+        val_idx = self.bn.values(rv).index(val)
+        if self.is_sparse:
+            keep = self._digits(self._idx, rv) == val_idx
+            self._set_sparse(self._axes(), self._idx[keep], self._val[keep])
+            return
+        keep = self._digits(np.arange(self._size()), rv) == val_idx
+        cpt = np.full(self._size(), self._fill())
+        cpt[keep] = self._dense()[keep]
+        self.cpt = cpt
+        self._check_sparse()
+
+    def nnz(self):
+        """
+        Number of non-zero entries in the cpt (in log space,
+        entries that are not -inf).
+        """
+        if self.is_sparse:
+            return len(self._val)
+        return int(np.count_nonzero(self._cpt != self._fill()))
+
+    def density(self):
+        """
+        Fraction of non-zero entries in the cpt.
+        """
+        return self.nnz() / max(self._size()*(self.batch or 1), 1)
+
+    def to_sparse(self):
+        """
+        Store the cpt as the sorted flat indices and values
+        of its non-zero entries.
+
+        Effects
+        -------
+        - sets self.is_sparse
+        """
+        assert (self.batch is None), 'A batched factor cannot be sparse.'
+        if not self.is_sparse:
+            idx, val = self._coords()
+            self._cpt = None
+            self._idx = idx
+            self._val = val
+            self.is_sparse = True
+
+    def to_dense(self):
+        """
+        Store the cpt as a dense numpy array again.
+
+        Effects
+        -------
+        - sets self.is_sparse
+        """
+        if self.is_sparse:
+            cpt = np.full(self._size(), self._fill())
+            cpt[self._idx] = self._val
+            self.cpt = cpt
+
+    def to_log(self, decimals=5):
         """
         Convert probabilities to log space from
         normal space.
 
-        """
-        self.cpt = np.round(np.log(self.cpt),5)
+        Arguments
+        ---------
+        *decimals* : an integer or None
+            Number of decimals to round to - pass None
+            to keep full precision (as log-space inference does).
 
-    def from_log(self):
+        """
+        if self.is_sparse:
+            self._val = np.log(self._val)
+            if decimals is not None:
+                self._val = np.round(self._val,decimals)
+            self.is_log = True
+            return
+        with np.errstate(divide='ignore'):
+            self.cpt = np.log(self._dense())
+        if decimals is not None:
+            self.cpt = np.round(self.cpt,decimals)
+        self.is_log = True
+
+    def from_log(self, decimals=5):
         """
         Convert probabilities from log space to
         normal space.
 
+        Arguments
+        ---------
+        *decimals* : an integer or None
+            Number of decimals to round to - pass None
+            to keep full precision.
+
         """
-        self.cpt = np.round(np.exp(self.cpt),5)
+        if self.is_sparse:
+            self._val = np.exp(self._val)
+            if decimals is not None:
+                self._val = np.round(self._val,decimals)
+            self.is_log = False
+            return
+        self.cpt = np.exp(self._dense())
+        if decimals is not None:
+            self.cpt = np.round(self.cpt,decimals)
+        self.is_log = False
 
     def perturb(self):
         """
@@ -631,7 +1061,7 @@ class Factor(object):
         This will probably make cpt values have many 
         decimal points (bad).
         """
-        self.cpt += 1e-7
+        self.cpt = self._dense() + 1e-7
 
     def normalize(self):
         """
@@ -641,6 +1071,14 @@ class Factor(object):
         for which the stride = 1, because it's assumed that's the
         main/child variable.
 
+        The cpt is viewed as a (rows x card) array and every
+        row is normalized at once. Rows which are entirely zero
+        (i.e. impossible parent instantiations) are left as zeros
+        instead of being perturbed, so no "nan" values appear.
+
+        In log space, the log-sum-exp of each row is subtracted.
+        A sparse cpt is normalized without being made dense.
+
         Effects
         -------
         - alters self.cpt
@@ -649,17 +1087,32 @@ class Factor(object):
         -----
 
         """
-        self.perturb() # stops nan's from happening
         var = [k for k,v in self.stride.items() if v==1]
+        if self.is_sparse:
+            n = self.card[var[0]] if len(var) > 0 else self._size()
+            uniq, inv = np.unique(self._idx // n, return_inverse=True)
+            if self.is_log:
+                m = _group_max(self._val, inv, len(uniq))
+                total = np.log(np.bincount(inv,
+                    weights=np.exp(self._val - m[inv]),
+                    minlength=len(uniq))) + m
+                self._val = self._val - total[inv]
+            else:
+                total = np.bincount(inv, weights=self._val,
+                    minlength=len(uniq))
+                self._val = self._val / total[inv]
+            return
         if len(var) > 0:
-            var = var[0]
-            for i in range(0,len(self.cpt),self.card[var]):
-                temp_sum = float(np.sum(self.cpt[i:(i+self.card[var])]))
-                for j in range(self.card[var]):
-                    self.cpt[i+j] /= temp_sum
+            rows = self._dense().reshape(self._lead() + [-1,self.card[var[0]]])
+        else:
+            rows = self._dense().reshape(self._lead() + [1,-1])
+        if self.is_log:
+            total = _logsumexp(rows, axis=-1)[...,np.newaxis]
+            rows = rows - np.where(np.isfinite(total), total, 0)
         else:
-            for i in range(len(self.cpt)):
-                self.cpt[i] /= (np.sum(self.cpt))
+            total = np.sum(rows, axis=-1)[...,np.newaxis]
+            rows = rows / np.where(total > 0, total, 1)
+        self.cpt = rows.reshape(self._lead() + [-1])
 
 
 
@@ -12,7 +12,7 @@ import numpy as np
 
 class Factorization(object):
 
-	def __init__(self, bn, nodes=None):
+	def __init__(self, bn, nodes=None, log=False):
 		"""
 		Initialize a Factorization object.
 
@@ -20,14 +20,22 @@ class Factorization(object):
 		that includes only a subset of the random variables in the
 		passed-in BayesNet object. This is mostly useful for CliqueTree
 		algorithms.
+
+		The *log* argument puts every factor in log space, so that
+		all products/eliminations are carried out as sums and
+		log-sum-exps and do not underflow on deep networks.
 		
 		"""
 		self.bn = bn
+		self.log = log
 
 		if nodes is not None:
 			self._phi = [Factor(bn,rv) for rv in nodes]
 		else:
 			self._phi = [Factor(bn,rv) for rv in bn.nodes()]
+		if log:
+			for phi in self._phi:
+				phi.to_log(decimals=None)
 
 		## MAP-BASED ATTRIBUTES ##
 		self.map_factors = OrderedDict()
@@ -39,6 +47,9 @@ class Factorization(object):
 		Refresh Factorization attributes.
 		"""
 		self._phi = [Factor(self.bn,rv) for rv in self.bn.nodes()]
+		if self.log:
+			for phi in self._phi:
+				phi.to_log(decimals=None)
 		self.map_factors = OrderedDict()
 		self.map_assignment = dict()
 		self.map_prob = -1
@@ -62,6 +73,8 @@ class Factorization(object):
 		self.sum_product_eliminate_var(rv)
 		return self
 
+	__truediv__ = __div__
+
 	def __floordiv__(self, rv):
 		"""
 		Overloads floor division operator for
@@ -107,7 +120,7 @@ class Factorization(object):
 		for i in range(1,len(relevant_factors)):
 			psi *= relevant_factors[i]
 
-		self.map_factors[rv] = deepcopy(psi)
+		self.map_factors[rv] = psi.copy()
 		# Take Max over psi for rv
 		psi //= rv # maxout
 		irrelevant_factors.append(psi) # add sum-prod factor back in
@@ -115,7 +128,7 @@ class Factorization(object):
 		self._phi = irrelevant_factors
 
 	def traceback_map(self):
-		nodes = self.map_factors.keys()
+		nodes = list(self.map_factors.keys())
 		idx = len(self.map_factors)
 		for rv in reversed(self.map_factors.keys()):
 			f = self.map_factors[rv]
@@ -131,7 +144,7 @@ class Factorization(object):
 	def consolidate(self):
 		final_phi = self._phi[0]
 		for i in range(1,len(self._phi)):
-			final_phi *= _phi[i]
+			final_phi *= self._phi[i]
 		#final_phi.normalize()
 		return final_phi
 
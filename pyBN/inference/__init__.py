@@ -1,3 +1,4 @@
+from pyBN.inference.map_approx import *
 from pyBN.inference.map_exact import *
 from pyBN.inference.marginal_approx import *
 from pyBN.inference.marginal_exact import *
\ No newline at end of file
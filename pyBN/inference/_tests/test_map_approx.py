@@ -0,0 +1,56 @@
+"""
+********
+UnitTest
+Map Approx
+********
+
+"""
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+import unittest
+import os
+from os.path import dirname
+import numpy as np
+
+from pyBN.readwrite.read import read_bn
+from pyBN.inference.map_approx import loopy_map
+from pyBN.inference.map_exact import ve_map
+from pyBN.classes.clustergraph import ClusterGraph
+
+class MapApproxTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.dpath = os.path.join(dirname(dirname(dirname(dirname(__file__)))),'data')	
+		self.bn = read_bn(os.path.join(self.dpath,'cmu.bn'))
+
+	def tearDown(self):
+		pass
+
+	def test_loopy_map(self):
+		# cmu is a polytree, so max-product is exact
+		for ev in [{}, {'JohnCalls':'Yes'}, {'JohnCalls':'Yes','MaryCalls':'Yes'}]:
+			log_prob, a = loopy_map(self.bn,evidence=ev)
+			p, b = ve_map(self.bn,evidence=dict(ev),prob=True)
+			self.assertDictEqual(a,b)
+			self.assertAlmostEqual(round(np.exp(log_prob),5),p)
+		self.assertEqual(loopy_map(self.bn,evidence={'Burglary':'Yes'},
+			target='Alarm',rho=0.5)[1],'Yes')
+
+	def test_cluster_graph_budget(self):
+		cgraph = ClusterGraph(self.bn)
+		cgraph.set_evidence({'JohnCalls':'Yes'})
+		self.assertFalse(cgraph.calibrate(max_product=True,max_iter=0))
+		self.assertTrue(cgraph.calibrate(max_product=True,max_time=10.))
+		mpe = cgraph.mpe()
+		for rv in self.bn.nodes():
+			p = cgraph.max_marginal(rv).cpt
+			self.assertAlmostEqual(np.sum(p),1.)
+			self.assertEqual(self.bn.values(rv)[np.argmax(p)],mpe[rv])
+		self.assertRaises(AssertionError, cgraph.calibrate, rho=0.5)
+
+	def test_reweighted_stays_calibrated(self):
+		cgraph = ClusterGraph(self.bn)
+		cgraph.set_evidence({'JohnCalls':'Yes'})
+		self.assertTrue(cgraph.calibrate(max_product=True,rho=0.5))
+		self.assertTrue(cgraph.calibrate(max_product=True,rho=0.5))
+		self.assertEqual(cgraph.n_updates,0)
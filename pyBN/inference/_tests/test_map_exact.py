@@ -13,7 +13,8 @@ from os.path import dirname
 import numpy as np
 
 from pyBN.readwrite.read import read_bn
-from pyBN.inference.map_exact import map_ve_e
+from pyBN.inference.map_exact import ve_map, jt_map
+from pyBN.classes.cliquetree import CliqueTree
 
 class MapExactTestCase(unittest.TestCase):
 
@@ -24,6 +25,25 @@ class MapExactTestCase(unittest.TestCase):
 	def tearDown(self):
 		pass
 
+	def test_jt_map(self):
+		ctree = CliqueTree(self.bn)
+		for ev in [{}, {'JohnCalls':'Yes'}, {'JohnCalls':'Yes','MaryCalls':'Yes'}]:
+			self.assertEqual(jt_map(self.bn,evidence=ev,prob=True,ctree=ctree),
+				ve_map(self.bn,evidence=dict(ev),prob=True))
+		self.assertEqual(jt_map(self.bn,evidence={'Burglary':'Yes'},
+			target='Alarm',ctree=ctree),'Yes')
+
+	def test_clique_tree_max_marginal(self):
+		ctree = CliqueTree(self.bn, log=True)
+		ctree.set_evidence({'JohnCalls':'Yes'})
+		self.assertEqual(ctree.calibrate(max_product=True),4)
+		self.assertEqual(ctree.calibrate(),4)
+		mpe = ctree.mpe()
+		for rv in self.bn.nodes():
+			p = ctree.max_marginal(rv).cpt
+			self.assertAlmostEqual(np.sum(p),1.)
+			self.assertEqual(self.bn.values(rv)[np.argmax(p)],mpe[rv])
+
 	#def test_map_noevidence(self):
 		#p = list(map_ve_e(self.bn,target='Alarm'))
 		#self.assertListEqual(p,['No',0.9367])
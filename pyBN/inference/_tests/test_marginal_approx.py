@@ -12,7 +12,12 @@ import os
 from os.path import dirname
 import numpy as np
 
-from pyBN.inference.marginal_approx import marginal_fs_a, marginal_lws_a, marginal_gs_a
+from pyBN.inference.marginal_approx import forward_sample as marginal_fs_a
+from pyBN.inference.marginal_approx import lw_sample as marginal_lws_a
+from pyBN.inference.marginal_approx import gibbs_sample as marginal_gs_a
+from pyBN.inference.marginal_approx import loopy_bp
+from pyBN.inference.marginal_exact import exact_bp
+from pyBN.classes.clustergraph import ClusterGraph
 from pyBN.readwrite.read import read_bn
 
 class MarginalApproxTestCase(unittest.TestCase):
@@ -27,11 +32,11 @@ class MarginalApproxTestCase(unittest.TestCase):
 	def test_forward_sample(self):
 		np.random.seed(3636)
 		self.assertDictEqual(marginal_fs_a(self.bn,n=1000),
-			{'Alarm': {'No': 0.996, 'Yes': 0.004},
-			 'Burglary': {'No': 0.998, 'Yes': 0.002},
-			 'Earthquake': {'No': 1.0, 'Yes': 0.0},
-			 'JohnCalls': {'No': 0.946, 'Yes': 0.054},
-			 'MaryCalls': {'No': 0.99, 'Yes': 0.01}}
+			{'Alarm': {'No': 0.999, 'Yes': 0.001},
+			 'Burglary': {'No': 1.0, 'Yes': 0.0},
+			 'Earthquake': {'No': 0.995, 'Yes': 0.005},
+			 'JohnCalls': {'No': 0.95, 'Yes': 0.05},
+			 'MaryCalls': {'No': 0.994, 'Yes': 0.006}}
 			 )
 
 	def test_likelihood_weighted_sample(self):
@@ -40,11 +45,11 @@ class MarginalApproxTestCase(unittest.TestCase):
 		"""
 		np.random.seed(3636)
 		self.assertDictEqual(marginal_lws_a(self.bn,evidence={'Burglary':'Yes'}),
-			{'Alarm': {'No': 0.058, 'Yes': 0.942},
+			{'Alarm': {'No': 0.051, 'Yes': 0.949},
 			 'Burglary': {'No': 0.0, 'Yes': 1.0},
-			 'Earthquake': {'No': 0.997, 'Yes': 0.003},
-			 'JohnCalls': {'No': 0.136, 'Yes': 0.864},
-			 'MaryCalls': {'No': 0.343, 'Yes': 0.657}})
+			 'Earthquake': {'No': 1.0, 'Yes': 0.0},
+			 'JohnCalls': {'No': 0.139, 'Yes': 0.861},
+			 'MaryCalls': {'No': 0.345, 'Yes': 0.655}})
 
 	def test_lws_allevidence(self):
 		self.assertDictEqual(marginal_lws_a(self.bn,evidence={'Burglary':'Yes','Alarm':'Yes',
@@ -55,6 +60,27 @@ class MarginalApproxTestCase(unittest.TestCase):
 			 'JohnCalls': {'No': 0.0, 'Yes': 1.0},
 			 'MaryCalls': {'No': 0.0, 'Yes': 1.0}})
 
+	def test_lws_ess(self):
+		ev = {'Burglary':'Yes','Alarm':'Yes','Earthquake':'Yes',
+			'JohnCalls':'Yes','MaryCalls':'Yes'}
+		n_eff, _ = marginal_lws_a(self.bn,evidence=ev,ess=True)
+		self.assertAlmostEqual(n_eff,1000.)
+		cbn = self.bn.compile()
+		data, log_weight = cbn.weighted_sample(3,ev)
+		self.assertListEqual(list(log_weight),list(cbn.log_prob(data)))
+		np.random.seed(3636)
+		n_eff, p = marginal_lws_a(self.bn,evidence={'JohnCalls':'Yes',
+			'MaryCalls':'Yes'},target='Burglary',n=100000,ess=True)
+		self.assertLess(n_eff,1000.)
+		self.assertAlmostEqual(p['Yes'],0.2842,places=1)
+
+	def test_observed_target(self):
+		ev = {'Alarm':'Yes','JohnCalls':'No'}
+		self.assertDictEqual(marginal_lws_a(self.bn,evidence=ev,
+			target='Alarm'),{'No': 0.0, 'Yes': 1.0})
+		self.assertListEqual(list(np.round(loopy_bp(self.bn,'Alarm',
+			evidence=ev).cpt,4)),[0.,1.])
+
 	def test_gibbs(self):
 		np.random.seed(3636)
 		self.assertDictEqual(marginal_gs_a(self.bn,n=1000,burn=200),
@@ -64,12 +90,26 @@ class MarginalApproxTestCase(unittest.TestCase):
 				 'JohnCalls': {'No': 0.9313, 'Yes': 0.0675},
 				 'MaryCalls': {'No': 0.9838, 'Yes': 0.015}})
 
-
-
-
-
-
-
-
-
-
+	def test_loopy_bp(self):
+		# cmu is a polytree, so loopy bp is exact
+		for ev in [{}, {'JohnCalls':'Yes','MaryCalls':'Yes'}]:
+			p = loopy_bp(self.bn,evidence=ev)
+			q = exact_bp(self.bn,evidence=ev)
+			for rv in self.bn.nodes():
+				self.assertListEqual(list(np.round(p[rv].cpt,4)),
+					list(np.round(q[rv].cpt,4)))
+		self.assertListEqual(list(np.round(loopy_bp(self.bn,'Burglary',
+			evidence={'Alarm':'Yes'},damping=0.5).cpt,4)),
+			list(np.round(exact_bp(self.bn,'Burglary',
+			evidence={'Alarm':'Yes'}).cpt,4)))
+
+	def test_cluster_graph_residual(self):
+		cgraph = ClusterGraph(self.bn)
+		cgraph.set_evidence({'JohnCalls':'Yes'})
+		self.assertTrue(cgraph.calibrate(tol=1e-8))
+		self.assertTrue(cgraph.is_calibrated(tol=1e-8))
+		cgraph.set_evidence({})
+		self.assertFalse(cgraph.calibrate(max_iter=0))
+		self.assertTrue(cgraph.calibrate(tol=1e-8))
+		self.assertTrue(cgraph.calibrate(tol=1e-8))
+		self.assertEqual(cgraph.n_updates,0)
@@ -9,11 +9,18 @@ __author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
 
 import unittest
 import os
+import shutil
+import tempfile
+import threading
 from os.path import dirname
 import numpy as np
 
 from pyBN.readwrite.read import read_bn
 from pyBN.inference.marginal_exact import marginal_ve_e
+from pyBN.inference.marginal_exact import marginal_contract, contraction_plan
+from pyBN.inference.marginal_exact import exact_bp
+from pyBN.inference.marginal_exact import marginal_rc, rc_plan
+from pyBN.classes.cliquetree import CliqueTree
 
 
 
@@ -62,6 +69,117 @@ class MarginalExactTestCase(unittest.TestCase):
 		self.assertListEqual(list(marginal_ve_e(self.bn,'Alarm',
 			evidence={'Burglary':'Yes'})),[0.06,0.94])
 
+	def test_marginal_ve_e_log(self):
+		self.assertListEqual(list(marginal_ve_e(self.bn,'Burglary',
+			evidence={'Alarm':'Yes','JohnCalls':'Yes'},log=True)),
+			list(marginal_ve_e(self.bn,'Burglary',
+			evidence={'Alarm':'Yes','JohnCalls':'Yes'})))
+
+	def test_marginal_ve_e_batch(self):
+		p = marginal_ve_e(self.bn,'Burglary',
+			batch_evidence={'Alarm':['Yes','No']})
+		self.assertEqual(p.shape,(2,2))
+		self.assertListEqual(list(p[0]),
+			list(marginal_ve_e(self.bn,'Burglary',evidence={'Alarm':'Yes'})))
+		self.assertListEqual(list(p[1]),
+			list(marginal_ve_e(self.bn,'Burglary',evidence={'Alarm':'No'})))
+
+	def test_observed_target(self):
+		for ev in [{'Alarm':'Yes'}, {'Alarm':'No','JohnCalls':'Yes'}]:
+			p = [0.,1.] if ev['Alarm'] == 'Yes' else [1.,0.]
+			self.assertListEqual(list(marginal_ve_e(self.bn,'Alarm',
+				evidence=ev)),p)
+			self.assertListEqual(list(marginal_contract(self.bn,'Alarm',
+				evidence=ev)),p)
+			self.assertListEqual(list(marginal_rc(self.bn,'Alarm',ev)),p)
+			self.assertListEqual(list(exact_bp(self.bn,'Alarm',
+				evidence=ev).cpt),p)
+
+	def test_marginal_contract(self):
+		for rv in ['Burglary','Earthquake','JohnCalls','MaryCalls']:
+			self.assertListEqual(list(marginal_contract(self.bn,rv,
+				evidence={'Alarm':'Yes'})),
+				list(marginal_ve_e(self.bn,rv,evidence={'Alarm':'Yes'})))
+
+	def test_contraction_plan_cached(self):
+		plan = contraction_plan(self.bn,'Burglary',['Alarm'])
+		self.assertIs(plan, contraction_plan(self.bn,'Burglary',['Alarm']))
+		self.assertListEqual(list(marginal_contract(self.bn,'Burglary',
+			evidence={'Alarm':'No'})),
+			list(marginal_ve_e(self.bn,'Burglary',evidence={'Alarm':'No'})))
+
+	def test_exact_bp(self):
+		for rv in ['Burglary','Earthquake','Alarm','MaryCalls']:
+			self.assertListEqual(list(np.round(exact_bp(self.bn,rv,
+				evidence={'JohnCalls':'Yes'}).cpt,4)),
+				list(marginal_ve_e(self.bn,rv,evidence={'JohnCalls':'Yes'})))
+
+	def test_clique_tree_incremental(self):
+		ctree = CliqueTree(self.bn)
+		self.assertEqual(ctree.calibrate(),4)
+		self.assertEqual(ctree.calibrate(),0)
+		ctree.set_evidence({'JohnCalls':'Yes'})
+		self.assertEqual(ctree.calibrate(),2)
+		for ev in [{'JohnCalls':'Yes'},{'JohnCalls':'Yes','Alarm':'No'},{}]:
+			for rv in ['Burglary','Earthquake','MaryCalls']:
+				self.assertListEqual(list(np.round(exact_bp(self.bn,rv,
+					evidence=ev,ctree=ctree).cpt,4)),
+					list(marginal_ve_e(self.bn,rv,evidence=ev)))
+
+	def test_clique_tree_buffers(self):
+		ctree = CliqueTree(self.bn, log=True)
+		ctree.calibrate()
+		msg = dict(ctree._msg)
+		ctree.set_evidence({'Alarm':'Yes'})
+		ctree.calibrate()
+		for edge in msg:
+			self.assertIs(ctree._msg[edge], msg[edge])
+		self.assertListEqual(list(np.round(ctree.marginal('Burglary').cpt,4)),
+			list(marginal_ve_e(self.bn,'Burglary',evidence={'Alarm':'Yes'})))
+
+	def test_clique_tree_parallel(self):
+		n_threads = threading.active_count()
+		ctree = CliqueTree(self.bn, n_jobs=2)
+		ctree.parallel_min_size = 0
+		ctree.set_evidence({'JohnCalls':'Yes'})
+		self.assertEqual(ctree.calibrate(),4)
+		self.assertEqual(threading.active_count(),n_threads)
+		for rv in ['Burglary','Earthquake','Alarm','MaryCalls']:
+			self.assertListEqual(list(np.round(ctree.marginal(rv).cpt,4)),
+				list(marginal_ve_e(self.bn,rv,evidence={'JohnCalls':'Yes'})))
+
+	def test_clique_tree_save_load(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			path = os.path.join(tmp,'cmu.npz')
+			CliqueTree(self.bn).save(path)
+			for bn in [None, self.bn]:
+				ctree = CliqueTree.load(path, bn=bn)
+				ctree.set_evidence({'JohnCalls':'Yes'})
+				self.assertListEqual(list(np.round(ctree.marginal('Burglary').cpt,4)),
+					list(marginal_ve_e(self.bn,'Burglary',evidence={'JohnCalls':'Yes'})))
+			bn = CliqueTree.load(path).bn
+			self.assertListEqual(list(bn.nodes()),list(self.bn.nodes()))
+			self.assertListEqual(bn.cpt('Alarm'),list(self.bn.cpt('Alarm')))
+			bn = read_bn(os.path.join(self.dpath,'cmu.bn'))
+			bn.F['Alarm']['cpt'] = [0.5]*8
+			self.assertRaises(ValueError, CliqueTree.load, path, bn)
+		finally:
+			shutil.rmtree(tmp)
+
+	def test_marginal_rc(self):
+		for ev in [{}, {'JohnCalls':'Yes'}, {'JohnCalls':'Yes','MaryCalls':'No'}]:
+			for rv in ['Burglary','Earthquake','Alarm']:
+				for memory in [None, 0]:
+					self.assertListEqual(list(marginal_rc(self.bn,rv,
+						evidence=ev,memory=memory)),
+						list(marginal_ve_e(self.bn,rv,evidence=ev)))
+		full = rc_plan(self.bn,'Burglary',['JohnCalls'])
+		none = rc_plan(self.bn,'Burglary',['JohnCalls'],memory=0)
+		self.assertEqual(none['cache_size'],0)
+		self.assertLessEqual(full['cache_size'],full['full_cache_size'])
+		self.assertLess(full['calls'],none['calls'])
+
 #	def test_marginal_ve_e_middle_leaf_ev(self):
 #		self.assertListEqual(list(marginal_ve_e(self.bn,'Alarm',
 #			evidence={'JohnCalls':'Yes'})),[ 0.95769,  0.04231])
@@ -0,0 +1 @@
+from pyBN.inference.map_approx.loopy_map import *
\ No newline at end of file
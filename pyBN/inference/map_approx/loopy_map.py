@@ -0,0 +1,82 @@
+
+__author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
+
+from pyBN.classes.clustergraph import ClusterGraph
+
+
+
+def loopy_map(bn,
+            evidence={},
+            target=None,
+            max_iter=100,
+            tol=1e-6,
+            damping=0.,
+            rho=None,
+            max_time=None,
+            cgraph=None):
+    """
+    Perform Max-Product Loopy Belief Propagation over a Bethe
+    cluster graph for approximate maximum a posteriori (MPE)
+    inference.
+
+    Every message is a vector, so unlike ve_map and jt_map this
+    runs on networks whose induced width is far too large for
+    exact inference, and it always stops within *max_iter*
+    messages per edge (and *max_time* seconds). The assignment
+    is decoded from the messages in topological order and then
+    improved by iterated conditional modes (see ClusterGraph.mpe),
+    and its joint log-probability with the
+    evidence is returned as the objective to compare runs by.
+
+    Arguments
+    ---------
+    *bn* : a BayesNet object
+
+    *evidence* : a dictionary, where
+        key = rv and value = rv value
+
+    *target* : a string or None
+        If given, only the MAP value of *target* is returned.
+
+    *max_iter* : an integer
+        The largest number of messages sent, per edge of
+        the cluster graph.
+
+    *tol* : a float
+        The convergence tolerance on the change of any message.
+
+    *damping* : a float in [0,1)
+        How much of its old value every sent message keeps.
+
+    *rho* : a float in (0,1] or None
+        If given, the messages are tree-reweighted with this
+        edge appearance probability (see ClusterGraph.calibrate).
+        Reweighted messages oscillate less than ordinary
+        max-product messages on strongly loopy networks.
+
+    *max_time* : a float or None
+        The largest number of seconds to spend sending messages.
+
+    *cgraph* : a ClusterGraph object or None
+        A cluster graph already built from *bn*. Its max-product
+        messages are reused as the starting point.
+
+    Returns
+    -------
+    A tuple (*log_prob*, *max_assignment*), where *max_assignment*
+    is a dictionary where key = rv and value = rv value (or the
+    MAP value of *target*) and *log_prob* is the joint
+    log-probability of the whole assignment and the evidence.
+
+    """
+    if cgraph is None:
+        cgraph = ClusterGraph(bn)
+    cgraph.set_evidence(evidence)
+    cgraph.calibrate(max_iter, tol, damping, max_product=True, rho=rho,
+        max_time=max_time)
+    log_prob, max_assignment = cgraph.mpe(score=True)
+
+    if target is not None:
+        return log_prob, max_assignment[target]
+    else:
+        return log_prob, max_assignment
@@ -1,2 +1,3 @@
 from pyBN.inference.map_exact.ilp_map import *
+from pyBN.inference.map_exact.jt_map import *
 from pyBN.inference.map_exact.ve_map import *
\ No newline at end of file
@@ -0,0 +1,81 @@
+
+__author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
+
+import numpy as np
+
+from pyBN.classes.cliquetree import CliqueTree
+
+
+
+def jt_map(bn,
+            evidence={},
+            target=None,
+            prob=False,
+            log=False,
+            ctree=None,
+            heuristic='min_fill',
+            n_jobs=1):
+    """
+    Perform Max-Product Message Passing over a Clique Tree
+    for exact maximum a posteriori (MPE) inference.
+
+    Unlike ve_map, the clique tree can be compiled once and
+    passed in as *ctree* for many queries: only the max-product
+    messages which depend on evidence that changed since the
+    tree's last query are recomputed. After a query, the
+    max-marginal of any rv - i.e. the confidence of its MAP
+    value - is available from ctree.max_marginal(rv).
+
+    Arguments
+    ---------
+    *bn* : a BayesNet object
+
+    *evidence* : a dictionary, where
+        key = rv and value = rv value
+
+    *target* : a string or None
+        If given, only the MAP value of *target* is returned.
+
+    *prob* : a boolean
+        Whether to also return the probability of the
+        MAP assignment (jointly with the evidence).
+
+    *log* : a boolean
+        Whether the clique potentials and messages are
+        kept in log space.
+
+    *ctree* : a CliqueTree object or None
+        A clique tree already compiled from *bn*.
+
+    *heuristic* : a string or a function
+        The elimination order heuristic used to triangulate
+        the moral graph - see "pyBN.utils.elimination_order".
+
+    *n_jobs* : an integer
+        The number of threads used to compute messages.
+
+    Returns
+    -------
+    The same as ve_map: the MAP assignment (a dictionary where
+    key = rv and value = rv value) or the MAP value of *target*,
+    preceded by the MAP probability if *prob* is True.
+
+    """
+    if ctree is None:
+        ctree = CliqueTree(bn, log=log, heuristic=heuristic, n_jobs=n_jobs)
+    ctree.set_evidence(evidence)
+    max_prob, max_assignment = ctree.mpe(prob=True)
+
+    if prob:
+        if ctree.log:
+            max_prob = np.exp(max_prob)
+        max_prob = round(max_prob,5)
+        if target is not None:
+            return max_prob, max_assignment[target]
+        else:
+            return max_prob, max_assignment
+    else:
+        if target is not None:
+            return max_assignment[target]
+        else:
+            return max_assignment
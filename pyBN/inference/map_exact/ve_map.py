@@ -6,29 +6,65 @@ import numpy as np
 
 from pyBN.classes.factor import Factor
 from pyBN.classes.factorization import Factorization
+from pyBN.utils.elimination_order import elimination_order
 
 
 
 def ve_map(bn,
             evidence={},
             target=None,
-            prob=False):
+            prob=False,
+            log=False,
+            batch_evidence=None,
+            heuristic='min_fill'):
     """
     Perform Max-Sum Variable Elimination over a BayesNet object
     for exact maximum a posteriori inference.
 
     This has been validated w/ and w/out evidence
+
+    If *log* is True, the elimination is done in log space
+    (i.e. true max-sum), which avoids underflow of the
+    maximum probability on large networks.
+
+    If *batch_evidence* is given (a dictionary where key = rv and
+    value = a list of B rv values), *target* must be set and every
+    variable except *target* is maxed out for all B evidence rows
+    at once. A (B x card) numpy array is returned whose row b is the
+    normalized max-marginal of *target* given evidence row b - its
+    argmax is the value of *target* in the MAP assignment for row b.
+
+    Variables are maxed out in the order chosen by *heuristic*
+    (see "pyBN.utils.elimination_order"), or in bn.nodes() order
+    if *heuristic* is None.
     
     """
-    _phi = Factorization(bn)
+    _phi = Factorization(bn, log=log)
 
-    order = copy(list(bn.nodes()))
     #### EVIDENCE PROCESSING ####
     for E, e in evidence.items():
         _phi -= (E,e)
-        order.remove(E)
+
+    if batch_evidence is not None:
+        assert (target is not None), 'Must set target with batch_evidence.'
+        for E, e in batch_evidence.items():
+            _phi -= (E,list(e))
+        observed = list(evidence.keys()) + list(batch_evidence.keys())
+        order = elimination_order(bn, target, observed, heuristic)['order']
+        for var in order:
+            _phi //= var
+        final_phi = _phi.consolidate()
+        if final_phi.batch is None:
+            n = len(list(batch_evidence.values())[0])
+            final_phi.batch = n
+            final_phi.cpt = np.tile(final_phi.cpt, (n,1))
+        final_phi.normalize()
+        if log:
+            final_phi.from_log(decimals=None)
+        return np.round(final_phi.cpt,5)
 
     #### MAX-PRODUCT ELIMINATE VAR ####
+    order = elimination_order(bn, None, evidence.keys(), heuristic)['order']
     for var in order:
         _phi //= var 
     
@@ -39,6 +75,8 @@ def ve_map(bn,
     if prob:
         # multiply phi's together if there is evidence
         final_phi = _phi.consolidate()
+        if log:
+            final_phi.from_log(decimals=None)
         max_prob = round(final_phi.cpt[0],5)
 
         if target is not None:
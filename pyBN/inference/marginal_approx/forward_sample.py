@@ -1,7 +1,3 @@
-from pyBN.classes.bayesnet import BayesNet
-from pyBN.classes.factor import Factor 
-from pyBN.utils.graph import topsort
-
 import numpy as np
 
 
@@ -39,31 +35,16 @@ def forward_sample(bn, n=1000):
 	Notes
 	-----
 	- Evidence is not currently implemented.
+	- Each rv is sampled for all *n* samples at once, from
+		cumulative cpt tables (see CompiledBayesNet.sample).
 	"""
 
-	sample_dict = {}
-	for var in bn.nodes():
-	    sample_dict[var] = {}
-	    for val in bn.values(var):
-	        sample_dict[var][val] = 0
-
-	for i in range(n):
-	    #if i % (n/float(10)) == 0:
-	     #   print 'Sample: ' , i
-	    new_sample = {}
-	    for rv in bn.nodes():
-	        f = Factor(bn,rv)
-	        for p in bn.parents(rv):
-	            f.reduce_factor(p,new_sample[p])
-	        choice_vals = bn.values(rv)
-	        choice_probs = f.cpt
-	        chosen_val = np.random.choice(choice_vals, p=choice_probs)
+	data = bn.compile().sample(n)
 
-	        sample_dict[rv][chosen_val] += 1
-	        new_sample[rv] = chosen_val
+	sample_dict = {}
+	for i, rv in enumerate(bn.nodes()):
+		counts = np.bincount(data[:,i], minlength=bn.card(rv))
+		sample_dict[rv] = dict([(val, int(counts[j]) / float(n)) \
+			for j, val in enumerate(bn.values(rv))])
 
-	for rv in sample_dict:
-	    for val in sample_dict[rv]:
-	        sample_dict[rv][val] = int(sample_dict[rv][val]) / float(n)
-	
-	return sample_dict
\ No newline at end of file
+	return sample_dict
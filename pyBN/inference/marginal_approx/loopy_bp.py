@@ -1,75 +1,76 @@
 
 __author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
 
-from pyBN.classes.bayesnet import BayesNet
-from pyBN.classes.factor import Factor 
-from pyBN.utils.graph import topsort
+from pyBN.classes.clustergraph import ClusterGraph
+from pyBN.classes.factor import Factor
+from pyBN.utils.relevance import prune_network
 
 import numpy as np
 
 
-def loopy_bp(target=None, evidence=None, max_iter=100):
+def loopy_bp(bn, target=None, evidence=None, max_iter=100, tol=1e-6,
+	damping=0., cgraph=None):
 	"""
-	Perform Message Passing (Loopy Belief Propagation) 
-	over a cluster graph.
-
-	This is a good candidate for Numba JIT.
+	Perform Message Passing (Loopy Belief Propagation)
+	over a Bethe cluster graph.
 
 	See Koller pg. 397.
 
+	Messages are sent in order of their residual - i.e. the
+	message which would change the most is sent first - until
+	no message would change by more than *tol*. The marginals
+	are approximate, but every message is a vector, so this
+	runs on networks which are far too large for a clique tree.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string or None
+		The rv whose marginal is returned. If None, the
+		marginal of every rv is returned.
+
+	*evidence* : a dictionary, where
+		key = rv and value = rv value
 
-	Parameters
-	----------
+	*max_iter* : an integer
+		The largest number of messages sent, per edge of
+		the cluster graph.
 
+	*tol* : a float
+		The convergence tolerance on the change of any message.
+
+	*damping* : a float in [0,1)
+		How much of its old value every sent message keeps.
+		Try 0.5 if the messages oscillate.
+
+	*cgraph* : a ClusterGraph object or None
+		A cluster graph already built from *bn*. Its messages
+		are reused as the starting point.
 
 	Returns
 	-------
-
+	*marginal* : a Factor object holding the target's
+		approximate marginal conditional probability distribution
+		- or, if *target* is None, a dictionary where key = rv
+		and value = that rv's marginal Factor.
 
 	Notes
 	-----
-	- Copied from clustergraph class... not tested.
-	- Definitely a problem due to normalization (prob vals way too small)
-	- Need to check the scope w.r.t. messages.. all clusters should not
-	be accumulating rv's in their scope over the course of the algorithm.
+	- If *target* is given and *cgraph* is not, the cluster
+		graph is only built over the nodes relevant to the query
+		(see "pyBN.utils.relevance").
+	- On a network without loops (a polytree), the marginals
+		are exact.
 	"""
-	def collect_beliefs(cgraph):
-		cgraph.beliefs = {}
-		for cluster in self.V:
-			cgraph.V[cluster].collect_beliefs()
-			#print('Belief ' , cluster , ' : \n', self.V[cluster].belief.cpt)
-			cgraph.beliefs[cluster] = cgraph.V[cluster].belief
-
-	# 1: Moralize the graph
-	# 2: Triangluate
-	# 3: Build a clique tree using max spanning
-	# 4: Propagation of probabilities using message passing
-
-	# creates clique tree and assigns factors, thus satisfying steps 1-3
-	cgraph = ClusterGraph(bn)
-
-	edge_visit_dict = dict([(i,0) for i in cgraph.E])
-
-	iteration = 0
-	while not cgraph.is_calibrated():
-		if iteration == max_iter:
-			break
-		if iteration % 50 == 0:
-			print('Iteration: ' , iteration)
-			for cluster in cgraph.V.values():
-				cluster.collect_beliefs()
-		# select an edge
-		e_idx = np.random.randint(0,len(cgraph.E))
-		edge_select = cgraph.E[e_idx]
-		p_idx = np.random.randint(0,2)
-		parent_edge = edge_select[p_idx]
-		child_edge = edge_select[np.abs(p_idx-1)]
-		print(parent_edge , child_edge)
-
-		# send a message along that edge
-		cgraph.V[parent_edge].send_message(cgraph.V[child_edge])
-
-		iteration += 1
-	print('Now Collecting Beliefs..')
-	collect_beliefs(cgraph)
-	#bn.ctree = self
\ No newline at end of file
+	if evidence is None:
+		evidence = {}
+	if cgraph is None:
+		if target is not None:
+			bn = prune_network(bn, target,
+				[rv for rv in evidence if rv != target])
+			evidence = dict([(rv, val) for rv, val in evidence.items() \
+				if rv in bn.F])
+		cgraph = ClusterGraph(bn)
+	return cgraph.loopy_belief_propagation(target, evidence,
+		max_iter, tol, damping)
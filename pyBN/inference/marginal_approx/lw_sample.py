@@ -1,18 +1,20 @@
 __author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
 
-from pyBN.classes.bayesnet import BayesNet
-from pyBN.classes.factor import Factor 
-from pyBN.utils.graph import topsort
+from pyBN.utils.relevance import prune_network
 
 import numpy as np
 
 
-def lw_sample(bn, evidence={}, target=None, n=1000):
+def lw_sample(bn, evidence={}, target=None, n=1000, ess=False):
 	"""
 	Approximate Marginal probabilities from
 	likelihood weighted sample algorithm on
 	a BayesNet object.
 
+	All *n* samples are drawn at once, one rv at a time
+	(see CompiledBayesNet.weighted_sample), and the weights
+	are kept in log space until they are normalized.
+
 	Arguments
 	---------
 	*bn* : a BayesNet object
@@ -23,12 +25,21 @@ def lw_sample(bn, evidence={}, target=None, n=1000):
 	*evidence* : a dictionary, where
 		key = rv, value = instantiation
 
+	*target* : a string or None
+		If given, only the nodes relevant to P(target | evidence)
+		are sampled (see "pyBN.utils.relevance"), and only the
+		target's dictionary is returned.
+
+	*ess* : a boolean
+		Whether to also return the effective sample size.
+
 	Returns
 	-------
 	*sample_dict* : a dictionary where key = rv
 		and value = another dictionary where
 		key = rv instantiation and value = marginal
-		probability
+		probability - preceded by the effective sample
+		size if *ess* is True.
 
 	Effects
 	-------
@@ -36,51 +47,39 @@ def lw_sample(bn, evidence={}, target=None, n=1000):
 
 	Notes
 	-----
-
+	- The effective sample size (sum w)^2 / sum(w^2) is the
+		number of unweighted samples the weighted ones are
+		worth. When it is a small fraction of *n*, the evidence
+		is unlikely under the prior and the marginals are noisy.
+	- If every sample contradicts the evidence, every
+		probability is 0 and the effective sample size is 0.
 	"""
+	if target is not None:
+		bn = prune_network(bn, target, evidence)
+		evidence = dict([(rv, val) for rv, val in evidence.items() \
+			if rv in bn.F])
+
+	cbn = bn.compile()
+	data, log_weight = cbn.weighted_sample(n, evidence)
+
+	top = np.max(log_weight) if n > 0 else -np.inf
+	if np.isfinite(top):
+		weight = np.exp(log_weight - top)
+		weight /= np.sum(weight)
+		n_eff = 1. / np.sum(weight**2)
+	else:
+		weight = np.zeros(n)
+		n_eff = 0.
+
 	sample_dict = {}
-	weight_list = np.ones(n)
-
-	#factor_dict = dict([(var,Factor(bn, var)) for var in bn.V])
-	#parent_dict = dict([(var, bn.data[var]['parents']) for var in bn.V])
-
-	for var in bn.nodes():
-	    sample_dict[var] = {}
-	    for val in bn.values(var):
-	        sample_dict[var][val] = 0
-
-	for i in range(n):
-	    #if i % (n/float(10)) == 0:
-	     #   print 'Sample: ' , i
-	    new_sample = {}
-	    for rv in bn.nodes():
-	        f = Factor(bn,rv)
-	        # reduce_factor by parent samples
-	        for p in bn.parents(rv):
-	            f.reduce_factor(p,new_sample[p])
-	        # if rv in evidence, choose that value and weight
-	        if rv in evidence:
-	            chosen_val = evidence[rv]
-	            weight_list[i] *= f.cpt[bn.values(rv).index(evidence[rv])]
-	        # if rv not in evidence, sample as usual
-	        else:
-	            choice_vals = bn.values(rv)
-	            choice_probs = f.cpt
-	            chosen_val = np.random.choice(choice_vals, p=choice_probs)
-	            
-	        new_sample[rv] = chosen_val
-	    # weight the choice by the evidence likelihood    
-	    for rv in new_sample:
-	        sample_dict[rv][new_sample[rv]] += 1*weight_list[i]
-
-	weight_sum = sum(weight_list)
-
-	for rv in sample_dict:
-	    for val in sample_dict[rv]:
-	        sample_dict[rv][val] /= weight_sum
-	        sample_dict[rv][val] = round(sample_dict[rv][val],4)
-	
+	for i, rv in enumerate(cbn.nodes()):
+		p = np.bincount(data[:,i], weights=weight, minlength=cbn.card(rv))
+		sample_dict[rv] = dict([(val, round(p[j],4)) \
+			for j, val in enumerate(cbn.values(rv))])
+
 	if target is not None:
-		return sample_dict[target]
+		sample_dict = sample_dict[target]
+	if ess:
+		return n_eff, sample_dict
 	else:
-		return sample_dict
\ No newline at end of file
+		return sample_dict
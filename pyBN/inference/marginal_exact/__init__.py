@@ -1,2 +1,4 @@
 from pyBN.inference.marginal_exact.exact_bp import *
-from pyBN.inference.marginal_exact.ve_marginal import *
\ No newline at end of file
+from pyBN.inference.marginal_exact.ve_marginal import *
+from pyBN.inference.marginal_exact.contraction import *
+from pyBN.inference.marginal_exact.rc_marginal import *
@@ -0,0 +1,247 @@
+"""
+*******************
+Tensor Contraction
+Marginal Inference
+*******************
+
+Answers a whole Variable Elimination query as a sequence
+of pairwise np.einsum contractions over the (unnormalized)
+CPT tensors of a Bayesian Network.
+
+Instead of multiplying every relevant factor together and
+then summing out one variable at a time (as Factorization
+does), a contraction plan is computed once per
+(network, target, evidence variables) triple: each CPT and
+each piece of evidence is an operand, and a greedy optimizer
+picks the pair of operands whose contraction gives the
+smallest intermediate tensor. Variables are summed out as
+soon as no other operand (and not the target) needs them.
+
+Plans are cached, so repeated queries with the same target
+and the same set of evidence variables (but possibly different
+evidence values) skip both planning and almost all of the
+Python overhead - the query is just the plan's einsum calls.
+
+Evidence enters the contraction as one-hot vector operands,
+which is why the plan does not depend on evidence values.
+
+A single np.einsum call can only address 52 distinct
+variables, so the whole query is never one call - each
+pairwise contraction gets its own subscripts instead.
+
+References
+----------
+[1] Koller, Friedman (2009). "Probabilistic Graphical Models."
+
+"""
+
+__author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
+
+import numpy as np
+
+from pyBN.utils.plan_cache import cached_plan
+from pyBN.utils.relevance import relevant_nodes
+
+_LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# a fixed path for pairwise contractions lets np.einsum hand
+# them to tensordot (BLAS) without searching for a path
+_PAIR_PATH = ['einsum_path', (0, 1)]
+
+def marginal_contract(bn, target, evidence={}):
+	"""
+	Perform Sum-Product Variable Elimination on a Discrete
+	Bayesian Network by contracting its CPT tensors along
+	a cached contraction plan.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string
+		The rv whose marginal distribution is returned.
+
+	*evidence* : a dictionary, where
+		key = rv and value = rv value
+
+	Returns
+	-------
+	*marginal* : a numpy array containing the target's
+		marginal conditional probability distribution, the
+		same as marginal_ve_e returns.
+
+	Notes
+	-----
+	- Every intermediate tensor is rescaled by its maximum,
+		so many pieces of evidence do not underflow to zero.
+	"""
+	plan = contraction_plan(bn, target, evidence.keys())
+
+	operands = []
+	for rv in plan['nodes']:
+		operands.append(np.asarray(bn.cpt(rv), dtype=np.float64).reshape(
+			[bn.card(p) for p in reversed(bn.parents(rv))] + [bn.card(rv)]))
+	for E in plan['evidence']:
+		e = np.zeros(bn.card(E))
+		e[bn.values(E).index(evidence[E])] = 1.
+		operands.append(e)
+
+	for i, j, subscripts in plan['steps']:
+		if j is None:
+			psi = np.einsum(subscripts, operands[i])
+		else:
+			psi = np.einsum(subscripts, operands[i], operands[j],
+				optimize=_PAIR_PATH)
+			operands[j] = None
+		m = np.max(psi)
+		if m > 0:
+			psi /= m
+		operands[i] = None
+		operands.append(psi)
+
+	psi = operands[-1]
+	return np.round(psi / np.sum(psi), 4)
+
+def contraction_plan(bn, target, evidence_vars=[]):
+	"""
+	Get the (cached) contraction plan for a query on *target*
+	given evidence on *evidence_vars*.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string
+
+	*evidence_vars* : a list of rvs with observed values
+
+	Returns
+	-------
+	*plan* : a dictionary, where
+		'nodes' = the rvs whose CPTs are the first operands -
+			only those which are relevant to the query (see
+			"pyBN.utils.relevance")
+		'evidence' = the (relevant) evidence rvs, whose one-hot
+			vectors are the next operands
+		'steps' = a list of (i, j, subscripts) tuples - contract
+			operands i and j (j is None for a single operand) with
+			np.einsum and append the result to the operand list.
+		'cost' = the total number of entries of all intermediate
+			tensors, a proxy for time and memory.
+		'width' = the largest number of variables in any
+			intermediate tensor.
+
+	Notes
+	-----
+	- Plans are cached by network structure (see
+		"pyBN.utils.plan_cache").
+	"""
+	evidence_vars = frozenset(evidence_vars)
+
+	def _build():
+		factor_nodes, _ = relevant_nodes(bn, target, evidence_vars)
+		needed = set([rv for n in factor_nodes for rv in bn.scope(n)])
+		return _greedy_plan(bn, factor_nodes, target,
+			sorted([E for E in evidence_vars if E in needed]))
+
+	return cached_plan('contraction', bn, (target, evidence_vars), _build)
+
+def _greedy_plan(bn, nodes, target, evidence_vars):
+	"""
+	Build a contraction plan by greedily contracting the pair
+	of operands (sharing at least one variable, if possible)
+	whose result has the smallest number of entries.
+	"""
+	scopes = [list(reversed(bn.parents(rv))) + [rv] for rv in nodes]
+	scopes.extend([[E] for E in evidence_vars])
+	card = dict([(rv, bn.card(rv)) for scope in scopes for rv in scope])
+
+	# which live operands contain each rv
+	holders = dict([(rv, set()) for rv in card])
+	for i, scope in enumerate(scopes):
+		for rv in scope:
+			holders[rv].add(i)
+	live = set(range(len(scopes)))
+
+	def _size(scope):
+		s = 1
+		for rv in scope:
+			s *= card[rv]
+		return s
+
+	def _result(ids):
+		# variables which survive contracting the operands *ids*
+		out = []
+		for i in ids:
+			for rv in scopes[i]:
+				if rv not in out and (rv == target or \
+						len(holders[rv] - set(ids)) > 0):
+					out.append(rv)
+		return out
+
+	def _subscripts(ids, out):
+		letters = {}
+		for rv in [rv for i in ids for rv in scopes[i]] + out:
+			if rv not in letters:
+				assert (len(letters) < len(_LETTERS)), \
+					'Contraction is wider than 52 variables.'
+				letters[rv] = _LETTERS[len(letters)]
+		return ','.join([''.join([letters[rv] for rv in scopes[i]])
+			for i in ids]) + '->' + ''.join([letters[rv] for rv in out])
+
+	def _contract(ids):
+		out = _result(ids)
+		for i in ids:
+			live.discard(i)
+			for rv in scopes[i]:
+				holders[rv].discard(i)
+		k = len(scopes)
+		scopes.append(out)
+		for rv in out:
+			holders[rv].add(k)
+		live.add(k)
+		steps.append((ids[0], ids[1] if len(ids) > 1 else None,
+			_subscripts(ids, out)))
+		return _size(out), len(out)
+
+	steps = []
+	cost = 0
+	width = 0
+
+	# sum out variables which only appear in one operand
+	for i in range(len(scopes)):
+		if len(_result([i])) < len(scopes[i]):
+			c, w = _contract([i])
+			cost += c
+			width = max(width, w)
+
+	while len(live) > 1:
+		best = None
+		for rv in holders:
+			ids = sorted(holders[rv])
+			for a in range(len(ids)):
+				for b in range(a+1, len(ids)):
+					pair = (ids[a], ids[b])
+					c = _size(_result(pair)) - \
+						_size(scopes[pair[0]]) - _size(scopes[pair[1]])
+					if best is None or c < best[0]:
+						best = (c, pair)
+		if best is None:
+			# only disconnected operands are left
+			pair = tuple(sorted(live, key=lambda i: _size(scopes[i]))[:2])
+		else:
+			pair = best[1]
+		c, w = _contract(list(pair))
+		cost += c
+		width = max(width, w)
+
+	final = list(live)[0]
+	if scopes[final] != [target]:
+		c, w = _contract([final])
+		cost += c
+
+	return {'nodes': nodes,
+			'evidence': evidence_vars,
+			'steps': steps,
+			'cost': cost,
+			'width': width}
@@ -1,16 +1,19 @@
 
 __author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
 
+from pyBN.classes.cliquetree import CliqueTree
 from pyBN.classes.factor import Factor
 from pyBN.classes.factorization import Factorization
 from pyBN.utils.graph import *
+from pyBN.utils.relevance import prune_network
 
 from copy import deepcopy, copy
 import numpy as np
 import json
 
 
-def exact_bp(bn, target=None, evidence=None, downward_pass=False):
+def exact_bp(bn, target=None, evidence=None, downward_pass=False, log=False,
+	ctree=None, heuristic='min_fill', n_jobs=1):
 	"""
 	Perform Belief Propagation (Message Passing) over a Clique Tree. This
 	is sometimes referred to as the "Junction Tree Algorithm" or
@@ -37,60 +40,74 @@ def exact_bp(bn, target=None, evidence=None, downward_pass=False):
 	---------
 	*bn* : a BayesNet object
 
+	*target* : a string or None
+		The rv whose marginal is returned. If None, the tree
+		is calibrated and the marginal of every rv is returned.
+
+	*evidence* : a dictionary, where
+		key = rv and value = rv value
+
+	*downward_pass* : a boolean
+		Whether to calibrate the whole tree even though only
+		the messages into the target's clique are needed.
+
+	*log* : a boolean
+		Whether the clique potentials and messages are
+		kept in log space.
+
+	*ctree* : a CliqueTree object or None
+		A clique tree already compiled from *bn*. Steps 1-3
+		are then skipped, and only the messages which depend
+		on evidence that changed since the tree's last query
+		are recomputed.
+
+	*heuristic* : a string or a function
+		The elimination order heuristic used to triangulate
+		the moral graph - see "pyBN.utils.elimination_order".
+
+	*n_jobs* : an integer
+		The number of threads used to compute messages from
+		independent subtrees at the same time.
+
 	Returns
 	-------
-
+	*marginal* : a Factor object holding the target's
+		marginal conditional probability distribution - or,
+		if *target* is None, a dictionary where key = rv and
+		value = that rv's marginal Factor.
 
 	Notes
 	-----
+	- If *target* is given and *ctree* is not, the clique tree
+		is only built over the nodes relevant to the query
+		(see "pyBN.utils.relevance").
+	- To answer many queries on one network, build the tree
+		once with CliqueTree(bn) and pass it as *ctree*.
 
 	"""
-	# 1: Moralize the graph
-	# 2: Triangluate
-	# 3: Build a clique tree using max spanning
-	# 4: Propagation of probabilities using message passing
+	if evidence is None:
+		evidence = {}
+	if ctree is None:
+		if target is not None:
+			bn = prune_network(bn, target,
+				[rv for rv in evidence if rv != target])
+			if bn.num_edges() == 0:
+				# target has no ancestors - its cpt is the marginal
+				if target in evidence:
+					phi = Factor(bn, target)
+					phi.observe_var(target, evidence[target])
+					phi.normalize()
+					return phi
+				return Factor(bn, target)
+			evidence = dict([(rv, val) for rv, val in evidence.items() \
+				if rv in bn.F])
+		# creates clique tree and assigns factors, thus satisfying steps 1-3
+		ctree = CliqueTree(bn, log=log, heuristic=heuristic, n_jobs=n_jobs)
 
-	# creates clique tree and assigns factors, thus satisfying steps 1-3
-	ctree = CliqueTree(bn) # might not be initialized?
-	#G = ctree.G
-	#cliques = copy.copy(ctree.V)
-
-	# select a clique as root where target is in scope of root
-	root = ctree.V[0]
-	if target is not None:
-		for v in ctree.V:
-			if target in ctree[v].scope:
-				root = v
-				break
-
-	
-	clique_ordering = ctree.dfs_postorder(root=root)
-
-	# UPWARD PASS
-	# send messages up the tree from the leaves to the single root
-	for i in clique_ordering:
-		#clique = ctree[i]
-		for j in ctree.parents(i):
-			ctree[i] >> ctree[j] 
-			#clique.send_message(ctree[j])
-		# if root node, collect its beliefs
-		#if len(ctree.parents(i)) == 0:
-			#ctree[root].collect_beliefs()
-	ctree[root].collect_beliefs()
-	marginal_target = ctree[root].marginalize_over(target)
-
-	# DOWNWARD PASS
-	if downward_pass == True:
-		# send messages down the tree from the root to the leaves
-		# (not needed unless *target* involves more than one variable)
-		new_ordering = list(reversed(clique_ordering))
-		for j in new_ordering:
-			for i in ctree.children(j):
-				ctree[j] >> ctree[i]
-			# if leaf node, collect its beliefs
-			if len(ctree.children(j)) == 0:                    
-				ctree[j].collect_beliefs()
-
-	return marginal_target
-
-	# beliefs hold the answers
\ No newline at end of file
+	# 4: Propagation of probabilities using message passing
+	ctree.set_evidence(evidence)
+	if downward_pass == True or target is None:
+		ctree.calibrate()
+	if target is None:
+		return dict([(rv, ctree.marginal(rv)) for rv in ctree.bn.nodes()])
+	return ctree.marginal(target)
@@ -0,0 +1,368 @@
+"""
+**********************
+Recursive Conditioning
+Marginal Inference
+**********************
+
+Answers a marginal query P(target | evidence) by Recursive
+Conditioning [1] over a dtree - a full binary tree whose leaves
+are the CPT factors of the network.
+
+Every internal node T of the dtree splits its factors into
+two halves. Its cutset - the variables shared by both halves
+which are not instantiated above T - is summed out by looping
+over its instantiations: for each one, both halves are solved
+recursively (and independently) and their results multiplied.
+Without any caching this needs memory linear in the size of
+the network, but the same sub-problem is solved again for
+every instantiation of the cutsets above it.
+
+The answer of a sub-problem only depends on the instantiation
+of the context of T - the variables of T which are instantiated
+above T - so T can cache one number per context instantiation.
+Caching every node solves each sub-problem once, in about the
+time and memory of a clique tree; caching no node uses linear
+memory but exponential time. Given a memory budget, rc_plan
+fills the caches which fit (smallest first), so exact answers
+remain possible on networks whose clique tree does not fit
+in memory - at the price of recomputation.
+
+The dtree is built from an elimination order [2], so its
+cutsets and contexts follow the same triangulation as
+Variable Elimination and clique trees do.
+
+References
+----------
+[1] Darwiche (2001). "Recursive Conditioning."
+	Artificial Intelligence 126(1-2), 5-41.
+[2] Darwiche (2009). "Modeling and Reasoning with Bayesian
+	Networks." Chapter 12.
+
+"""
+
+__author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
+
+from array import array
+from itertools import product
+import numpy as np
+
+from pyBN.classes.factorization import Factorization
+from pyBN.utils.elimination_order import elimination_order
+from pyBN.utils.plan_cache import cached_plan
+from pyBN.utils.relevance import prune_network
+
+def marginal_rc(bn, target, evidence={}, memory=None, heuristic='min_fill'):
+	"""
+	Perform Recursive Conditioning on a Discrete Bayesian
+	Network, with caches which fit in *memory* bytes.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string
+		The rv whose marginal distribution is returned.
+
+	*evidence* : a dictionary, where
+		key = rv and value = rv value
+
+	*memory* : an integer or None
+		The number of bytes the caches may take up (8 per
+		cached number). If None, every useful cache is filled.
+		Call rc_plan() with the same arguments to see how much
+		the full caches would take and how many recursive calls
+		a budget costs.
+
+	*heuristic* : a string or a function
+		The elimination order heuristic the dtree is built
+		from - see "pyBN.utils.elimination_order".
+
+	Returns
+	-------
+	*marginal* : a numpy array containing the target's
+		marginal conditional probability distribution, the
+		same as marginal_ve_e returns.
+
+	Notes
+	-----
+	- Barren and d-separated nodes are pruned from the network
+		before the dtree is built (see "pyBN.utils.relevance").
+	- The probability of the evidence is computed in normal
+		space, so a very large amount of evidence can underflow
+		to zero - use marginal_ve_e with log=True for those queries.
+	"""
+	bn = prune_network(bn, target, [rv for rv in evidence if rv != target])
+	evidence = dict([(rv, val) for rv, val in evidence.items() \
+		if rv in bn.F])
+	plan = rc_plan(bn, target, evidence.keys(), memory, heuristic)
+	psi = _condition(bn, plan, target, evidence)
+	total = np.sum(psi)
+	if total > 0:
+		psi = psi / total
+	return np.round(psi, 4)
+
+def rc_plan(bn, target, evidence_vars=[], memory=None, heuristic='min_fill'):
+	"""
+	Get the (cached) dtree and cache allocation for a query
+	on *target* given evidence on *evidence_vars*.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string
+
+	*evidence_vars* : a list of rvs with observed values
+
+	*memory* : an integer or None
+		The number of bytes the caches may take up.
+
+	*heuristic* : a string or a function
+		The elimination order heuristic the dtree is built from.
+
+	Returns
+	-------
+	*plan* : a dictionary, where
+		'nodes' = the rvs whose CPTs are the leaves - leaf i
+			is the CPT of nodes[i], and internal nodes follow
+		'left', 'right' = the children of each dtree node
+			(None for leaves)
+		'root' = the root of the dtree
+		'cutset' = the rvs each node loops over
+		'context' = the (non-evidence) rvs instantiated above
+			each node which its answer depends on
+		'summed' = the rvs each leaf sums out of its CPT
+		'cached' = whether each node caches its answers
+		'cache_size' = the number of cached numbers
+		'full_cache_size' = the number of cached numbers if
+			every useful cache were filled
+		'calls' = the number of recursive calls the query
+			makes, at most - a proxy for time
+
+	Notes
+	-----
+	- Plans are cached by network structure (see
+		"pyBN.utils.plan_cache").
+	"""
+	evidence_vars = frozenset(evidence_vars)
+	return cached_plan('recursive_conditioning', bn,
+		(target, evidence_vars, memory, heuristic),
+		lambda: _dtree_plan(bn, target, evidence_vars, memory, heuristic))
+
+def _dtree_plan(bn, target, evidence_vars, memory, heuristic):
+	"""
+	Build a dtree by composing, for every rv in the elimination
+	order, the trees which mention it - then annotate every node
+	with its cutset and context, and pick the nodes to cache.
+	"""
+	nodes = list(bn.nodes())
+	card = dict([(rv, bn.card(rv)) for rv in nodes])
+	rank = dict([(rv, k) for k, rv in enumerate(nodes)])
+	left = [None]*len(nodes)
+	right = [None]*len(nodes)
+	scope = [set(bn.scope(rv)) for rv in nodes]
+
+	def _compose(trees):
+		# join the trees with the fewest rvs first
+		trees = sorted(trees, key=lambda t: len(scope[t]))
+		while len(trees) > 1:
+			a, b = trees[0], trees[1]
+			left.append(a)
+			right.append(b)
+			scope.append(scope[a] | scope[b])
+			trees = sorted(trees[2:] + [len(scope)-1],
+				key=lambda t: len(scope[t]))
+		return trees[0]
+
+	live = set(range(len(nodes)))
+	order = elimination_order(bn, target, evidence_vars, heuristic)['order']
+	for rv in order:
+		trees = [t for t in live if rv in scope[t]]
+		if len(trees) > 1:
+			live.difference_update(trees)
+			live.add(_compose(trees))
+	root = _compose(list(live))
+
+	### CUTSETS & CONTEXTS, TOP-DOWN ###
+	n = len(scope)
+	cutset = [[] for _ in range(n)]
+	context = [[] for _ in range(n)]
+	summed = [[] for _ in range(n)]
+	acutset = [None]*n
+	acutset[root] = set(evidence_vars) | set([target])
+	stack = [root]
+	while stack:
+		t = stack.pop()
+		context[t] = sorted([rv for rv in scope[t] if rv in acutset[t] \
+			and rv not in evidence_vars], key=rank.__getitem__)
+		if left[t] is None:
+			summed[t] = sorted(scope[t] - acutset[t], key=rank.__getitem__)
+			continue
+		cutset[t] = sorted((scope[left[t]] & scope[right[t]]) - acutset[t],
+			key=rank.__getitem__)
+		for c in [left[t], right[t]]:
+			acutset[c] = acutset[t] | set(cutset[t])
+			stack.append(c)
+
+	### CACHE ALLOCATION ###
+	def _size(rvs):
+		s = 1
+		for rv in rvs:
+			s *= card[rv]
+		return s
+
+	size = [_size(context[t]) for t in range(n)]
+
+	def _calls(cached):
+		# how often each node is called - a cached node recurses
+		# at most once per instantiation of its context
+		calls = [0]*n
+		calls[root] = card[target] if target not in evidence_vars else 1
+		for t in reversed(range(n)):
+			if left[t] is not None:
+				evals = min(calls[t], size[t]) if cached[t] else calls[t]
+				calls[left[t]] = calls[right[t]] = evals * _size(cutset[t])
+		return calls
+
+	cached = [False]*n
+	calls = _calls(cached)
+	useful = [t for t in range(n) if left[t] is not None and calls[t] > size[t]]
+	budget = None if memory is None else memory // 8
+	if budget is None:
+		for t in useful:
+			cached[t] = True
+	else:
+		# greedily cache the node which saves the most calls per
+		# cached number - a node called c times whose subtree makes
+		# b calls below it saves about (c - size) / c * b calls
+		left_over = budget
+		candidates = set(useful)
+		while candidates:
+			below = [0]*n
+			for t in range(n):
+				if left[t] is not None:
+					below[t] += below[left[t]] + below[right[t]] + \
+						calls[left[t]] + calls[right[t]]
+			best = None
+			for t in list(candidates):
+				if size[t] > left_over or calls[t] <= size[t]:
+					candidates.discard(t)
+					continue
+				gain = float(calls[t] - size[t]) / calls[t] * below[t] / size[t]
+				if best is None or gain > best[0]:
+					best = (gain, t)
+			if best is None:
+				break
+			cached[best[1]] = True
+			candidates.discard(best[1])
+			left_over -= size[best[1]]
+			calls = _calls(cached)
+	cache_size = sum([size[t] for t in range(n) if cached[t]])
+
+	return {'nodes': nodes,
+			'left': left,
+			'right': right,
+			'root': root,
+			'cutset': cutset,
+			'context': context,
+			'summed': summed,
+			'cached': cached,
+			'cache_size': cache_size,
+			'full_cache_size': sum([size[t] for t in useful]),
+			'calls': sum(_calls(cached))}
+
+def _condition(bn, plan, target, evidence):
+	"""
+	Run recursive conditioning along *plan* once per value
+	of *target*, and return the unnormalized P(target, evidence).
+	"""
+	nodes = plan['nodes']
+	left, right = plan['left'], plan['right']
+	ids = dict([(rv, k) for k, rv in enumerate(nodes)])
+	inst = [0]*len(nodes) # the value index of every instantiated rv
+	for E, e in evidence.items():
+		inst[ids[E]] = bn.values(E).index(e)
+
+	def _strides(rvs):
+		out = []
+		s = 1
+		for rv in reversed(rvs):
+			out.append((ids[rv], s))
+			s *= bn.card(rv)
+		return list(reversed(out)), s
+
+	### LEAF TABLES: EVIDENCE SET & SUMMED RVS SUMMED OUT ###
+	tables = []
+	for i, phi in enumerate(Factorization(bn, nodes)):
+		ev = [rv for rv in phi.scope if rv in evidence]
+		axes = ev + plan['summed'][i] + plan['context'][i]
+		psi = phi._tensor(axes)[tuple([inst[ids[rv]] for rv in ev])]
+		psi = np.sum(psi, axis=tuple(range(len(plan['summed'][i]))))
+		tables.append(np.ravel(psi).tolist())
+
+	### CACHES & CUTSET LOOPS ###
+	n = len(left)
+	keys = [_strides(plan['context'][t])[0] for t in range(n)]
+	caches = [None]*n
+	for t in range(n):
+		if plan['cached'][t]:
+			caches[t] = array('d', [-1.]) * _strides(plan['context'][t])[1]
+	loops = [([ids[rv] for rv in plan['cutset'][t]],
+		[range(bn.card(rv)) for rv in plan['cutset'][t]]) for t in range(n)]
+
+	# a dtree can be deeper than the recursion limit, so the
+	# recursion runs on an explicit stack of frames
+	# [node, cache key, cutset instantiations, total, state, left answer]
+	# where state 0 = next instantiation, 1 = waiting for the left
+	# answer, 2 = waiting for the right answer
+	stack = []
+
+	def _open(t):
+		# answer t right away (leaf or cache hit), or push its frame
+		key = 0
+		for v, s in keys[t]:
+			key += inst[v]*s
+		if left[t] is None:
+			return tables[t][key]
+		cache = caches[t]
+		if cache is not None and cache[key] >= 0:
+			return cache[key]
+		stack.append([t, key, product(*loops[t][1]), 0., 0, 0.])
+		return None
+
+	def _rc(root):
+		answer = _open(root)
+		while stack:
+			frame = stack[-1]
+			t = frame[0]
+			if answer is not None:
+				if frame[4] == 1 and answer > 0:
+					frame[4] = 2
+					frame[5] = answer
+					answer = _open(right[t])
+					continue
+				if frame[4] == 2:
+					frame[3] += frame[5] * answer
+				frame[4] = 0
+				answer = None
+			vals = next(frame[2], None)
+			if vals is None:
+				stack.pop()
+				if caches[t] is not None:
+					caches[t][frame[1]] = frame[3]
+				answer = frame[3]
+				continue
+			for v, x in zip(loops[t][0], vals):
+				inst[v] = x
+			frame[4] = 1
+			answer = _open(left[t])
+		return answer
+
+	psi = np.zeros(bn.card(target))
+	if target in evidence:
+		psi[inst[ids[target]]] = _rc(plan['root'])
+	else:
+		for x in range(bn.card(target)):
+			inst[ids[target]] = x
+			psi[x] = _rc(plan['root'])
+	return psi
@@ -4,12 +4,15 @@ __author__ = """N. Cullen <ncullen.th@dartmouth.edu>"""
 from pyBN.classes.factor import Factor
 from pyBN.classes.factorization import Factorization
 from pyBN.utils.graph import *
+from pyBN.utils.elimination_order import elimination_order
+from pyBN.utils.relevance import prune_network
 
 from copy import deepcopy, copy
 import numpy as np
 import json
 
-def marginal_ve_e(bn, target, evidence={}):
+def marginal_ve_e(bn, target, evidence={}, log=False, batch_evidence=None,
+	heuristic='min_fill'):
 	"""
 	Perform Sum-Product Variable Elimination on
 	a Discrete Bayesian Network.
@@ -23,27 +26,55 @@ def marginal_ve_e(bn, target, evidence={}):
 	*evidence* : a dictionary, where
 		key = rv and value = rv value
 
+	*log* : a boolean
+		Whether to run the elimination in log space, which
+		keeps deep networks and many pieces of evidence from
+		underflowing to zero.
+
+	*batch_evidence* : a dictionary, where
+		key = rv and value = a list of B rv values
+		Answers the same query for B rows of evidence at
+		once - every factor operation runs over all B rows
+		simultaneously. Can be combined with *evidence*,
+		which is shared by every row.
+
+	*heuristic* : a string or a function
+		The elimination order heuristic - see
+		"pyBN.utils.elimination_order". Use None to eliminate
+		in bn.nodes() order. Call elimination_order() with the
+		same arguments to see the order and its largest factor.
+
 	Returns
 	-------
 	*marginal_dict* : a dictionary, where
 		key = an rv in target and value =
 		a numpy array containing the key's
 		marginal conditional probability distribution.
+		If *batch_evidence* is given, a (B x card) numpy
+		array with one posterior per evidence row.
 
 	Notes
 	-----
-	- Mutliple pieces of evidence often returns "nan"...numbers too small?
-		- dividing by zero -> perturb values in Factor class
+	- Mutliple pieces of evidence can underflow to zero in normal
+		space - use log=True for those queries.
+	- Barren and d-separated nodes are pruned from the network
+		before elimination (see "pyBN.utils.relevance").
 	"""
-	_phi = Factorization(bn)
+	observed = list(evidence.keys())
+	if batch_evidence is not None:
+		observed.extend(batch_evidence.keys())
+	bn = prune_network(bn, target, observed)
 
-	order = copy(list(bn.nodes()))
-	order.remove(target)
+	_phi = Factorization(bn, log=log)
+	order = elimination_order(bn, target, observed, heuristic)['order']
 
 	#### EVIDENCE PROCESSING ####
 	for E, e in evidence.items():
-		_phi -= (E,e)
-		order.remove(E)
+		if E != target:
+			_phi -= (E,e)
+	if batch_evidence is not None:
+		for E, e in batch_evidence.items():
+			_phi -= (E,list(e))
 
 	#### SUM-PRODUCT ELIMINATE VAR ####
 	for var in order:
@@ -51,5 +82,21 @@ def marginal_ve_e(bn, target, evidence={}):
 
 	# multiply phi's together if there is evidence
 	final_phi = _phi.consolidate()
+	if batch_evidence is not None and final_phi.batch is None:
+		n = len(list(batch_evidence.values())[0])
+		final_phi.batch = n
+		final_phi.cpt = np.tile(final_phi.cpt, (n,1))
+	final_phi.normalize()
+	if log:
+		final_phi.from_log(decimals=None)
+	psi = final_phi.cpt
+
+	if target in evidence:
+		# an observed target keeps its axis, with all of the
+		# mass on its observed value
+		psi = psi * (np.arange(bn.card(target)) == \
+			bn.value_idx(target, evidence[target]))
+		total = np.sum(psi, axis=-1, keepdims=True)
+		psi = psi / np.where(total > 0, total, 1.)
 
-	return np.round(final_phi.cpt,4)
\ No newline at end of file
+	return np.round(psi,4)
\ No newline at end of file
@@ -81,22 +81,14 @@ def bayes_estimator(bn, data, equiv_sample=None, prior_dict=None, nodes=None):
 	for i, n in enumerate(nodes):
 		bn.F[n]['values'] = list(np.unique(data[:,i]))
 
-	obs_dict = dict([(rv,[]) for rv in nodes])
-	# set empty conditional probability table for each RV
 	for rv in nodes:
 		# get number of values in the CPT = product of scope vars' cardinalities
 		p_idx = int(np.prod([bn.card(p) for p in bn.parents(rv)])*bn.card(rv))
-		bn.F[rv]['cpt'] = [equiv_sample/p_idx]*p_idx
-	
-	# loop through each row of data
-	for row in data:
-		# store the observation of each variable in the row
-		obs_dict = dict([(rv,row[rv]) for rv in nodes])
-		# loop through each RV and increment its observed parent-self value
-		for rv in nodes:
-			rv_dict= { n: obs_dict[n] for n in obs_dict if n in bn.scope(rv) }
-			offset = bn.cpt_indices(target=rv,val_dict=rv_dict)[0]
-			bn.F[rv]['cpt'][offset]+=1
+		# cpt offset of every row's observed parent-self value, then count them
+		rv_dict = dict([(n, data[:,n]) for n in bn.scope(rv)])
+		offsets = bn.cpt_indices(target=rv,val_dict=rv_dict)
+		bn.F[rv]['cpt'] = list(equiv_sample/p_idx + \
+			np.bincount(offsets, minlength=p_idx))
 
 	
 	for rv in nodes:
@@ -32,7 +32,6 @@ from pyBN.learning.parameter.mle import mle_estimator
 from pyBN.learning.parameter.bayes import bayes_estimator
 from pyBN.learning.structure.score.info_scores import info_score
 from pyBN.utils.independence_tests import mutual_information
-from pyBN.utils.graph import would_cause_cycle
 
 
 def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=None):
@@ -80,6 +79,8 @@ def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=N
 	# COMPUTE INITIAL LIKELIHOOD SCORE	
 	value_dict = dict([(n, np.unique(data[:,i])) for i,n in enumerate(names)])
 	bn = BayesNet(c_dict)
+	# c_dict is bn.E - edit the structure through bn, so its ancestor
+	# index (used for the cycle checks) stays up to date
 	mle_estimator(bn, data)
 	max_score = info_score(bn, nrow, metric)
 	
@@ -98,7 +99,7 @@ def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=N
 		### TEST ARC ADDITIONS ###
 		for u in bn.nodes():
 			for v in bn.nodes():
-				if v not in c_dict[u] and u!=v and not would_cause_cycle(c_dict, u, v):
+				if v not in c_dict[u] and u!=v and not bn.would_cause_cycle(u, v):
 					# FOR MMHC ALGORITHM -> Edge Restrictions
 					if restriction is None or (u,v) in restriction:
 						# SCORE FOR 'V' -> gaining a parent
@@ -138,7 +139,7 @@ def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=N
 		### TEST ARC REVERSALS ###
 		for u in bn.nodes():
 			for v in bn.nodes():
-				if v in c_dict[u] and not would_cause_cycle(c_dict,v,u, reverse=True):
+				if v in c_dict[u] and not bn.would_cause_cycle(v, u, reverse=True):
 					# SCORE FOR 'U' -> gaining 'v' as parent
 					old_cols = (u,) + tuple(p_dict[v]) # without 'v' as parent
 					mi_old = mutual_information(data[:,old_cols])
@@ -170,19 +171,18 @@ def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=N
 			if max_operation == 'Addition':
 				if debug:
 					print('ADDING: ' , max_arc , '\n')
-				c_dict[u].append(v)
+				bn.add_edge(u,v)
 				p_dict[v].append(u)
 			elif max_operation == 'Deletion':
 				if debug:
 					print('DELETING: ' , max_arc , '\n')
-				c_dict[u].remove(v)
+				bn.remove_edge(u,v)
 				p_dict[v].remove(u)
 			elif max_operation == 'Reversal':
 				if debug:
 					print('REVERSING: ' , max_arc, '\n')
-					c_dict[u].remove(v)
+					bn.reverse_arc(u,v)
 					p_dict[v].remove(u)
-					c_dict[v].append(u)
 					p_dict[u].append(v)
 		else:
 			if debug:
@@ -201,10 +201,10 @@ def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=N
 						while True:
 							u,v = np.random.choice(list(bn.nodes()), size=2, replace=False)
 							# IF EDGE DOESN'T EXIST, ADD IT
-							if u not in p_dict[v] and u!=v and not would_cause_cycle(c_dict,u,v):
+							if u not in p_dict[v] and u!=v and not bn.would_cause_cycle(u, v):
 								if debug:
 									print('RESTART - ADDING: ', (u,v))
-								c_dict[u].append(v)
+								bn.add_edge(u,v)
 								p_dict[v].append(u)
 								break
 					elif operation == 1:
@@ -214,19 +214,18 @@ def hc_rr(data, M=5, R=3, metric='AIC', max_iter=100, debug=False, restriction=N
 							if u in p_dict[v]:
 								if debug:
 									print('RESTART - DELETING: ', (u,v))
-								c_dict[u].remove(v)
+								bn.remove_edge(u,v)
 								p_dict[v].remove(u)
 								break
 					elif operation == 2:
 						while True:
 							u,v = np.random.choice(list(bn.nodes()), size=2, replace=False)
 							# IF EDGE EXISTS, REVERSE IT
-							if u in p_dict[v] and not would_cause_cycle(c_dict,v,u, reverse=True):
+							if u in p_dict[v] and not bn.would_cause_cycle(v, u, reverse=True):
 								if debug:
 									print('RESTART - REVERSING: ', (u,v))
-								c_dict[u].remove(v)
+								bn.reverse_arc(u,v)
 								p_dict[v].remove(u)
-								c_dict[v].append(u)
 								p_dict[u].append(v)
 								break
 
@@ -23,7 +23,6 @@ from pyBN.learning.parameter.mle import mle_estimator
 from pyBN.learning.parameter.bayes import bayes_estimator
 from pyBN.learning.structure.score.info_scores import info_score
 from pyBN.utils.independence_tests import mutual_information
-from pyBN.utils.graph import would_cause_cycle
 
 
 def tabu(data, k=5, metric='AIC', max_iter=100, debug=False, restriction=None):
@@ -81,6 +80,8 @@ def tabu(data, k=5, metric='AIC', max_iter=100, debug=False, restriction=None):
 	# COMPUTE INITIAL LIKELIHOOD SCORE	
 	value_dict = dict([(n, np.unique(data[:,i])) for i,n in enumerate(names)])
 	bn = BayesNet(c_dict)
+	# c_dict is bn.E - edit the structure through bn, so its ancestor
+	# index (used for the cycle checks) stays up to date
 	mle_estimator(bn, data)
 	max_score = info_score(bn, nrow, metric)
 
@@ -103,7 +104,7 @@ def tabu(data, k=5, metric='AIC', max_iter=100, debug=False, restriction=None):
 				# CHECK TABU LIST - can't delete an addition on the tabu list
 				if (u,v,'Deletion') not in tabu_list:
 					# CHECK EDGE EXISTENCE AND CYCLICITY
-					if v not in c_dict[u] and u!=v and not would_cause_cycle(c_dict, u, v):
+					if v not in c_dict[u] and u!=v and not bn.would_cause_cycle(u, v):
 						# FOR MMHC ALGORITHM -> Edge Restrictions
 						if restriction is None or (u,v) in restriction:
 							# SCORE FOR 'V' -> gaining a parent
@@ -147,7 +148,7 @@ def tabu(data, k=5, metric='AIC', max_iter=100, debug=False, restriction=None):
 			for v in bn.nodes():
 				# CHECK TABU LIST - can't reverse back a reversal on the tabu list
 				if (u,v,'Reversal') not in tabu_list:
-					if v in c_dict[u] and not would_cause_cycle(c_dict,v,u, reverse=True):
+					if v in c_dict[u] and not bn.would_cause_cycle(v, u, reverse=True):
 						# SCORE FOR 'U' -> gaining 'v' as parent
 						old_cols = (u,) + tuple(p_dict[v]) # without 'v' as parent
 						mi_old = mutual_information(data[:,old_cols])
@@ -179,21 +180,20 @@ def tabu(data, k=5, metric='AIC', max_iter=100, debug=False, restriction=None):
 			if max_operation == 'Addition':
 				if debug:
 					print('ADDING: ' , max_arc , '\n')
-				c_dict[u].append(v)
+				bn.add_edge(u,v)
 				p_dict[v].append(u)
 				tabu_list[_iter % 5] = (u,v,'Addition')
 			elif max_operation == 'Deletion':
 				if debug:
 					print('DELETING: ' , max_arc , '\n')
-				c_dict[u].remove(v)
+				bn.remove_edge(u,v)
 				p_dict[v].remove(u)
 				tabu_list[_iter % 5] = (u,v,'Deletion')
 			elif max_operation == 'Reversal':
 				if debug:
 					print('REVERSING: ' , max_arc, '\n')
-					c_dict[u].remove(v)
+					bn.reverse_arc(u,v)
 					p_dict[v].remove(u)
-					c_dict[v].append(u)
 					p_dict[u].append(v)
 					tabu_list[_iter % 5] = (u,v,'Reversal')
 		else:
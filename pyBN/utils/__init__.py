@@ -1,11 +1,14 @@
 from pyBN.utils.class_equivalence import *
 from pyBN.utils.data import *
 from pyBN.utils.discretize import *
+from pyBN.utils.elimination_order import *
 from pyBN.utils.graph import *
 from pyBN.utils.hybrid_distance import *
 from pyBN.utils.independence_tests import *
 from pyBN.utils.markov_blanket import *
 from pyBN.utils.orient_edges import *
 from pyBN.utils.parameter_distance import *
+from pyBN.utils.plan_cache import *
 from pyBN.utils.random_sample import *
+from pyBN.utils.relevance import *
 from pyBN.utils.structure_distance import *
\ No newline at end of file
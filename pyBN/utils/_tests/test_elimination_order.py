@@ -0,0 +1,79 @@
+"""
+*****************
+UnitTest
+Elimination Order
+*****************
+
+"""
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+import unittest
+import os
+from os.path import dirname
+
+import networkx as nx
+
+from pyBN.utils.elimination_order import elimination_order, triangulate
+from pyBN.utils.graph import make_chordal
+from pyBN.readwrite.read import read_bn
+
+
+class EliminationOrderTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.dpath = os.path.join(dirname(dirname(dirname(dirname(__file__)))),'data')	
+		self.bn = read_bn(os.path.join(self.dpath,'cmu.bn'))
+
+	def tearDown(self):
+		pass
+
+	def test_order_excludes_target_and_evidence(self):
+		r = elimination_order(self.bn,'Burglary',['Alarm'])
+		self.assertSetEqual(set(r['order']),
+			set(['Earthquake','JohnCalls','MaryCalls']))
+
+	def test_min_fill(self):
+		r = elimination_order(self.bn,'Burglary',heuristic='min_fill')
+		self.assertListEqual(r['order'],
+			['Earthquake','JohnCalls','MaryCalls','Alarm'])
+		self.assertEqual(r['max_size'],8)
+		self.assertEqual(r['width'],2)
+
+	def test_order_cached(self):
+		r1 = elimination_order(self.bn,'Burglary',['Alarm'])
+		r2 = elimination_order(self.bn,'Burglary',['Alarm'])
+		self.assertIs(r1,r2)
+		bn = read_bn(os.path.join(self.dpath,'cmu.bn'))
+		self.assertIs(elimination_order(bn,'Burglary',['Alarm']),r1)
+		bn.add_edge('Burglary','MaryCalls')
+		r3 = elimination_order(bn,'Burglary',['Alarm'])
+		self.assertIsNot(r3,r1)
+
+	def test_restarts(self):
+		r = elimination_order(self.bn,None,heuristic='min_degree',
+			restarts=5,seed=1)
+		self.assertEqual(len(r['order']),5)
+		self.assertEqual(r['max_size'],8)
+
+	def test_triangulate(self):
+		bn = read_bn(os.path.join(self.dpath,'asia.bif'))
+		tri = triangulate(bn)
+		self.assertListEqual(tri['fill_edges'],[('bronc','lung')])
+		self.assertEqual(len(tri['cliques']),6)
+		self.assertEqual(tri['width'],2)
+		self.assertEqual(tri['total_size'],40)
+		for rv in bn.nodes():
+			self.assertTrue(any([set(bn.scope(rv)) <= c \
+				for c in tri['cliques']]))
+		self.assertTrue(nx.is_chordal(make_chordal(bn)))
+
+	def test_triangulate_junction_tree(self):
+		bn = read_bn(os.path.join(self.dpath,'asia.bif'))
+		tri = triangulate(bn)
+		self.assertListEqual(tri['parents'],[1,3,5,None,5,1])
+		for rv in bn.nodes():
+			self.assertTrue(set(bn.scope(rv)) <= \
+				tri['cliques'][tri['assignment'][rv]])
+
+if __name__ == '__main__':
+	unittest.main(exit=False)
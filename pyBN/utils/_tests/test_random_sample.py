@@ -29,5 +29,5 @@ class RandomSampleTestCase(unittest.TestCase):
 		np.random.seed(3636)
 		sample = random_sample(self.bn,5)
 		self.assertListEqual(list(sample.ravel()),
-			[0, 0, 1, 1, 0, 0, 0, 1, 1, 0, 1, 
-			1, 1, 1, 1, 0, 0, 1, 1, 0, 1, 0, 1, 1, 0])
\ No newline at end of file
+			[0, 0, 1, 0, 1, 1, 0, 1, 1, 0, 1,
+			0, 1, 1, 1, 0, 0, 1, 1, 0, 0, 0, 1, 0, 0])
\ No newline at end of file
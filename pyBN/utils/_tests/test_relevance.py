@@ -0,0 +1,57 @@
+"""
+***************
+UnitTest
+Query Relevance
+***************
+
+"""
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+import unittest
+import os
+from os.path import dirname
+
+from pyBN.utils.relevance import relevant_nodes, prune_network
+from pyBN.readwrite.read import read_bn
+
+
+class RelevanceTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.dpath = os.path.join(dirname(dirname(dirname(dirname(__file__)))),'data')	
+		self.bn = read_bn(os.path.join(self.dpath,'cmu.bn'))
+
+	def tearDown(self):
+		pass
+
+	def test_barren(self):
+		f, r = relevant_nodes(self.bn,'Alarm')
+		self.assertListEqual(f,['Burglary','Earthquake','Alarm'])
+		self.assertListEqual(r,[])
+
+	def test_dseparated(self):
+		# Alarm blocks JohnCalls from MaryCalls
+		f, r = relevant_nodes(self.bn,'MaryCalls',['Alarm','JohnCalls'])
+		self.assertListEqual(f,['MaryCalls'])
+		self.assertListEqual(r,['Alarm'])
+
+	def test_evidence_below(self):
+		f, r = relevant_nodes(self.bn,'Burglary',['JohnCalls'])
+		self.assertListEqual(f,
+			['Burglary','Earthquake','Alarm','JohnCalls'])
+
+	def test_observed_target(self):
+		f, r = relevant_nodes(self.bn,'Alarm',['Alarm','JohnCalls'])
+		self.assertListEqual(f,['Burglary','Earthquake','Alarm','JohnCalls'])
+		bn = prune_network(self.bn,'Alarm',['Alarm'])
+		self.assertListEqual(bn.V,['Burglary','Earthquake','Alarm'])
+
+	def test_prune_network(self):
+		bn = prune_network(self.bn,'MaryCalls',['Alarm','JohnCalls'])
+		self.assertListEqual(bn.V,['Alarm','MaryCalls'])
+		self.assertListEqual(bn.parents('Alarm'),[])
+		self.assertListEqual(bn.cpt('Alarm'),[0.5,0.5])
+		self.assertListEqual(bn.cpt('MaryCalls'),self.bn.cpt('MaryCalls'))
+
+if __name__ == '__main__':
+	unittest.main(exit=False)
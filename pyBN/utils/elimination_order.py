@@ -0,0 +1,372 @@
+"""
+*****************
+Elimination Order
+*****************
+
+Greedy heuristics for choosing the order in which Variable
+Elimination sums (or maxes) out the variables of a query.
+
+The order is computed on the moral graph of the network after
+the evidence variables have been removed: eliminating a variable
+creates a factor over the variable and all of its current
+neighbors, and connects those neighbors to each other. A good
+order keeps every such factor small.
+
+Heuristics (the cost of eliminating rv next)
+--------------------------------------------
+- min_degree : number of neighbors of rv
+- min_fill : number of edges added between rv's neighbors
+- weighted_min_fill : sum over added edges of the product
+	of the cardinalities of their two endpoints
+- min_weight : number of entries of the created factor
+
+A heuristic can also be any function f(adj, card, rv) -> cost,
+where *adj* is a dict of neighbor sets and *card* a dict of
+cardinalities.
+
+With *restarts* > 0, the greedy search is also repeated that
+many times while picking randomly among the 3 cheapest next
+variables, and the best order found is kept.
+
+Orders are cached per (network, heuristic, target, evidence
+variables), so repeated queries of the same shape do not
+recompute them.
+
+triangulate() eliminates every variable along such an order
+and returns the fill-in edges and the maximal cliques of the
+resulting chordal graph, which is what CliqueTree is built on.
+
+References
+----------
+[1] Koller, Friedman (2009). "Probabilistic Graphical Models."
+	Section 9.4.3
+
+"""
+
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+import numpy as np
+
+from pyBN.utils.plan_cache import cached_plan
+
+def min_degree(adj, card, rv):
+	return len(adj[rv])
+
+def min_fill(adj, card, rv):
+	nbrs = list(adj[rv])
+	fill = 0
+	for i in range(len(nbrs)):
+		for j in range(i+1, len(nbrs)):
+			if nbrs[j] not in adj[nbrs[i]]:
+				fill += 1
+	return fill
+
+def weighted_min_fill(adj, card, rv):
+	nbrs = list(adj[rv])
+	fill = 0
+	for i in range(len(nbrs)):
+		for j in range(i+1, len(nbrs)):
+			if nbrs[j] not in adj[nbrs[i]]:
+				fill += card[nbrs[i]]*card[nbrs[j]]
+	return fill
+
+def min_weight(adj, card, rv):
+	s = card[rv]
+	for n in adj[rv]:
+		s *= card[n]
+	return s
+
+HEURISTICS = {
+	'min_degree': min_degree,
+	'min_fill': min_fill,
+	'weighted_min_fill': weighted_min_fill,
+	'min_weight': min_weight
+}
+
+def elimination_order(bn, target=None, evidence=[], heuristic='min_fill',
+	restarts=0, seed=None):
+	"""
+	Get the (cached) elimination order for a query on *target*
+	given evidence on the variables in *evidence*.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string, a list of strings, or None
+		The rv(s) which are NOT eliminated. If None, every
+		non-evidence rv is eliminated (e.g. for MAP queries).
+
+	*evidence* : a list of rvs (or a dict whose keys are rvs)
+		with observed values
+
+	*heuristic* : a string (a key of HEURISTICS) or a function
+		f(adj, card, rv) -> cost. If None, the rvs are
+		eliminated in bn.nodes() (topsort) order.
+
+	*restarts* : an integer
+		Number of extra randomized greedy runs.
+
+	*seed* : an integer or None
+		Seed for the randomized runs.
+
+	Returns
+	-------
+	*order_dict* : a dictionary, where
+		'order' = the list of rvs to eliminate, in order
+		'max_size' = the number of entries of the largest
+			factor created while eliminating
+		'width' = the largest number of variables in any
+			created factor, minus one (the induced width)
+		'total_size' = the summed number of entries of
+			every created factor
+
+	Notes
+	-----
+	- Orders are cached by network structure (see
+		"pyBN.utils.plan_cache").
+	"""
+	if target is None:
+		target = []
+	elif not isinstance(target, (list, tuple, set)):
+		target = [target]
+	key = (heuristic, frozenset(target), frozenset(evidence), restarts, seed)
+	return cached_plan('elimination_order', bn, key,
+		lambda: _find_order(bn, list(bn.nodes()), set(target),
+			set(evidence), heuristic, restarts, seed))
+
+def _find_order(bn, nodes, target, evidence, heuristic, restarts, seed):
+	"""
+	Build the moral graph without the evidence rvs and run
+	the greedy search (plus any randomized restarts).
+	"""
+	adj, card = _moral_graph(bn, nodes, evidence)
+	elim = [rv for rv in nodes if rv in adj and rv not in target]
+
+	if heuristic is None:
+		return _simulate(adj, card, elim)
+	if not callable(heuristic):
+		heuristic = HEURISTICS[heuristic]
+
+	best = _greedy(adj, card, elim, heuristic)
+	rng = np.random.RandomState(seed)
+	for _ in range(restarts):
+		res = _greedy(adj, card, elim, heuristic, rng)
+		if (res['max_size'], res['total_size']) < \
+				(best['max_size'], best['total_size']):
+			best = res
+	return best
+
+def triangulate(bn, heuristic='min_fill', restarts=0, seed=None):
+	"""
+	Triangulate the moral graph of *bn* by eliminating every rv
+	in the order given by *heuristic* (see elimination_order).
+	Eliminating an rv connects all of its remaining neighbors -
+	these added edges are the fill-in edges, and the moral graph
+	plus the fill-in edges is chordal.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*heuristic* : a string, a function, None, or a list
+		The elimination order heuristic - or, if a list of
+		every rv is given, the elimination order itself.
+
+	*restarts* : an integer
+		Number of extra randomized greedy runs.
+
+	*seed* : an integer or None
+		Seed for the randomized runs.
+
+	Returns
+	-------
+	*tri_dict* : a dictionary, where
+		'order' = the elimination order
+		'fill_edges' = a list of the (rv, rv) fill-in edges
+		'cliques' = a list of the maximal cliques (sets of rvs)
+			of the chordal graph, in the order they were created
+		'width' = the treewidth of the triangulation - i.e.
+			the size of the largest clique, minus one
+		'max_size' = the number of entries of the largest
+			clique potential
+		'total_size' = the summed number of entries of every
+			clique potential (the junction tree's state space)
+		'parents' = for every clique, the index of its parent
+			clique in a junction tree over the cliques, or None
+			for a root (one per connected component)
+		'assignment' = a dictionary, where key = rv and
+			value = the index of a clique containing rv's family
+
+	Notes
+	-----
+	- Every rv is in at least one clique, even if it has no
+		neighbors in the moral graph.
+	"""
+	if isinstance(heuristic, (list, tuple)):
+		order = list(heuristic)
+	else:
+		order = elimination_order(bn, None, [], heuristic,
+			restarts, seed)['order']
+	nodes = list(bn.nodes())
+	pos = dict([(rv, i) for i, rv in enumerate(nodes)])
+	adj, card = _moral_graph(bn, nodes, set())
+
+	step = dict([(rv, k) for k, rv in enumerate(order)])
+	fill_edges = []
+	cliques = []
+	containing = dict([(rv, []) for rv in nodes])
+	step_cliques = [] # the clique created by each elimination step
+	step_parent = [] # the step which eliminates rv's first neighbor
+	step_max = [] # the maximal clique of each step, if it is one
+	for rv in order:
+		nbrs = sorted(adj[rv], key=pos.__getitem__)
+		for i in range(len(nbrs)):
+			for j in range(i+1, len(nbrs)):
+				if nbrs[j] not in adj[nbrs[i]]:
+					fill_edges.append((nbrs[i], nbrs[j]))
+		_eliminate(adj, rv)
+		# the clique is maximal unless an earlier clique contains it,
+		# and any such clique must contain rv too
+		clique = set(nbrs + [rv])
+		step_cliques.append(clique)
+		step_parent.append(min([step[n] for n in nbrs]) if nbrs else None)
+		if not any([clique <= cliques[k] for k in containing[rv]]):
+			for n in clique:
+				containing[n].append(len(cliques))
+			step_max.append(len(cliques))
+			cliques.append(clique)
+		else:
+			step_max.append(None)
+
+	parents, assignment = _junction_tree(bn, order, step, step_cliques,
+		step_parent, step_max, len(cliques))
+	sizes = [int(np.prod([card[rv] for rv in c])) for c in cliques]
+	return {'order': order, 'fill_edges': fill_edges, 'cliques': cliques,
+			'parents': parents, 'assignment': assignment,
+			'width': max([len(c) for c in cliques]) - 1,
+			'max_size': max(sizes), 'total_size': sum(sizes)}
+
+def _junction_tree(bn, order, step, step_cliques, step_parent, step_max,
+	n_cliques):
+	"""
+	Build the junction tree over the maximal cliques directly
+	from the elimination steps, in time linear in the number
+	of steps.
+
+	The clique of each step is joined to the clique of the step
+	which eliminates the first of its neighbors - this tree of
+	all step cliques has the running intersection property.
+	A non-maximal step clique is then contracted into a neighbor
+	which contains it (by running intersection, one always does).
+
+	Returns the parent of every maximal clique (None for a root)
+	and, for every rv, a maximal clique containing its family.
+	"""
+	nbrs = [[] for _ in order]
+	for k, p in enumerate(step_parent):
+		if p is not None:
+			nbrs[k].append(p)
+			nbrs[p].append(k)
+	rep = list(step_max)
+	for k in range(len(order)):
+		# follow strictly larger supersets until a maximal clique
+		path = []
+		j = k
+		while rep[j] is None:
+			path.append(j)
+			j = [n for n in nbrs[j] if step_cliques[j] < step_cliques[n]][0]
+		for i in path:
+			rep[i] = rep[j]
+
+	parents = [None]*n_cliques
+	for k, p in enumerate(step_parent):
+		if p is not None and rep[k] != rep[p]:
+			parents[rep[k]] = rep[p]
+
+	# a family is a clique of the moral graph, so the step which
+	# eliminates its first member creates a clique containing it
+	assignment = dict([(rv, rep[min([step[n] for n in bn.scope(rv)])]) \
+		for rv in bn.nodes()])
+	return parents, assignment
+
+def _moral_graph(bn, nodes, evidence):
+	"""
+	Adjacency sets (and cardinalities) of the moral graph of
+	*bn* without the *evidence* rvs.
+	"""
+	keep = [rv for rv in nodes if rv not in evidence]
+	card = dict([(rv, bn.card(rv)) for rv in keep])
+	adj = dict([(rv, set()) for rv in keep])
+	for rv in keep:
+		family = [p for p in bn.parents(rv) if p not in evidence] + [rv]
+		for a in family:
+			for b in family:
+				if a != b:
+					adj[a].add(b)
+	return adj, card
+
+def _eliminate(adj, rv):
+	"""
+	Remove *rv* from the graph *adj* (in place), connecting
+	its neighbors, and return those neighbors.
+	"""
+	nbrs = adj.pop(rv)
+	for n in nbrs:
+		adj[n].discard(rv)
+		adj[n].update(nbrs)
+		adj[n].discard(n)
+	return nbrs
+
+def _simulate(adj, card, order):
+	"""
+	Factor sizes created by eliminating in a fixed *order*.
+	"""
+	adj = dict([(rv, set(n)) for rv, n in adj.items()])
+	max_size, total_size, width = 1, 0, 0
+	for rv in order:
+		nbrs = _eliminate(adj, rv)
+		size = card[rv]
+		for n in nbrs:
+			size *= card[n]
+		max_size = max(max_size, size)
+		total_size += size
+		width = max(width, len(nbrs))
+	return {'order': list(order), 'max_size': max_size,
+			'width': width, 'total_size': total_size}
+
+def _greedy(adj, card, elim, heuristic, rng=None):
+	"""
+	Repeatedly eliminate the cheapest rv - or, if *rng* is
+	given, a random one of the 3 cheapest. Only the neighbors
+	of an eliminated rv (and their neighbors) change cost, so
+	only those are re-scored.
+	"""
+	adj = dict([(rv, set(n)) for rv, n in adj.items()])
+	pos = dict([(rv, i) for i, rv in enumerate(elim)])
+	cost = dict([(rv, heuristic(adj, card, rv)) for rv in elim])
+	order = []
+	max_size, total_size, width = 1, 0, 0
+	while cost:
+		if rng is None:
+			rv = min(cost, key=lambda v: (cost[v], pos[v]))
+		else:
+			cands = sorted(cost, key=lambda v: (cost[v], pos[v]))[:3]
+			rv = cands[rng.randint(len(cands))]
+		del cost[rv]
+		order.append(rv)
+		nbrs = _eliminate(adj, rv)
+		size = card[rv]
+		for n in nbrs:
+			size *= card[n]
+		max_size = max(max_size, size)
+		total_size += size
+		width = max(width, len(nbrs))
+		dirty = set(nbrs)
+		for n in nbrs:
+			dirty.update(adj[n])
+		for n in dirty:
+			if n in cost:
+				cost[n] = heuristic(adj, card, n)
+	return {'order': order, 'max_size': max_size,
+			'width': width, 'total_size': total_size}
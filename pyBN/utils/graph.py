@@ -10,21 +10,37 @@ eventually be corrected.
 import networkx as nx
 import numpy as np
 from copy import copy
+from collections import deque
+
+from pyBN.utils.elimination_order import triangulate
 
 def would_cause_cycle(e, u, v, reverse=False):
 	"""
 	Test if adding the edge u -> v to the BayesNet
 	object would create a DIRECTED (i.e. illegal) cycle.
+
+	That happens iff u is reachable from v, so this is
+	a single depth-first search from v - O(V+E).
+	If *reverse*, the existing edge v -> u is ignored.
+
+	For repeated checks while editing a BayesNet, use
+	bn.would_cause_cycle() instead - it is O(1).
 	"""
-	G = nx.DiGraph(e)
-	if reverse:
-		G.remove_edge(v,u)
-	G.add_edge(u,v)
-	try:
-		nx.find_cycle(G, source=u)
+	if u == v:
 		return True
-	except:
-		return False
+	visited = set([v])
+	stack = [v]
+	while stack:
+		n = stack.pop()
+		for c in e[n]:
+			if reverse and n == v and c == u:
+				continue
+			if c == u:
+				return True
+			if c not in visited:
+				visited.add(c)
+				stack.append(c)
+	return False
 
 
 
@@ -32,27 +48,35 @@ def topsort(edge_dict, root=None):
 	"""
 	List of nodes in topological sort order from edge dict
 	where key = rv and value = list of rv's children
+
+	Kahn's algorithm - O(V+E). Nodes with no parents
+	come first, in edge_dict order. If *root* is given,
+	only root and its descendants are returned.
 	"""
-	queue = []
 	if root is not None:
-		queue = [root]
+		nodes = [root]
+		seen = set(nodes)
+		for n in nodes:
+			for c in edge_dict[n]:
+				if c not in seen:
+					seen.add(c)
+					nodes.append(c)
 	else:
-		for rv in edge_dict.keys():
-			prior=True
-			for p in edge_dict.keys():
-				if rv in edge_dict[p]:
-					prior=False
-			if prior==True:
-				queue.append(rv)
-	
+		nodes = list(edge_dict.keys())
+	indegree = dict([(rv,0) for rv in nodes])
+	for rv in nodes:
+		for c in edge_dict[rv]:
+			indegree[c] += 1
+
+	queue = deque([rv for rv in nodes if indegree[rv] == 0])
 	visited = []
 	while queue:
-		vertex = queue.pop(0)
-		if vertex not in visited:
-			visited.append(vertex)
-			for nbr in edge_dict[vertex]:
+		vertex = queue.popleft()
+		visited.append(vertex)
+		for nbr in edge_dict[vertex]:
+			indegree[nbr] -= 1
+			if indegree[nbr] == 0:
 				queue.append(nbr)
-			#queue.extend(edge_dict[vertex]) # add all vertex's children
 	return visited
 
 def dfs_postorder(edge_dict, root=None):
@@ -129,32 +153,29 @@ def mst(edge_dict):
 	
 	return mst_G
 
-def make_chordal(bn, v=None,e=None):
+def make_chordal(bn, v=None, heuristic='min_fill'):
 	"""
 	This function creates a chordal graph - i.e. one in which there
 	are no cycles with more than three nodes.
 
-	Can supply a v_list and e_list for chordal graph of any random graph..
-
-	We start from the moral graph, so if that is already chordal then it
-	will return that.
-
-	Algorithm from Cano & Moral 1990 ->
-	'Heuristic Algorithms for the Triangulation of Graphs'
-
+	The moral graph is triangulated by greedy elimination over
+	adjacency sets (see "pyBN.utils.elimination_order.triangulate"),
+	so the moral graph plus the fill-in edges is returned.
 
 	Parameters
 	----------
 	*v* : a list (optional)
-	    A vertex list
+	    An elimination order over every vertex, to use
+	    instead of *heuristic*
 
-	*e* : a list (optional)
-	    An edge list
+	*heuristic* : a string
+	    The elimination order heuristic - 'min_fill' (default),
+	    'min_weight', 'weighted_min_fill' or 'min_degree'
 
 
 	Returns
 	-------
-	*G* : a network Digraph object
+	*G* : a networkx Graph object
 
 	Effects
 	-------
@@ -162,48 +183,15 @@ def make_chordal(bn, v=None,e=None):
 
 	Notes
 	-----
-	Where is this used? Do we need to use networkx?       
-
+	Use triangulate() directly to also get the maximal
+	cliques and the treewidth of the triangulation.
 
 	"""
-	chordal_E = bn.moralized_edges() # start with moral graph
-
-	# if moral graph is already chordal, no need to alter it
-	if not is_chordal(chordal_E):            
-		temp_E = copy(chordal_E)
-		temp_V = []
-
-		# if v and e is supplied, skip all the rest
-		if v and e:
-			chordal_E = copy(e)
-			temp_E = copy(chordal_E)
-			temp_V = copy(v)
-		else:
-			temp_G = nx.Graph()
-			temp_G.add_edges_from(chordal_E)
-			degree_dict = temp_G.degree()
-			temp_V = sorted(degree_dict, key=degree_dict.get)
-		#print temp_V
-		for v in temp_V:
-			#Add links between the pairs nodes adjacent to Node i
-			#Add those links to chordal_E and temp_E
-			adj_v = set([n for e in temp_E for n in e if v in e and n!=v])
-			for a1 in adj_v:
-				for a2 in adj_v:
-					if a1!=a2:
-						if [a1,a2] not in chordal_E and [a2,a1] not in chordal_E:
-							chordal_E.append([a1,a2])
-							temp_E.append([a1,a2])
-			# remove Node i from temp_V and all its links from temp_E 
-			temp_E2 = []
-			for edge in temp_E:
-				if v not in edge:
-					temp_E2.append(edge)
-			temp_E = temp_E2
-
-	
+	tri = triangulate(bn, v if v is not None else heuristic)
 	G = nx.Graph()
-	G.add_edges_from(chordal_E)
+	G.add_nodes_from(bn.nodes())
+	G.add_edges_from(bn.moralized_edges())
+	G.add_edges_from(tri['fill_edges'])
 	return G
 
 
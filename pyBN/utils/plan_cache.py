@@ -0,0 +1,69 @@
+"""
+**********
+Plan Cache
+**********
+
+One cache for the query plans which only depend on the
+structure of a network - elimination orders, contraction
+plans and recursive conditioning dtrees.
+
+Plans are keyed on the structure itself (every rv with its
+cardinality and ordered parents), not on the network object,
+so the pruned copy of a network which every query builds (see
+"pyBN.utils.relevance") still finds the plan of the last query
+on the same structure - and a network edited in place, by
+add_edge() or any other way, simply misses the cache instead
+of getting a stale plan. Changing only the cpts keeps the plans.
+
+"""
+
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+_PLANS = {}
+
+def structure_key(bn):
+	"""
+	A hashable key which changes whenever the structure of
+	*bn* does - a tuple of (rv, card, parents) in bn.nodes()
+	(topsort) order.
+	"""
+	return tuple([(rv, bn.card(rv), tuple(bn.parents(rv))) \
+		for rv in bn.nodes()])
+
+def cached_plan(kind, bn, key, build):
+	"""
+	Get the cached plan of type *kind* for the structure of
+	*bn* and the query *key* - or call build() and cache it.
+
+	Arguments
+	---------
+	*kind* : a string naming the type of plan
+
+	*bn* : a BayesNet (or CompiledBayesNet) object
+
+	*key* : a hashable description of the query
+
+	*build* : a function of no arguments which returns the plan
+
+	Returns
+	-------
+	*plan* : whatever build() returns - the same object for
+		every call with an equal structure and query
+	"""
+	full_key = (kind, structure_key(bn), key)
+	try:
+		return _PLANS[full_key]
+	except KeyError:
+		plan = _PLANS[full_key] = build()
+		return plan
+
+def clear_plan_cache(kind=None):
+	"""
+	Remove every cached plan (of type *kind*, if given) to
+	free memory.
+	"""
+	if kind is None:
+		_PLANS.clear()
+	else:
+		for full_key in [k for k in _PLANS if k[0] == kind]:
+			del _PLANS[full_key]
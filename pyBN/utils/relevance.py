@@ -0,0 +1,154 @@
+"""
+***************
+Query Relevance
+***************
+
+Prune a BayesNet down to the part which is needed to answer
+a query P(target | evidence), before running exact or
+approximate inference on it.
+
+Two kinds of nodes are dropped:
+
+	- barren nodes : nodes which are not ancestors of the
+		target or of the evidence. Their cpts sum to one
+		when they are eliminated, so they never change the
+		answer.
+
+	- d-separated nodes : in the moral graph of the ancestral
+		set, with the evidence nodes removed, only the connected
+		component of the target matters - every other factor is
+		a constant which disappears when the answer is normalized.
+
+Evidence nodes which are still needed as parents of a kept node,
+but whose own cpt is irrelevant, become roots with a uniform cpt.
+The posterior of the target given the evidence is the same in the
+pruned network as in the original one.
+
+References
+----------
+[1] Koller, Friedman (2009). "Probabilistic Graphical Models."
+	Section 9.3.2
+[2] Baker, Boult (1990). "Pruning Bayesian Networks for
+	Efficient Computation."
+
+"""
+
+__author__ = """Nicholas Cullen <ncullen.th@dartmouth.edu>"""
+
+def relevant_nodes(bn, target, evidence=[]):
+	"""
+	Find the nodes whose cpts are needed to answer a query.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string or a list of strings
+
+	*evidence* : a list of rvs (or a dict whose keys are rvs)
+		with observed values. An observed target is treated as
+		unobserved here, so it always stays in the result - the
+		query still sets it to its observed value.
+
+	Returns
+	-------
+	*factor_nodes* : a list of rvs, in bn.nodes() order, whose
+		cpts are needed
+
+	*evidence_roots* : a list of evidence rvs, in bn.nodes()
+		order, which are needed only as parents of a node in
+		*factor_nodes*
+	"""
+	if not isinstance(target, (list, tuple, set)):
+		target = [target]
+	evidence = set(evidence) - set(target)
+
+	# ancestral set of target and evidence
+	anc = set()
+	stack = list(target) + list(evidence)
+	while stack:
+		rv = stack.pop()
+		if rv not in anc:
+			anc.add(rv)
+			stack.extend(bn.parents(rv))
+
+	# moral graph of the ancestral set without evidence nodes
+	adj = dict([(rv, set()) for rv in anc if rv not in evidence])
+	for rv in anc:
+		family = [p for p in bn.parents(rv) if p not in evidence]
+		if rv not in evidence:
+			family.append(rv)
+		for a in family:
+			adj[a].update(family)
+
+	# connected component of the target
+	comp = set()
+	stack = list(target)
+	while stack:
+		rv = stack.pop()
+		if rv not in comp:
+			comp.add(rv)
+			stack.extend(adj[rv])
+
+	factor_nodes = []
+	scope_nodes = set()
+	for rv in bn.nodes():
+		if rv in anc and (rv in comp or (rv in evidence and \
+				any([p in comp for p in bn.parents(rv)]))):
+			factor_nodes.append(rv)
+			scope_nodes.update(bn.scope(rv))
+	factored = set(factor_nodes)
+	evidence_roots = [rv for rv in bn.nodes()
+		if rv in scope_nodes and rv not in factored]
+	return factor_nodes, evidence_roots
+
+def prune_network(bn, target, evidence=[]):
+	"""
+	Return a new BayesNet which contains only the nodes
+	needed to answer P(target | evidence) - see
+	relevant_nodes(). If nothing can be pruned, *bn*
+	itself is returned.
+
+	Arguments
+	---------
+	*bn* : a BayesNet object
+
+	*target* : a string or a list of strings
+
+	*evidence* : a list of rvs (or a dict whose keys are rvs)
+		with observed values
+
+	Returns
+	-------
+	*pruned_bn* : a BayesNet object
+
+	Notes
+	-----
+	- The values list of every kept node, and the cpt list of
+		every kept node which is not an evidence root, is the
+		same list object as in *bn* - not a copy - so do not
+		edit them in place. V, E, F and the parents lists are
+		new, and evidence roots get a new uniform cpt.
+	"""
+	from pyBN.classes.bayesnet import BayesNet
+	factor_nodes, evidence_roots = relevant_nodes(bn, target, evidence)
+	if len(factor_nodes) == bn.num_nodes():
+		return bn
+	keep = set(factor_nodes) | set(evidence_roots)
+
+	pruned = BayesNet()
+	pruned.V = [rv for rv in bn.nodes() if rv in keep]
+	pruned.E = dict([(rv, []) for rv in pruned.V])
+	pruned.F = {}
+	for rv in pruned.V:
+		if rv in evidence_roots:
+			pruned.F[rv] = {'parents': [],
+				'values': bn.values(rv),
+				'cpt': [1./bn.card(rv)]*bn.card(rv)}
+		else:
+			pruned.F[rv] = {'parents': list(bn.parents(rv)),
+				'values': bn.values(rv),
+				'cpt': bn.cpt(rv)}
+			for p in bn.parents(rv):
+				pruned.E[p].append(rv)
+	return pruned